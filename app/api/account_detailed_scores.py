@@ -1,6 +1,5 @@
 import urllib.parse
-
-from boto3.dynamodb.conditions import Key
+from concurrent.futures import ThreadPoolExecutor
 
 from lib.authz import require_can_read_account
 from lib.dynamodb import accounts_table, scores_table
@@ -9,6 +8,18 @@ from lib.lambda_decorator.email_decorator import email_decorator
 from lib.lambda_decorator.exceptions import HttpInvalidException, HttpNotFoundException
 from lib.lambda_decorator.scan_id_decorator import get_scan_id_decorator
 
+MAX_WORKERS = 16
+
+
+def get_requirements_scores(scan_id, account_id):
+    """
+    :param scan_id: scan to get the scores of
+    :param account_id: account to get the scores of
+    :return: list of requirementId and score for every requirement scored for the account
+    """
+    to_parse = scores_table.get_account_scores(scan_id, account_id)
+    return [{'requirementId': item['requirementId'], 'score': item['score']} for item in to_parse]
+
 
 @api_decorator
 @email_decorator
@@ -26,29 +37,23 @@ def account_detailed_scores_handler(event, context):
     except KeyError:
         raise HttpInvalidException('account ids or scan id not found in request')
 
-    accounts = []
-    account_ids = urllib.parse.unquote(account_ids).split(',')
+    account_ids = [account_id for account_id in urllib.parse.unquote(account_ids).split(',') if len(account_id) > 0]
     require_can_read_account(event['userRecord'], account_ids)
 
+    account_records = accounts_table.get_accounts(account_ids)
     for account_id in account_ids:
-        try:
-            account_name = accounts_table.get_account(account_id).get('account_name', account_id)
-        except KeyError:
+        if account_id not in account_records:
             raise HttpNotFoundException(f'account record not found for {account_id}')
 
-        if len(account_id) > 0:
-            detailed_score = {
-                'accountId': account_id,
-                'accountName': account_name,
-            }
-            requirements = []
-            to_parse = scores_table.query_all(
-                KeyConditionExpression=Key('scanId').eq(scan_id) & Key('accntId_rqrmntId').begins_with(account_id),
-            )
-            for item in to_parse:
-                requirements.append({'requirementId': item['requirementId'], 'score': item['score']})
-
-            detailed_score['requirementsScores'] = requirements
-            accounts.append(detailed_score)
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(account_ids)) or 1) as executor:
+        requirements_scores = executor.map(lambda account_id: get_requirements_scores(scan_id, account_id), account_ids)
+
+    accounts = [
+        {
+            'accountId': account_id,
+            'accountName': account_records[account_id].get('account_name', account_id),
+            'requirementsScores': requirements,
+        } for account_id, requirements in zip(account_ids, requirements_scores)
+    ]
 
     return {'accounts': accounts}
@@ -1,6 +1,8 @@
 import datetime
 import os
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
 
 from boto3.dynamodb.conditions import Key
 
@@ -17,17 +19,37 @@ PREFIX = os.environ.get('SCORECARD_PREFIX')
 MONDAY = 0
 HISTORICAL_SCORE_COUNT = 6
 CRITICAL_SEVERITY = 'critical'
+# newest record is the current score, followed by enough days to contain HISTORICAL_SCORE_COUNT mondays
+HISTORY_RECORD_LIMIT = HISTORICAL_SCORE_COUNT * 7 + 1
+MAX_WORKERS = 16
 
-def make_account_object(account_id):
+
+def get_scores_from_history(history: dict) -> Tuple[Optional[int], Optional[int], list]:
+    """
+    :param history: the account's score history rollup record
+    :return: current score, critical count and historical scores
+    """
+    if not history.get('daily'):
+        return None, None, []
+    current = history['daily'][0]
+    historical_scores = [
+        {'date': entry['date'], 'score': entry['score']}
+        for entry in history.get('weekly', []) if entry['date'] < current['date']
+    ][:HISTORICAL_SCORE_COUNT]
+    return current['score'], current['criticalCount'], historical_scores
+
+
+def get_scores_from_records(account_id) -> Tuple[Optional[int], Optional[int], list]:
     """
+    Fallback for accounts without a score history rollup, reads the most recent daily account scores
     :param account_id: the account_id of the required score summary
-    :return: for each account specified, returns historical score, current score, accountName and
-             Download link to latest spreadsheet (presigned s3 url)
+    :return: current score, critical count and historical scores
     """
-    accountscores_records = account_scores_table.query_all(
-        KeyConditionExpression=Key('accountId').eq(account_id),
-        ScanIndexForward=False
-    )
+    accountscores_records = account_scores_table.query(
+        KeyConditionExpression=Key('accountId').eq(account_id) & Key('date').lt(account_scores_table.HISTORY),
+        ScanIndexForward=False,
+        Limit=HISTORY_RECORD_LIMIT
+    ).get('Items') or []
 
     historical_scores = []
 
@@ -45,15 +67,25 @@ def make_account_object(account_id):
         current_score = None
         critical_count = None
 
-    try:
-        account_name = accounts_table.get_item(
-            Key={'accountId': account_id})['Item'].get('account_name', account_id)
-    except KeyError:
-        raise HttpNotFoundException(f'account record not found for {account_id}')
+    return current_score, critical_count, historical_scores
+
+
+def make_account_object(account_id, account_record, history=None):
+    """
+    :param account_id: the account_id of the required score summary
+    :param account_record: the account's record from the accounts table
+    :param history: the account's score history rollup record, if there is one
+    :return: for each account specified, returns historical score, current score, accountName and
+             Download link to latest spreadsheet (presigned s3 url)
+    """
+    if history:
+        current_score, critical_count, historical_scores = get_scores_from_history(history)
+    else:
+        current_score, critical_count, historical_scores = get_scores_from_records(account_id)
 
     return {
         'accountId': account_id,
-        'accountName': account_name,
+        'accountName': account_record.get('account_name', account_id),
         'currentScore': current_score,
         'criticalCount': critical_count,
         'historicalScores': historical_scores,
@@ -85,6 +117,18 @@ def account_summary_handler(event, context=None):
     account_ids = urllib.parse.unquote(account_ids).split(',')
     require_can_read_account(event['userRecord'], account_ids)
 
+    account_records = accounts_table.get_accounts(account_ids)
+    for account_id in account_ids:
+        if account_id not in account_records:
+            raise HttpNotFoundException(f'account record not found for {account_id}')
+    histories = account_scores_table.get_histories(account_ids)
+
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(account_ids)) or 1) as executor:
+        accounts = list(executor.map(
+            lambda account_id: make_account_object(account_id, account_records[account_id], histories.get(account_id)),
+            account_ids
+        ))
+
     return {
-        'accounts': [make_account_object(account_id) for account_id in account_ids]
+        'accounts': accounts
     }
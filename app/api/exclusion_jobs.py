@@ -0,0 +1,210 @@
+"""
+Jobs applying wildcard exclusions to the latest scan, implementing GET /exclusions/jobs/{jobId}.
+
+Wildcard exclusions can match the ncrs of every account, too many to rescore within the api timeout.
+Changing one starts a job instead: a worker is invoked asynchronously for each partition key of the scan,
+applying the exclusions to the ncrs under it and rescoring them (the ncrs and scores of an account are all
+under one partition key). A scan with a single partition key is split by account instead. Each worker adds
+its counts to the job record, which is polled for progress. Workers that fail without recording it (timed out,
+out of memory, throttled) are counted by exclusion_job_failure_handler, their OnFailure destination.
+
+Exclusions expiring between scans are swept the same way on a schedule, see expire_exclusions_handler.
+"""
+import json
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+from lib import authz
+from lib.dynamodb import config_table, exclusions_table, scans_table
+from lib.exclusions import exclusions as exclusions_lib
+from lib.lambda_decorator.decorator import api_decorator, states_decorator
+from lib.lambda_decorator.email_decorator import email_decorator
+from lib.lambda_decorator.exceptions import HttpNotFoundException
+from lib.logger import logger
+from states import rescore
+
+EXCLUSION_JOB_FUNCTION = os.getenv('EXCLUSION_JOB_FUNCTION')
+HIDDEN_FIELDS = ['scan', 'scanId', 'ttl']
+EXPIRING_STATUSES = [exclusions_lib.APPROVED, exclusions_lib.INITIAL]  # statuses of exclusions that can be effective
+SWEEPER = 'exclusionSweeper'  # creator of the exclusion jobs started by the sweep
+ACCOUNTS_PER_WORKER = 50  # accounts a worker rescores when the scan has a single partition key
+
+lambda_client = boto3.client('lambda')
+
+
+def start_exclusion_job(scan_id: str, exclusions: List[dict], created_by: Optional[str] = None) -> dict:
+    """
+    Record a job applying the exclusions to the scan and invoke a worker per work item, see get_work_items
+
+    :return: the job, as returned by the api
+    """
+    job = scans_table.create_exclusion_job(scan_id, exclusions, get_work_items(scan_id, exclusions), created_by)
+    for work_item in job['workItems']:
+        try:
+            lambda_client.invoke(
+                FunctionName=EXCLUSION_JOB_FUNCTION,
+                InvocationType='Event',
+                Payload=json.dumps({'jobId': job['jobId'], **work_item}).encode('utf-8'),
+            )
+        except ClientError as err:
+            logger.warning('Unable to start exclusion job %s for %s: %s', job['jobId'], describe_work_item(work_item), err)
+            job = scans_table.add_exclusion_job_progress(job['jobId'], error=f'{describe_work_item(work_item)}: unable to start')
+    logger.info('Started exclusion job %s over %d partitions of scan %s', job['jobId'], len(job['workItems']), scan_id)
+    return format_job(job)
+
+
+def get_work_items(scan_id: str, exclusions: List[dict]) -> List[dict]:
+    """
+    :return: a work item per partition key of the scan holding ncrs the exclusions can match. A scan with a single
+    partition key is split into work items of ACCOUNTS_PER_WORKER accounts, rather than left to a single worker
+    """
+    partition_keys = rescore.get_partition_keys(scan_id, exclusions)
+    if partition_keys != [scan_id]:
+        return [{'partitionKey': partition_key} for partition_key in partition_keys]
+    account_ids = rescore.get_account_ids(exclusions)
+    return [
+        {'partitionKey': scan_id, 'accountIds': account_ids[index:index + ACCOUNTS_PER_WORKER]}
+        for index in range(0, len(account_ids), ACCOUNTS_PER_WORKER)
+    ]
+
+
+def describe_work_item(work_item: dict) -> str:
+    """Work item as named in the errors of a job"""
+    if work_item.get('accountIds'):
+        return f'{work_item["partitionKey"]} accounts {work_item["accountIds"][0]}-{work_item["accountIds"][-1]}'
+    return work_item['partitionKey']
+
+
+def format_job(job: dict) -> dict:
+    return {key: value for key, value in job.items() if key not in HIDDEN_FIELDS}
+
+
+@api_decorator
+@email_decorator
+def get_exclusion_job_handler(event, context):
+    """
+    :param event: {
+      "pathParameters": {
+        "jobId": string,
+      }
+    }
+    """
+    authz.require_is_admin(event.get('userRecord'))
+    job_id = (event.get('pathParameters') or {}).get('jobId', '')
+    job = scans_table.get_exclusion_job(job_id) if job_id else {}
+    if not job:
+        raise HttpNotFoundException(f'Exclusion job {job_id} not found')
+    return format_job(job)
+
+
+@states_decorator
+def exclusion_job_worker_handler(event, context):
+    """
+    Applies the exclusions of a job to the ncrs of one work item of its scan, and counts the work item as done.
+    Errors are recorded on the job rather than raised, so a failed work item is not retried and counted twice.
+
+    Expected input event format
+    {
+        "jobId": job_id,
+        "partitionKey": partition_key,
+        "accountIds": account ids, only the ncrs of these accounts under the partition key (optional)
+    }
+    """
+    job = scans_table.get_exclusion_job(event['jobId'])
+    if not job:
+        logger.error('Exclusion job %s not found', event['jobId'])
+        return {}
+    try:
+        exclusion_types = config_table.get_config(config_table.EXCLUSIONS)
+        result = rescore.rescore_exclusions(
+            job['rescoreScanId'], job['exclusions'], exclusion_types, partition_key=event['partitionKey'], account_ids=event.get('accountIds')
+        )
+    except Exception as err: # pylint: disable=broad-except
+        logger.exception('Exclusion job %s failed for %s', event['jobId'], describe_work_item(event))
+        job = scans_table.add_exclusion_job_progress(event['jobId'], error=f'{describe_work_item(event)}: {err}')
+    else:
+        job = scans_table.add_exclusion_job_progress(event['jobId'], ncrs=result.ncrs, scores=result.scores)
+    return {'jobId': job['jobId'], 'processState': job['processState']}
+
+
+@states_decorator
+def exclusion_job_failure_handler(event, context):
+    """
+    OnFailure destination of the worker. Counts the work item of a worker that failed without recording it,
+    e.g. timed out or ran out of memory, or whose invocation expired before it ran, as failed so the job completes.
+
+    Expected input event format
+    {
+        "requestContext": {"condition": "RetriesExhausted" or "EventAgeExceeded", ...},
+        "requestPayload": the worker's event,
+        "responsePayload": {"errorMessage": error, ...}, when the worker ran
+    }
+    """
+    work_item = event['requestPayload']
+    error = (event.get('responsePayload') or {}).get('errorMessage') or event['requestContext']['condition']
+    logger.error('Exclusion job %s worker failed for %s: %s', work_item['jobId'], describe_work_item(work_item), error)
+    job = scans_table.add_exclusion_job_progress(work_item['jobId'], error=f'{describe_work_item(work_item)}: {error}')
+    return {'jobId': job['jobId'], 'processState': job['processState']}
+
+
+@states_decorator
+def expire_exclusions_handler(event, context):
+    """
+    Scheduled sweep applying the exclusions that expired since the last sweep to the ncrs and scores of the latest scan.
+    Expiration is otherwise only evaluated by the Exclude step of the next scan. Exclusions expire at the start of their
+    expirationDate, so those expired by the day a scan ran were applied by its Exclude step and are not swept again.
+    Wildcard exclusions are applied by an exclusion job, the others within the sweep. A sweep whose job fails is
+    not counted, the next sweep applies its exclusions again.
+    """
+    scan_id = scans_table.get_latest_complete_scan()
+    if not scan_id:
+        logger.info('No completed scan to apply expired exclusions to')
+        return {}
+    today = datetime.now().strftime('%Y/%m/%d')
+    swept_date = get_swept_date(scan_id, scans_table.get_exclusion_sweep())
+    if swept_date >= today:
+        logger.info('Exclusions expired by %s already applied to scan %s', swept_date, scan_id)
+        return {'scanId': scan_id, 'sweptDate': swept_date, 'expired': 0}
+
+    expired_from = (datetime.strptime(swept_date, '%Y/%m/%d') + timedelta(days=1)).strftime('%Y/%m/%d')
+    expired = get_expired_exclusions(expired_from, today)
+    logger.info('Applying %d exclusions expired from %s to %s to scan %s', len(expired), expired_from, today, scan_id)
+    job = None
+    if expired:
+        wildcard_exclusions = [exclusion for exclusion in expired if exclusions_lib.is_wildcard_exclusion(exclusion)]
+        other_exclusions = [exclusion for exclusion in expired if not exclusions_lib.is_wildcard_exclusion(exclusion)]
+        if wildcard_exclusions:
+            job = start_exclusion_job(scan_id, wildcard_exclusions, SWEEPER)
+        if other_exclusions:
+            rescore.rescore_exclusions(scan_id, other_exclusions, config_table.get_config(config_table.EXCLUSIONS))
+    if job and job['partitionsFailed']:
+        logger.warning('Exclusion job %s failed to start for %d partitions, not recording the sweep', job['jobId'], job['partitionsFailed'])
+        return {'scanId': scan_id, 'sweptDate': swept_date, 'expired': len(expired), 'jobId': job['jobId']}
+    # not recorded if rescoring failed, so the next sweep retries
+    scans_table.set_exclusion_sweep(scan_id, today, job['jobId'] if job else None, swept_date)
+    return {'scanId': scan_id, 'sweptDate': today, 'expired': len(expired), 'jobId': job['jobId'] if job else None}
+
+
+def get_swept_date(scan_id: str, sweep: dict) -> str:
+    """
+    :param sweep: the last sweep, see scans_table.set_exclusion_sweep
+    :return: date (YYYY/MM/DD) the exclusions expired by have been applied to the scan, the date before the last sweep if its job failed
+    """
+    if sweep.get('rescoreScanId') != scan_id:
+        return scan_id[0:10].replace('-', '/')
+    if sweep.get('jobId') and scans_table.get_exclusion_job(sweep['jobId']).get('processState') == scans_table.ERRORED:
+        logger.warning('Exclusion job %s of the last sweep failed, sweeping again from %s', sweep['jobId'], sweep['previousSweptDate'])
+        return sweep['previousSweptDate']
+    return sweep['sweptDate']
+
+
+def get_expired_exclusions(expired_from: str, expired_to: str) -> List[dict]:
+    """:return: exclusions that were effective until they expired between the dates, both included"""
+    return [
+        exclusion for status in EXPIRING_STATUSES
+        for exclusion in exclusions_table.query_by_expiration(exclusions_table.STATUS_INDEX, status, expiring_between=(expired_from, expired_to))
+    ]
@@ -1,7 +1,16 @@
+import heapq
 import json
-from lib import base64
+from datetime import datetime
+from functools import reduce
+from operator import and_
+from typing import Iterator, Optional, Tuple
+
+from boto3.dynamodb.conditions import Attr, ConditionBase
+
+from api import exclusion_jobs
 from lib import authz
 from lib import ncr_util
+from lib import pagination
 from lib.logger import logger
 from lib.dict_merge import dict_merge
 from lib.lambda_decorator.email_decorator import email_decorator
@@ -10,41 +19,191 @@ from lib.lambda_decorator import exceptions
 from lib.lambda_decorator.scan_id_decorator import get_scan_id_decorator
 from lib.dynamodb import exclusions_table, audit_table, ncr_table, requirements_table, config_table
 from lib.exclusions import exclusions
+from states import rescore
 from states.exclude import update_ncr_exclusion
 
+DEFAULT_LIMIT = 1000  # exclusions returned by a filtered query without a limit
+EXCLUSION_STATES = [
+    exclusions.INITIAL,
+    exclusions.APPROVED,
+    exclusions.APPROVED_PENDING_CHANGES,
+    exclusions.REJECTED,
+    exclusions.ARCHIVED,
+]
+STORED_STATUSES = {state: state for state in EXCLUSION_STATES}
+STORED_STATUSES[exclusions.APPROVED_PENDING_CHANGES] = exclusions.APPROVED
+UNDATED = 'undated'  # position of a page among the exclusions without an expirationDate, listed after the indexed ones
+
+
 @api_decorator
 @email_decorator
 def get_exclusions_handler(event, context):
+    """
+    Lists exclusions, optionally filtered by status (exclusion state), accountId, requirementId and expiringBefore.
+    Filtered exclusions are queried from the index of the most selective filter and returned in order of
+    expirationDate (ascending unless order is desc). Exclusions without an expirationDate are not indexed, they are
+    scanned for once the indexed ones are listed, unless expiringBefore is given.
+    The exclusions of an accountId include the exclusions of all accounts ('*'), as they apply to it too.
+    Without filters, or while the index of the filter is not created yet, the table is scanned.
+    At most limit exclusions are returned, with a nextToken to get the following ones.
+    """
     authz.require_is_admin(event.get('userRecord'))
-    scan_params = {}
+    multivalue_querystring_parameters = event.get('multiValueQueryStringParameters') or {}
     querystring_parameters = event.get('queryStringParameters') or {}
-    try:
-        next_token = querystring_parameters.get('nextToken')
-        if next_token:
-            scan_params['ExclusiveStartKey'] = json.loads(base64.base64_to_string(next_token))
-    except Exception: # pylint: disable=broad-except
-        pass
-    try:
-        limit = querystring_parameters.get('limit')
-        if limit:
-            scan_params['Limit'] = int(limit)
-    except Exception: # pylint: disable=broad-except
-        pass
+    states = [state for value in multivalue_querystring_parameters.get('status', []) for state in value.split(',') if state]
+    account_id = querystring_parameters.get('accountId')
+    requirement_id = querystring_parameters.get('requirementId')
+    expiring_before = querystring_parameters.get('expiringBefore')
+    order = querystring_parameters.get('order') or 'asc'
+    limit = pagination.parse_limit(querystring_parameters.get('limit'))
+    next_token = querystring_parameters.get('nextToken')
 
-    result = exclusions_table.scan(**scan_params)
-    exclusions = result['Items']
-    for exclusion in exclusions:
-        exclusion['exclusionId'] = exclusions_table.get_exclusion_id(exclusion)
-    last_evaluated_key = None
-    if 'LastEvaluatedKey' in result:
-        last_evaluated_key = base64.string_to_base64(json.dumps(result['LastEvaluatedKey']))
+    invalid_states = set(states) - set(EXCLUSION_STATES)
+    if invalid_states:
+        raise exceptions.HttpInvalidException(f'Invalid status: {", ".join(sorted(invalid_states))}')
+    if expiring_before and not is_exclusion_date(expiring_before):
+        raise exceptions.HttpInvalidException('expiringBefore must be a date formatted YYYY/MM/DD')
+    if order not in ['asc', 'desc']:
+        raise exceptions.HttpInvalidException('order must be asc or desc')
 
+    # approved and approvedPendingChanges exclusions are both stored with the approved status
+    stored_statuses = list(dict.fromkeys(STORED_STATUSES[state] for state in states or EXCLUSION_STATES))
+    account_ids = list(dict.fromkeys([account_id, '*'])) if account_id else []
+    if account_id and exclusions_table.has_index(exclusions_table.ACCOUNT_INDEX):
+        index_name, partition_values = exclusions_table.ACCOUNT_INDEX, account_ids
+    elif requirement_id and exclusions_table.has_index(exclusions_table.REQUIREMENT_INDEX):
+        index_name, partition_values = exclusions_table.REQUIREMENT_INDEX, [requirement_id]
+    elif (states or expiring_before) and not (account_id or requirement_id):
+        index_name, partition_values = exclusions_table.STATUS_INDEX, stored_statuses
+    else:
+        index_name, partition_values = None, []
+
+    filters = []
+    if account_id and index_name != exclusions_table.ACCOUNT_INDEX:
+        filters.append(Attr('accountId').is_in(account_ids))
+    if requirement_id and index_name != exclusions_table.REQUIREMENT_INDEX:
+        filters.append(Attr('requirementId').eq(requirement_id))
+    if index_name:
+        query_parameters = {'FilterExpression': reduce(and_, filters)} if filters else {}
+        position = parse_next_token(next_token, index_name, partition_values, order) if next_token else {}
+        exclusion_records, next_position = query_exclusions(
+            index_name, partition_values, expiring_before, order, states, limit or DEFAULT_LIMIT, position, query_parameters
+        )
+    else:
+        if states:
+            filters.append(Attr('status').is_in(stored_statuses))
+        if expiring_before:
+            filters.append(Attr('expirationDate').lt(expiring_before))
+        exclusion_records, next_position = scan_exclusions(limit, next_token, reduce(and_, filters) if filters else None)
+        exclusion_records = [exclusion for exclusion in exclusion_records if not states or exclusions.get_state(exclusion) in states]
+
+    for exclusion in exclusion_records:
+        exclusion['exclusionId'] = exclusions_table.get_exclusion_id(exclusion)
     return {
-        'exclusions': exclusions,
-        'nextToken': last_evaluated_key,
+        'exclusions': exclusion_records,
+        'nextToken': pagination.encode_token(next_position) if next_position else None,
     }
 
 
+def scan_exclusions(limit: Optional[int], next_token: Optional[str], filter_expression: Optional[ConditionBase] = None) -> Tuple[list, Optional[dict]]:
+    """
+    :param filter_expression: only return exclusions matching it, pages can then hold fewer than limit exclusions
+    :return: a page of exclusions in table order, and the position to continue from if there are more
+    """
+    scan_parameters: dict = {}
+    if next_token:
+        scan_parameters['ExclusiveStartKey'] = pagination.decode_token(next_token)
+    if limit:
+        scan_parameters['Limit'] = limit
+    if filter_expression:
+        scan_parameters['FilterExpression'] = filter_expression
+    result = exclusions_table.scan(**scan_parameters)
+    return result['Items'], result.get('LastEvaluatedKey')
+
+
+def query_exclusions(index_name: str, partition_values: list, expiring_before: Optional[str], order: str, states: list, limit: int,
+                     position: dict, query_parameters: dict) -> Tuple[list, Optional[dict]]:
+    """
+    Merges the exclusions of the index partitions in order of expirationDate, each partition being in that order already,
+    followed by the exclusions of the partitions without an expirationDate unless expiring_before is given.
+
+    :param states: exclusion states to keep, all if empty
+    :param position: position to continue from, as returned with the previous page, empty for the first page
+    :return: a page of exclusions, and the position to continue from if there are more
+    """
+    ascending = order == 'asc'
+    start_keys = position.get('keys', {})
+
+    def partition_exclusions(partition_value):
+        partition_query_parameters = {**query_parameters, 'Limit': limit + 1}
+        if start_keys.get(partition_value):
+            partition_query_parameters['ExclusiveStartKey'] = start_keys[partition_value]
+        for exclusion in exclusions_table.query_by_expiration(index_name, partition_value, expiring_before, ascending, **partition_query_parameters):
+            if not states or exclusions.get_state(exclusion) in states:
+                yield exclusion[exclusions_table.INDEX_SORT_KEY], partition_value, exclusion
+
+    last_keys = dict(start_keys)
+    exclusion_records: list = []
+    if UNDATED not in position:
+        merged = heapq.merge(
+            *[partition_exclusions(partition_value) for partition_value in partition_values], key=lambda entry: entry[0], reverse=not ascending
+        )
+        for _, partition_value, exclusion in merged:
+            if len(exclusion_records) >= limit:
+                return exclusion_records, {'index': index_name, 'order': order, 'keys': last_keys}
+            exclusion_records.append(exclusion)
+            last_keys[partition_value] = exclusions_table.get_index_key(index_name, exclusion)
+        if expiring_before:
+            return exclusion_records, None
+
+    undated_start_key = position.get(UNDATED)
+    for exclusion in scan_undated_exclusions(index_name, partition_values, states, undated_start_key, query_parameters):
+        if len(exclusion_records) >= limit:
+            return exclusion_records, {'index': index_name, 'order': order, 'keys': last_keys, UNDATED: undated_start_key}
+        exclusion_records.append(exclusion)
+        undated_start_key = {key: exclusion[key] for key in exclusions_table.TABLE_KEYS}
+    return exclusion_records, None
+
+
+def scan_undated_exclusions(index_name: str, partition_values: list, states: list, start_key: Optional[dict],
+                            query_parameters: dict) -> Iterator[dict]:
+    """
+    :param start_key: table key to continue after, None to start from the beginning
+    :return: exclusions of the index partitions missing from the index, as they have no expirationDate
+    """
+    filter_expression = Attr(exclusions_table.INDEX_SORT_KEY).not_exists() & Attr(exclusions_table.INDEX_PARTITION_KEYS[index_name]).is_in(partition_values)
+    if 'FilterExpression' in query_parameters:
+        filter_expression = filter_expression & query_parameters['FilterExpression']
+    scan_parameters = {'FilterExpression': filter_expression}
+    if start_key:
+        scan_parameters['ExclusiveStartKey'] = start_key
+    for exclusion in exclusions_table.scan_iter(**scan_parameters):
+        if not states or exclusions.get_state(exclusion) in states:
+            yield exclusion
+
+
+def parse_next_token(next_token: str, index_name: str, partition_values: list, order: str) -> dict:
+    """
+    :return: position to continue from, see query_exclusions
+    :raises HttpInvalidException: if the token was not returned for the same filters and order
+    """
+    position = pagination.decode_token(next_token)
+    start_keys = position.get('keys')
+    if position.get('index') != index_name or position.get('order') != order or not isinstance(start_keys, dict):
+        raise exceptions.HttpInvalidException('invalid nextToken')
+    if not set(start_keys) <= set(partition_values):
+        raise exceptions.HttpInvalidException('invalid nextToken')
+    return position
+
+
+def is_exclusion_date(value: str) -> bool:
+    try:
+        datetime.strptime(value, '%Y/%m/%d')
+    except ValueError:
+        return False
+    return True
+
+
 @api_decorator
 @email_decorator
 @get_scan_id_decorator
@@ -70,7 +229,8 @@ def put_exclusions_handler(event, context):
     delete_exclusion = current_exclusion if update_requires_replacement(current_exclusion, update_request) else {}
     requirement = requirements_table.get(requirement_id)
     exclusion_type = requirement.get('exclusionType')
-    exclusion_config = config_table.get_config(config_table.EXCLUSIONS).get(exclusion_type)
+    exclusion_types = config_table.get_config(config_table.EXCLUSIONS)
+    exclusion_config = exclusion_types.get(exclusion_type)
     logger.debug('%s', json.dumps({
         'current_exclusion': current_exclusion,
         'prospective_exclusion': prospective_exclusion,
@@ -105,9 +265,12 @@ def put_exclusions_handler(event, context):
             'deleteExclusion': delete_exclusion,
         })
 
+    rescore_job = rescore_latest_scan(event['scanId'], [new_exclusion, current_exclusion], exclusion_types, user_record.get('email'))
+
     return {
         'newExclusion': new_exclusion,
         'deleteExclusion': delete_exclusion,
+        'rescoreJob': rescore_job,
     }
 
 
@@ -177,6 +340,7 @@ def put_exclusions_for_user_handler(event, context):
     updated_ncr = update_ncr_exclusion(ncr, new_exclusion, exclusion_types)
     logger.debug('Updated ncr: %s', json.dumps(updated_ncr, default=str))
     ncr_table.put_item(Item=updated_ncr)
+    rescore_latest_scan(latest_scan_id, [new_exclusion], exclusion_types)
 
     return {
         'newExclusion': new_exclusion,
@@ -188,6 +352,24 @@ def put_exclusions_for_user_handler(event, context):
     }
 
 
+def rescore_latest_scan(scan_id: str, changed_exclusions: list, exclusion_types: dict, email: Optional[str] = None) -> Optional[dict]:
+    """
+    Applies changed exclusions to the ncrs and scores of the latest scan. Wildcard exclusions can match too many
+    ncrs to do so within the api timeout, they are applied by an exclusion job instead.
+    The exclusion change is already saved, so failing to rescore is logged rather than failing the request.
+
+    :return: the exclusion job started, if any
+    """
+    changed_exclusions = [exclusion for exclusion in changed_exclusions if exclusion]
+    try:
+        if any(exclusions.is_wildcard_exclusion(exclusion) for exclusion in changed_exclusions):
+            return exclusion_jobs.start_exclusion_job(scan_id, changed_exclusions, email)
+        rescore.rescore_exclusions(scan_id, changed_exclusions, exclusion_types)
+    except Exception: # pylint: disable=broad-except
+        logger.exception('Unable to rescore scan %s', scan_id)
+    return None
+
+
 def split_exclusion_id(exclusion_id: str) -> tuple:
     try:
         parts = exclusions_table.parse_exclusion_id(exclusion_id)
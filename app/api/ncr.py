@@ -1,18 +1,41 @@
 import json
-from boto3.dynamodb.conditions import Key
+from typing import Iterator, Optional, Tuple
 
-from lib import ncr_util, authz
+from boto3.dynamodb.conditions import Attr, Key
+
+from lib import ncr_util, authz, pagination
 from lib.logger import logger
+from lib.exclusions import exclusions, state_machine
 from lib.lambda_decorator.decorator import api_decorator
+from lib.lambda_decorator.exceptions import HttpInvalidException
 from lib.lambda_decorator.scan_id_decorator import get_scan_id_decorator
 from lib.lambda_decorator.email_decorator import email_decorator
 from lib.dynamodb import ncr_table, requirements_table
 
+TABLE_KEYS = ['scanId', 'accntId_rsrceId_rqrmntId']
+INDEX_KEYS = TABLE_KEYS + ['rqrmntId_accntId']
+# attributes needed to build the ncrId, allowedActions and nextToken of an ncr, whatever fields are requested
+# (exclusionId references the exclusion of ncrs that don't hold a copy of it, exclusionSnapshot keeps its state)
+REQUIRED_FIELDS = INDEX_KEYS + ['requirementId', 'exclusion', 'exclusionId', 'exclusionSnapshot']
+EXCLUSION_STATES = [
+    state_machine.States.start,
+    state_machine.States.initial,
+    state_machine.States.approved,
+    state_machine.States.approved_pending_changes,
+    state_machine.States.rejected,
+    state_machine.States.archived,
+]
+
 
 @api_decorator
 @email_decorator
 @get_scan_id_decorator
 def ncr_handler(event, context):
+    """
+    Lists the ncrs of the given accounts, optionally filtered by requirementId, severity, region and exclusionState.
+    When limit is given at most that many ncrs are returned, along with a nextToken to get the following ones.
+    The resource attributes returned can be restricted with a comma separated list of fields.
+    """
     scan_id = event['scanId']
     user = event['userRecord']
 
@@ -20,10 +43,19 @@ def ncr_handler(event, context):
     querystring_parameters = event.get('queryStringParameters') or {}
     account_ids = multivalue_querystring_parameters.get('accountId', [])
     requirement_id = querystring_parameters.get('requirementId', False)
+    severities = multivalue_querystring_parameters.get('severity', [])
+    regions = multivalue_querystring_parameters.get('region', [])
+    exclusion_states = multivalue_querystring_parameters.get('exclusionState', [])
+    fields = [field for field in (querystring_parameters.get('fields') or '').split(',') if field]
+    limit = pagination.parse_limit(querystring_parameters.get('limit'))
     logger.debug('Account Ids: %s', json.dumps(account_ids, default=str))
     logger.debug('Requirement ID: %s', json.dumps(requirement_id, default=str))
     authz.require_can_read_account(user, account_ids)
 
+    invalid_states = set(exclusion_states) - set(EXCLUSION_STATES)
+    if invalid_states:
+        raise HttpInvalidException(f'Invalid exclusionState: {", ".join(sorted(invalid_states))}')
+
     # get requirements
     if requirement_id:
         requirements = {
@@ -35,29 +67,95 @@ def ncr_handler(event, context):
         for requirement in all_requirements:
             requirements[requirement['requirementId']] = requirement
     logger.debug('Requirements: %s', json.dumps(requirements, default=str))
+    if severities:
+        requirements = {
+            key: requirement for key, requirement in requirements.items() if requirement.get('severity') in severities
+        }
+
+    query_parameters = {}
+    if regions:
+        query_parameters['FilterExpression'] = Attr('region').is_in(regions)
+    if fields:
+        projection = list(dict.fromkeys(REQUIRED_FIELDS + fields))
+        query_parameters['ProjectionExpression'] = ', '.join(f'#field{index}' for index in range(len(projection)))
+        query_parameters['ExpressionAttributeNames'] = {f'#field{index}': field for index, field in enumerate(projection)}
+    if limit:
+        # read one extra ncr to find out if there is a next page
+        query_parameters['Limit'] = limit + 1
+    key_names = INDEX_KEYS if isinstance(requirement_id, str) else TABLE_KEYS
+
+    start_account_id, exclusive_start_key = None, None
+    if querystring_parameters.get('nextToken'):
+        start_account_id, exclusive_start_key = parse_next_token(querystring_parameters['nextToken'], scan_id, account_ids, key_names)
+        account_ids = account_ids[account_ids.index(start_account_id):]
+
+    ncrs = iterate_ncrs(scan_id, account_ids, requirement_id, query_parameters, limit, start_account_id, exclusive_start_key)
+    allowed_actions_cache: dict = {}
+    ncr_records, next_token, last_position = [], None, None
+    for account_id, item in ncrs:
+        if item['requirementId'] not in requirements:
+            continue
+        if exclusion_states and exclusions.get_state(item.get('exclusion', {})) not in exclusion_states:
+            continue
+        if limit and len(ncr_records) >= limit:
+            next_token = pagination.encode_token(last_position)
+            break
+        last_position = {'accountId': account_id, 'key': {key: item[key] for key in key_names}}
+        ncr = prepare_allowed_actions_output(
+            initialize_output(scan_id, item), item, user, account_id, requirements[item['requirementId']], allowed_actions_cache
+        )
+        ncr_records.append(prepare_resource_output(ncr, item, fields))
+
+    return {'ncrRecords': ncr_records, 'nextToken': next_token}
+
+
+def iterate_ncrs(scan_id, account_ids, requirement_id, query_parameters, limit, start_account_id=None, exclusive_start_key=None) -> Iterator[Tuple[str, dict]]:
+    """
+    Yields (account id, ncr) for each account in turn. Pages are only read as they are consumed when a limit is given.
 
-    ncr_records, to_parse = [], []
+    :param query_parameters: additional query parameters, e.g. filter and projection
+    :param start_account_id: account to start from the exclusive_start_key in
+    """
     for account_id in account_ids:
+        partition_key = ncr_table.partition_key(scan_id, account_id)
         if isinstance(requirement_id, str):
-            to_parse = ncr_table.query_all(
-                IndexName='by-scanId',
-                KeyConditionExpression=Key('scanId').eq(scan_id) &
-                Key('rqrmntId_accntId').eq(
+            account_query_parameters = {
+                'IndexName': 'by-scanId',
+                'KeyConditionExpression': Key('scanId').eq(partition_key) & Key('rqrmntId_accntId').eq(
                     '{}#{}'.format(requirement_id, account_id)
-                )
-            )
+                ),
+                **query_parameters,
+            }
         else:
-            to_parse = ncr_table.query_all(
-                KeyConditionExpression=Key('scanId').eq(scan_id) &
-                Key('accntId_rsrceId_rqrmntId').begins_with(account_id)
-            )
-        logger.debug('To parse: %s', json.dumps(to_parse, default=str))
-
+            account_query_parameters = {
+                'KeyConditionExpression': Key('scanId').eq(partition_key) & Key('accntId_rsrceId_rqrmntId').begins_with(account_id),
+                **query_parameters,
+            }
+        if account_id == start_account_id and exclusive_start_key:
+            account_query_parameters['ExclusiveStartKey'] = exclusive_start_key
+
+        if limit:
+            to_parse = ncr_table.query_iter(**account_query_parameters)
+        else:
+            to_parse = ncr_table.query_all(**account_query_parameters)
         for item in to_parse:
-            ncr = prepare_allowed_actions_output(initialize_output(scan_id, item), item, user, account_id, requirements[item['requirementId']])
-            ncr_records.append(prepare_resource_output(ncr, item))
+            yield account_id, item
+
+
+def parse_next_token(next_token: str, scan_id: str, account_ids: list, key_names: list) -> Tuple[str, dict]:
+    """
+    :return: account id to continue from, and the key of the last ncr returned for it
+    :raises HttpInvalidException: if the token does not belong to this scan and these accounts
+    """
+    position = pagination.decode_token(next_token)
+    account_id = position.get('accountId')
+    key = position.get('key')
+    if account_id not in account_ids or not isinstance(key, dict) or sorted(key) != sorted(key_names):
+        raise HttpInvalidException('invalid nextToken')
+    if key['scanId'] != ncr_table.partition_key(scan_id, account_id):
+        raise HttpInvalidException('invalid nextToken')
+    return account_id, key
 
-    return {'ncrRecords': ncr_records}
 
 ##########
 ##-PREP-##
@@ -73,7 +171,7 @@ def initialize_output(scan_id, resource):
     """
     return {'ncrId': ncr_table.create_ncr_id(resource)}
 
-def prepare_allowed_actions_output(output, resource, user, account, requirement):
+def prepare_allowed_actions_output(output, resource, user, account, requirement, allowed_actions_cache: Optional[dict] = None):
     """
     Method to build the allowedActions section of the output.
 
@@ -82,28 +180,34 @@ def prepare_allowed_actions_output(output, resource, user, account, requirement)
     :param user: a dict representing the user which the dict is being built for.
     :param account: a string representing the account.
     :param requirement: a dict representing the requirement.
+    :param allowed_actions_cache: optional dict to reuse allowedActions across resources of the same user,
+                                  keyed by account, requirement and exclusion status.
 
     :returns dict: A dict combining the output parameter passed in and the generated allowedActions dict.
     """
-    output['allowedActions'] = ncr_util.get_allowed_actions(user, account, requirement, resource.get('exclusion', {}))
+    exclusion = resource.get('exclusion', {})
+    if allowed_actions_cache is None:
+        output['allowedActions'] = ncr_util.get_allowed_actions(user, account, requirement, exclusion)
+        return output
+
+    cache_key = (account, requirement['requirementId'], exclusion.get('status'), bool(exclusion.get('updateRequested')))
+    if cache_key not in allowed_actions_cache:
+        allowed_actions_cache[cache_key] = ncr_util.get_allowed_actions(user, account, requirement, exclusion)
+    output['allowedActions'] = allowed_actions_cache[cache_key]
     return output
 
-def prepare_resource_output(output, resource):
+def prepare_resource_output(output, resource, fields: Optional[list] = None):
     """
     Method to build the resource section of the output.
 
     :param output: The output to append the resource to.
     :param resource: a dict representing the resource to configure the id from.
+    :param fields: optional list of the resource attributes to include, all of them if not given.
 
     :returns dict: A dict combining the output parameter passed in and the generated resource dict.
     """
-    new_resource = dict(resource)
-    if 'scanId' in new_resource:
-        del new_resource['scanId']
-    if 'accntId_rsrceId_rqrmntId' in new_resource:
-        del new_resource['accntId_rsrceId_rqrmntId']
-    if 'rqrmntId_accntId' in new_resource:
-        del new_resource['rqrmntId_accntId']
-
-    output['resource'] = new_resource
+    if fields:
+        output['resource'] = {key: resource[key] for key in fields if key in resource and key not in INDEX_KEYS}
+    else:
+        output['resource'] = {key: value for key, value in resource.items() if key not in INDEX_KEYS}
     return output
@@ -31,10 +31,7 @@ def check_ncr(ncr_id):
         ncr_id_parts = ncr_table.parse_ncr_id(ncr_id)
     except: # pylint: disable=broad-except
         raise HttpInvalidException('invalid NCR ID')
-    ncr = ncr_table.get_item(Key={
-        'scanId': ncr_id_parts.scan_id,
-        'accntId_rsrceId_rqrmntId': ncr_id_parts.accntId_rsrceId_rqrmntId,
-    }).get('Item', False)
+    ncr = ncr_table.get_ncr(ncr_id_parts.scan_id, ncr_id_parts.account_id, ncr_id_parts.resource_id, ncr_id_parts.requirement_id)
     if not ncr:
         raise HttpNotFoundException(f'record for ncrId {ncr_id} not found')
     return ncr
@@ -2,13 +2,19 @@
 -file concerned with implementation of GET /scans
 -should return as many scans as possible starting from newest
 -return size must be capped at 6mb
+-further scans can be fetched by passing the returned nextToken, page size can be set with limit
 """
+from typing import Iterable, Optional, Tuple
+
 from boto3.dynamodb.conditions import Key
 
+from lib import pagination
 from lib.dynamodb import scans_table
 from lib.lambda_decorator.decorator import api_decorator, format_result
+from lib.lambda_decorator.exceptions import HttpInvalidException
 
 BYTE_LIMIT = 5000000
+RECORD_SEPARATOR = ', '  # json.dumps separator between list items
 
 
 def determine_bytes(target: dict) -> int:
@@ -22,18 +28,60 @@ def make_result(records: list) -> dict:
     return {'scans': records}
 
 
-def make_max_return(records: list, byte_limit: int) -> list:
-    count_bytes = determine_bytes(make_result(records))
-    while count_bytes > byte_limit:
-        records.pop()
-        count_bytes = determine_bytes(make_result(records))
-    return make_result(records)
+def cap_records(records: Iterable, byte_limit: int, limit: Optional[int] = None) -> Tuple[list, bool]:
+    """
+    Takes records in order for as long as the serialized result stays within byte_limit
+    (and within limit records, if given). Each record is serialized once and its size
+    added to a running total.
+
+    :return: the records that fit, and whether any records were left over
+    """
+    capped_records: list = []
+    count_bytes = determine_bytes(make_result([]))
+    for record in records:
+        record.pop('scan', None)
+        record_bytes = determine_bytes(record)
+        if capped_records:
+            record_bytes += len(RECORD_SEPARATOR)
+        if count_bytes + record_bytes > byte_limit or (limit and len(capped_records) >= limit):
+            return capped_records, True
+        count_bytes += record_bytes
+        capped_records.append(record)
+    return capped_records, False
+
+
+def make_max_return(records: list, byte_limit: int) -> dict:
+    capped_records, _ = cap_records(records, byte_limit)
+    return make_result(capped_records)
+
+
+def parse_next_token(next_token: str) -> dict:
+    try:
+        scan_id = pagination.decode_token(next_token)['scanId']
+    except KeyError:
+        raise HttpInvalidException('invalid nextToken')
+    return {'scan': scans_table.SCAN, 'scanId': scan_id}
+
+
+def make_next_token(record: dict) -> str:
+    return pagination.encode_token({'scanId': record['scanId']})
 
 
 @api_decorator
 def scans_handler(event, context):
-    records = scans_table.query_all(
-        KeyConditionExpression=Key('scan').eq(scans_table.SCAN),
-        ScanIndexForward=False
-    )
-    return make_max_return(records, BYTE_LIMIT)
+    querystring_parameters = event.get('queryStringParameters') or {}
+    limit = pagination.parse_limit(querystring_parameters.get('limit'))
+    query_parameters = {
+        'KeyConditionExpression': Key('scan').eq(scans_table.SCAN),
+        'ScanIndexForward': False,
+    }
+    if querystring_parameters.get('nextToken'):
+        query_parameters['ExclusiveStartKey'] = parse_next_token(querystring_parameters['nextToken'])
+    if limit:
+        # read one extra scan to find out if there is a next page without another query
+        query_parameters['Limit'] = limit + 1
+
+    records, has_more = cap_records(scans_table.query_iter(**query_parameters), BYTE_LIMIT, limit)
+    result = make_result(records)
+    result['nextToken'] = make_next_token(records[-1]) if has_more and records else None
+    return result
@@ -0,0 +1,63 @@
+"""
+Lookups of account records by account id, payer id, executive sponsor, scorecard profile and user,
+built in a single pass over the accounts (and users) so callers don't have to filter all accounts per lookup.
+"""
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+SPONSOR_FIELD = 'exec_sponsor_email'
+NO_SPONSOR_VALUE = 'No executive sponsor'
+PROFILE_FIELD = 'scorecard_profile'
+
+
+def get_sponsor(account: dict) -> str:
+    """Executive sponsor of the account, lower cased, or NO_SPONSOR_VALUE"""
+    if SPONSOR_FIELD in account and isinstance(account[SPONSOR_FIELD], str):
+        return account[SPONSOR_FIELD].lower()
+    return NO_SPONSOR_VALUE
+
+
+class AccountIndex():
+    def __init__(self, accounts: Iterable[dict], users: Optional[Iterable[dict]] = None):
+        """
+        :param accounts: account records, as in the accounts table
+        :param users: user records, as in the users table, only needed for lookups by user
+        """
+        self.accounts: Dict[str, dict] = {}
+        self.by_payer_id: Dict[str, List[dict]] = defaultdict(list)
+        self.by_sponsor: Dict[str, List[dict]] = defaultdict(list)
+        self.by_profile: Dict[str, List[dict]] = defaultdict(list)
+        for account in accounts:
+            self.accounts[account['accountId']] = account
+            if account.get('payer_id'):
+                self.by_payer_id[account['payer_id']].append(account)
+            self.by_sponsor[get_sponsor(account)].append(account)
+            if account.get(PROFILE_FIELD):
+                self.by_profile[account[PROFILE_FIELD]].append(account)
+
+        self.by_user: Dict[str, List[dict]] = {}
+        for user in users or []:
+            self.by_user[user['email']] = self.get_accounts(user.get('accounts', {}))
+
+    def get_account(self, account_id) -> Optional[dict]:
+        return self.accounts.get(account_id)
+
+    def get_accounts(self, account_ids: Iterable[str]) -> List[dict]:
+        """Accounts of the account ids, in their order, unknown account ids left out"""
+        return [self.accounts[account_id] for account_id in account_ids if account_id in self.accounts]
+
+    def payer_ids(self) -> List[str]:
+        return list(self.by_payer_id)
+
+    def get_payer_accounts(self, payer_id) -> List[dict]:
+        return self.by_payer_id.get(payer_id, [])
+
+    def get_sponsor_accounts(self, sponsor) -> List[dict]:
+        return self.by_sponsor.get(sponsor.lower() if sponsor != NO_SPONSOR_VALUE else sponsor, [])
+
+    def get_profile_accounts(self, profile) -> List[dict]:
+        return self.by_profile.get(profile, [])
+
+    def get_user_accounts(self, email) -> List[dict]:
+        """Accounts of a user, users are only known if the index was built with them"""
+        return self.by_user.get(email, [])
@@ -0,0 +1,148 @@
+"""
+The bootstrap document holds the parts of the user status response that are the same for every user
+(requirements, configuration, and for admins the users, accounts and payer accounts lists).
+It is built by the Load step of every scan and stored in the scorecard bucket, so GET /user/status does not
+have to scan the tables on every page load.
+"""
+import json
+import os
+from typing import Optional, Tuple
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from lib.account_index import AccountIndex
+from lib.dynamodb import user_table, requirements_table, accounts_table, config_table
+from lib.lambda_decorator.decorator import serializer
+from lib.logger import logger
+from lib.s3.s3_buckets import S3
+
+BUCKET = os.environ.get('SCORECARD_BUCKET')
+PREFIX = os.environ.get('SCORECARD_PREFIX')
+KEY = f'{PREFIX}/bootstrap.json'
+
+ADMIN_KEYS = ['usersList', 'accountList', 'payerAccounts']
+
+# last document read by this container, revalidated against s3 with its etag
+cached_bootstrap: dict = {'etag': None, 'document': None}
+
+
+def list_all_users(all_accounts):
+    """
+    :return: list composed of all users' email, first name, last name, and a list of accountIds associated
+    with that user
+    """
+    users = user_table.scan_all(ProjectionExpression='email, firstName, lastName, accounts')
+    for user in users:
+        user['accountList'] = [
+            {
+                'accountId': account,
+                'accountName': all_accounts.get(account, {}).get('account_name', '')
+            } for account in user.get('accounts', {}).keys()]
+        user.pop('accounts', None)
+    return users
+
+
+def create_account_list(accounts):
+    """
+    :param accounts: full contents of accounts table
+    :return: list composed of all accounts (just accountId) in accounts table
+    """
+    logger.debug('Creating account list')
+    return [
+        {
+            'accountId': account['accountId'],
+            'accountName': account.get('account_name', ''),
+        } for account in accounts.values()]
+
+
+def get_payer_accounts(account_index: AccountIndex):
+    """
+    :param account_index: index of the full contents of accounts table
+    :return: list of payer objects representing each unique payer id in accounts table
+    """
+    logger.debug('Getting payer accounts')
+    return [make_payer_object(payer_id, account_index) for payer_id in account_index.payer_ids()]
+
+
+def make_payer_object(payer_id, account_index: AccountIndex):
+    payer_account = account_index.get_account(payer_id)
+    return {
+        'id': payer_id,
+        'accountName': payer_account.get('account_name', '') if payer_account else 'not available',
+        'accountList': [
+            {'accountId': account['accountId'], 'accountName': account.get('account_name', '')}
+            for account in account_index.get_payer_accounts(payer_id)
+        ],
+    }
+
+
+def get_requirements():
+    """
+    :return: list of all requirements, with the parameters of their remediation
+    """
+    requirements = requirements_table.scan_all()
+    remediation_types = config_table.get_config(config_table.REMEDIATIONS)
+    for requirement in requirements:
+        if isinstance(requirement.get('remediation'), dict):
+            remediation_id = requirement['remediation'].get('remediationId')
+            remediation = remediation_types.get(remediation_id)
+            if remediation:
+                requirement['remediation']['parameters'] = remediation['parameters']
+    return requirements
+
+
+def build_bootstrap(include_admin=True, account_index: Optional[AccountIndex] = None) -> dict:
+    """
+    :param include_admin: whether to include the lists only returned to admins
+    :param account_index: index of all accounts, the accounts table is scanned if not given
+    :return: bootstrap document
+    """
+    document = {'requirements': get_requirements()}
+    exclusion_types = config_table.get_config('exclusions')
+    if exclusion_types:
+        document['exclusionTypes'] = exclusion_types
+    severity_colors = config_table.get_config('severityColors')
+    if severity_colors:
+        document['severityColors'] = severity_colors
+
+    if include_admin:
+        if account_index is None:
+            account_index = AccountIndex(accounts_table.scan_all())
+        document.update({
+            'usersList': list_all_users(account_index.accounts),
+            'accountList': create_account_list(account_index.accounts),
+            'payerAccounts': get_payer_accounts(account_index),
+        })
+    return document
+
+
+def save_bootstrap(document: dict) -> None:
+    S3.put_object(
+        Bucket=BUCKET,
+        Key=KEY,
+        Body=json.dumps(document, default=serializer).encode('utf-8'),
+        ContentType='application/json',
+    )
+
+
+def get_bootstrap() -> Tuple[Optional[dict], Optional[str]]:
+    """
+    :return: latest bootstrap document and its etag, or None, None if it is not available
+    """
+    kwargs = {'Bucket': BUCKET, 'Key': KEY}
+    if cached_bootstrap['etag']:
+        kwargs['IfNoneMatch'] = cached_bootstrap['etag']
+    try:
+        response = S3.get_object(**kwargs)
+    except ClientError as err:
+        if err.response.get('Error', {}).get('Code') == '304':
+            return cached_bootstrap['document'], cached_bootstrap['etag']
+        logger.warning('Unable to get bootstrap document: %s', err)
+        return None, None
+    except BotoCoreError as err:
+        logger.warning('Unable to get bootstrap document: %s', err)
+        return None, None
+
+    cached_bootstrap['document'] = json.loads(response['Body'].read())
+    cached_bootstrap['etag'] = response['ETag']
+    return cached_bootstrap['document'], cached_bootstrap['etag']
@@ -14,10 +14,12 @@ from .user import UserTable
 account_scores_table = AccountScoresTable(os.getenv('ACCOUNT_SCORES_TABLE', 'accountScores-table'), ttl=60)
 accounts_table = AccountsTable(os.getenv('ACCOUNTS_TABLE', 'accounts-table'))
 audit_table = AuditTable(os.getenv('AUDIT_TABLE', 'audit-table'))
-exclusions_table = ExclusionsTable(os.getenv('EXCLUSIONS_TABLE', 'exclusions-table'))
-ncr_table = NCRTable(os.getenv('NCR_TABLE', 'nonCompliantResources-table'), ttl=30)
+exclusions_table = ExclusionsTable(os.getenv('EXCLUSIONS_TABLE', 'exclusions-table'), indexes=int(os.getenv('EXCLUSIONS_INDEXES', '1')))
+scans_table = ScansTable(
+    os.getenv('SCANS_TABLE', 'scans-table'), ttl=30, cache_ttl=int(os.getenv('LATEST_SCAN_CACHE_TTL', '60')), shards=int(os.getenv('SCAN_SHARDS', '1'))
+)
+ncr_table = NCRTable(os.getenv('NCR_TABLE', 'nonCompliantResources-table'), ttl=30, scans_table=scans_table, exclusions_table=exclusions_table)
 requirements_table = RequirementsTable(os.getenv('REQUIREMENTS_TABLE', 'requirements-table'))
-scans_table = ScansTable(os.getenv('SCANS_TABLE', 'scans-table'), ttl=30)
-scores_table = ScoresTable(os.getenv('SCORES_TABLE', 'scores-table'), ttl=30)
-user_table = UserTable(os.getenv('USERS_TABLE', 'users-table'))
+scores_table = ScoresTable(os.getenv('SCORES_TABLE', 'scores-table'), ttl=30, scans_table=scans_table)
+user_table = UserTable(os.getenv('USERS_TABLE', 'users-table'), cache_ttl=int(os.getenv('USER_CACHE_TTL', '10')))
 config_table = ConfigTable(os.getenv('CONFIG_TABLE', 'config-table'))
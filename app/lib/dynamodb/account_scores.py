@@ -1,5 +1,64 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from lib.dynamodb.scores import ScoresTable
 from lib.dynamodb.table_base import TableBase
 
 
 class AccountScoresTable(TableBase):
-    pass
+    HISTORY = 'history'  # date key of the per account rollup of recent overall scores
+    DATE_FORMAT = '%Y-%m-%d'
+    MONDAY = 0
+    DAILY_HISTORY_COUNT = 7
+    # one more than shown, as the current score may itself be a monday
+    WEEKLY_HISTORY_COUNT = 7
+    CRITICAL_SEVERITY = 'critical'
+
+    def get_histories(self, account_ids: list) -> dict:
+        """
+        :param account_ids: accounts to get the score history rollup of
+        :return: dict of history rollup records found, keyed by account id
+        """
+        keys = [{'accountId': account_id, 'date': self.HISTORY} for account_id in dict.fromkeys(account_ids)]
+        return {history['accountId']: history for history in self.batch_get_items(keys)}
+
+    @classmethod
+    def make_history_entry(cls, account_score: dict) -> dict:
+        return {
+            'date': account_score['date'],
+            'scanId': account_score['scanId'],
+            'score': ScoresTable.get_single_score_calc(account_score['score']),
+            'criticalCount': account_score['score'].get(cls.CRITICAL_SEVERITY, {}).get('numFailing', 0),
+        }
+
+    def update_history(self, history: Optional[dict], account_score: dict) -> dict:
+        """
+        Adds an account score to the account's rolling window of daily and weekly (monday) overall scores.
+        An entry for the same date is replaced, entries that would have expired from the table are dropped.
+
+        :param history: current history rollup record of the account, if any
+        :param account_score: new account score record
+        :return: new history rollup record, newest entries first
+        """
+        entry = self.make_history_entry(account_score)
+        entry_date = datetime.strptime(entry['date'], self.DATE_FORMAT)
+        oldest_date = (entry_date - timedelta(days=self.ttl)).strftime(self.DATE_FORMAT) if self.ttl else ''
+
+        def recent(entries: list) -> list:
+            return [existing for existing in entries if existing['date'] != entry['date'] and existing['date'] >= oldest_date]
+
+        def add_entry(entries: list, count: int) -> list:
+            return sorted(entries + [entry], key=lambda existing: existing['date'], reverse=True)[:count]
+
+        history = history or {}
+        daily = add_entry(recent(history.get('daily', [])), self.DAILY_HISTORY_COUNT)
+        weekly = recent(history.get('weekly', []))
+        if entry_date.weekday() == self.MONDAY:
+            weekly = add_entry(weekly, self.WEEKLY_HISTORY_COUNT)
+
+        return {
+            'accountId': account_score['accountId'],
+            'date': self.HISTORY,
+            'daily': daily,
+            'weekly': weekly,
+        }
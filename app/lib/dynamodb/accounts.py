@@ -7,6 +7,15 @@ class AccountsTable(TableBase):
             Key={'accountId': account_id}
         )['Item']
 
+    def get_accounts(self, account_ids: list) -> dict:
+        """
+        Get several account records with batched reads
+
+        :param account_ids: account ids to get, duplicates are allowed
+        :return: dict of account records found, keyed by account id
+        """
+        keys = [{'accountId': account_id} for account_id in dict.fromkeys(account_ids)]
+        return {account['accountId']: account for account in self.batch_get_items(keys)}
 
     @staticmethod
     def normalize_account_record(account: dict):
@@ -1,6 +1,8 @@
 import json
 
-from typing import NamedTuple
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+from boto3.dynamodb.conditions import Key
 
 from lib.logger import logger
 from lib.lambda_decorator import exceptions
@@ -39,6 +41,48 @@ class ExclusionIdParts(NamedTuple):
 
 
 class ExclusionsTable(TableBase):
+    # indexes of exclusions by status, account and requirement, each sorted by expirationDate (exclusions without one are not indexed)
+    STATUS_INDEX = 'by-status'
+    ACCOUNT_INDEX = 'by-accountId'
+    REQUIREMENT_INDEX = 'by-requirementId'
+    INDEXES = [STATUS_INDEX, ACCOUNT_INDEX, REQUIREMENT_INDEX]  # in the order they are created, see ExclusionsIndexes in dynamodb.yaml
+    INDEX_PARTITION_KEYS = {STATUS_INDEX: 'status', ACCOUNT_INDEX: 'accountId', REQUIREMENT_INDEX: 'requirementId'}
+    INDEX_SORT_KEY = 'expirationDate'
+    TABLE_KEYS = ['accountId', 'rqrmntId_rsrceRegex']
+
+    def __init__(self, table_name, indexes=len(INDEXES)):
+        """
+        :param indexes: number of INDEXES created so far, indexes are created one per stack update
+        """
+        super().__init__(table_name)
+        self.indexes = self.INDEXES[:indexes]
+
+    def has_index(self, index_name: str) -> bool:
+        return index_name in self.indexes
+
+    def query_by_expiration(self, index_name: str, partition_value: str, expiring_before: Optional[str] = None, ascending: bool = True,
+                            expiring_between: Optional[Tuple[str, str]] = None, **kwargs) -> Iterator[dict]:
+        """
+        Exclusions of one partition of an index, in order of expirationDate. Pages are only read as they are consumed.
+
+        :param index_name: one of STATUS_INDEX, ACCOUNT_INDEX, REQUIREMENT_INDEX
+        :param partition_value: status, account id or requirement id of the exclusions
+        :param expiring_before: only exclusions expiring before this date, formatted like expirationDate (YYYY/MM/DD)
+        :param expiring_between: only exclusions expiring between these dates, both included, instead of expiring_before
+        :param kwargs: additional query parameters, e.g. FilterExpression or ExclusiveStartKey
+        """
+        key_condition = Key(self.INDEX_PARTITION_KEYS[index_name]).eq(partition_value)
+        if expiring_between:
+            key_condition = key_condition & Key(self.INDEX_SORT_KEY).between(*expiring_between)
+        elif expiring_before:
+            key_condition = key_condition & Key(self.INDEX_SORT_KEY).lt(expiring_before)
+        return self.query_iter(IndexName=index_name, KeyConditionExpression=key_condition, ScanIndexForward=ascending, **kwargs)
+
+    def get_index_key(self, index_name: str, exclusion: dict) -> dict:
+        """Key of an exclusion in an index, i.e. the ExclusiveStartKey continuing a query after it"""
+        key_names = list(dict.fromkeys([*self.TABLE_KEYS, self.INDEX_PARTITION_KEYS[index_name], self.INDEX_SORT_KEY]))
+        return {key_name: exclusion[key_name] for key_name in key_names}
+
     @staticmethod
     def get_exclusion_id(exclusion: dict) -> str:
         return '#'.join([exclusion.get('accountId', ''), exclusion.get('requirementId', ''), exclusion.get('resourceId', '')])
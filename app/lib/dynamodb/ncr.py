@@ -1,8 +1,16 @@
-from typing import Union, NamedTuple
+import copy
+import gzip
+from typing import Dict, Iterable, Optional, Union, NamedTuple
 
 from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.types import Binary
 
-from lib.dynamodb.table_base import TableBase
+from lib.dynamodb.sharded_scan import ShardedScanTable
+
+COMPRESSED_ATTRIBUTES = ['reason']  # text attributes stored gzipped once they reach COMPRESSION_MIN_LENGTH
+COMPRESSION_MIN_LENGTH = 1024
+# fields of the applied exclusion kept on the ncr next to its exclusionId, enough to tell the state of the exclusion
+EXCLUSION_SNAPSHOT_FIELDS = ['status', 'expirationDate', 'hidesResources', 'type']
 
 
 class NcrIdParts(NamedTuple):
@@ -21,12 +29,105 @@ class NcrIdParts(NamedTuple):
         return NCRTable.create_sort_key(self.account_id, self.resource_id, self.requirement_id)
 
 
-class NCRTable(TableBase):
+class NCRTable(ShardedScanTable):
     CLOUDSPLOIT_FINDING_NA = 'N/A'  # string in cloudsploit finding indicating no resource ID
     REMEDIATION_SUCCESS = 'Success'
     REMEDIATION_IN_PROGRESS = 'In Progress'
     REMEDIATION_ERROR = 'Error'
 
+    def __init__(self, table_name, ttl=None, scans_table=None, exclusions_table=None):
+        """
+        :param scans_table: see ShardedScanTable
+        :param exclusions_table: table the exclusions applied to ncrs are referenced in, exclusions are copied into ncrs without it
+        """
+        super().__init__(table_name, ttl=ttl, scans_table=scans_table)
+        self.exclusions_table = exclusions_table
+        self.resolve_exclusions = True
+
+    def without_exclusion_lookup(self) -> 'NCRTable':
+        """
+        The table reading the applied exclusions from their snapshot on the ncrs instead of looking them up,
+        for bulk readers only needing the state of the exclusions
+        """
+        table = copy.copy(self)
+        table.resolve_exclusions = False
+        return table
+
+    def encode_item(self, item: dict) -> dict:
+        """
+        Large text attributes are stored gzipped as binary, and the applied exclusion as the id of its record
+        in the exclusions table with a snapshot of its EXCLUSION_SNAPSHOT_FIELDS rather than a copy of it
+        """
+        encoded = dict(item)
+        for attribute in COMPRESSED_ATTRIBUTES:
+            value = encoded.get(attribute)
+            if isinstance(value, str) and len(value) >= COMPRESSION_MIN_LENGTH:
+                encoded[attribute] = Binary(gzip.compress(value.encode('utf-8')))
+        exclusion = encoded.get('exclusion')
+        if self.exclusions_table and isinstance(exclusion, dict) and exclusion.get('accountId') and exclusion.get('rqrmntId_rsrceRegex'):
+            encoded['exclusionId'] = f'{exclusion["accountId"]}#{exclusion["rqrmntId_rsrceRegex"]}'
+            encoded['exclusionSnapshot'] = {field: exclusion[field] for field in EXCLUSION_SNAPSHOT_FIELDS if field in exclusion}
+            del encoded['exclusion']
+        return encoded
+
+    def decode_items(self, items: list) -> list:
+        """
+        Decompresses text attributes and replaces exclusion ids with the exclusions, read in a single batch.
+        The snapshot on the ncr takes precedence over the current exclusion record, so the state of the exclusion
+        matches the one the ncr was scored with. The other fields, e.g. justification, come from the current record.
+        Exclusions not found, or not looked up (see without_exclusion_lookup), are rebuilt from their snapshot alone
+        """
+        exclusions = {}
+        if self.resolve_exclusions:
+            exclusions = self.get_exclusions({item['exclusionId'] for item in items if 'exclusionId' in item})
+        for item in items:
+            for attribute in COMPRESSED_ATTRIBUTES:
+                if isinstance(item.get(attribute), Binary):
+                    item[attribute] = gzip.decompress(item[attribute].value).decode('utf-8')
+            if 'exclusionId' in item:
+                exclusion_id = item.pop('exclusionId')
+                snapshot = item.pop('exclusionSnapshot', None)
+                exclusion = exclusions.get(exclusion_id, {})
+                if snapshot is not None:
+                    exclusion = {**exclusion, **self.exclusion_from_snapshot(exclusion_id, snapshot)}
+                item['exclusion'] = exclusion
+        return items
+
+    @staticmethod
+    def exclusion_from_snapshot(exclusion_id: str, snapshot: Optional[dict]) -> dict:
+        """
+        :param exclusion_id: '<accountId>#<rqrmntId_rsrceRegex>' of the exclusion
+        :param snapshot: EXCLUSION_SNAPSHOT_FIELDS of the exclusion, ncrs written before snapshots were kept have none
+        :return: the exclusion's keys and snapshot fields, empty without a snapshot
+        """
+        if snapshot is None:
+            return {}
+        account_id, requirement_resource = exclusion_id.split('#', 1)
+        requirement_id, resource_id = requirement_resource.split('#', 1)
+        return {
+            'accountId': account_id,
+            'requirementId': requirement_id,
+            'resourceId': resource_id,
+            'rqrmntId_rsrceRegex': requirement_resource,
+            **snapshot,
+        }
+
+    def get_exclusions(self, exclusion_ids: Iterable[str]) -> Dict[str, dict]:
+        """
+        :param exclusion_ids: '<accountId>#<rqrmntId_rsrceRegex>' of exclusions
+        :return: exclusions found, by id
+        """
+        keys = []
+        for exclusion_id in exclusion_ids:
+            account_id, requirement_resource = exclusion_id.split('#', 1)
+            keys.append({'accountId': account_id, 'rqrmntId_rsrceRegex': requirement_resource})
+        if not keys:
+            return {}
+        return {
+            f'{exclusion["accountId"]}#{exclusion["rqrmntId_rsrceRegex"]}': exclusion
+            for exclusion in self.exclusions_table.batch_get_items(keys)
+        }
+
     def update_remediation_status(self, ncr: dict, status: str, check_remediation_started=True) -> Union[bool, dict]:
         """
         update ncr with a field 'remediated' with string value
@@ -53,7 +154,7 @@ class NCRTable(TableBase):
     @staticmethod
     def create_ncr_id(ncr: dict) -> str:
         """NCR IDs uniquely identify an NCR, use so API only requires a single value"""
-        return f'{ncr["scanId"]}#{ncr["accntId_rsrceId_rqrmntId"]}'
+        return f'{NCRTable.get_scan_id(ncr["scanId"])}#{ncr["accntId_rsrceId_rqrmntId"]}'
 
     @staticmethod
     def parse_ncr_id(ncr_id: str) -> NcrIdParts:
@@ -62,18 +163,18 @@ class NCRTable(TableBase):
     def get_all_account_ncrs_by_requirement_id(self, scan_id: str, account_id: str, requirement_id: str) -> list:
         return self.query_all(
             IndexName='by-scanId',
-            KeyConditionExpression=Key('scanId').eq(scan_id) & Key('rqrmntId_accntId').eq(f'{requirement_id}#{account_id}')
+            KeyConditionExpression=Key('scanId').eq(self.partition_key(scan_id, account_id)) & Key('rqrmntId_accntId').eq(f'{requirement_id}#{account_id}')
         )
 
     def get_all_account_ncrs(self, scan_id: str, account_id: str) -> list:
         return self.query_all(
-            KeyConditionExpression=Key('scanId').eq(scan_id) & Key('accntId_rsrceId_rqrmntId').begins_with(account_id)
+            KeyConditionExpression=Key('scanId').eq(self.partition_key(scan_id, account_id)) & Key('accntId_rsrceId_rqrmntId').begins_with(account_id)
         )
 
     def get_ncr(self, scan_id: str, account_id: str, resource_id: str, requirement_id: str) -> dict:
         return self.get_item(
             Key={
-                'scanId': scan_id,
+                'scanId': self.partition_key(scan_id, account_id),
                 'accntId_rsrceId_rqrmntId': '#'.join([
                     account_id,
                     resource_id,
@@ -89,15 +190,14 @@ class NCRTable(TableBase):
     def create_gsi_sort_key(account_id, requirement_id):
         return f'{requirement_id}#{account_id}'
 
-    @staticmethod
-    def new_ncr_record(data: dict, scan_id: str) -> dict:
+    def new_ncr_record(self, data: dict, scan_id: str) -> dict:
         """
         :param data: dict containing k:v pairs representing ncr record
-        :param scan_id: str with scan_id to use as pk for ncr table
+        :param scan_id: str with scan_id to derive the pk for ncr table from
         :return: ncr record (dict)
         """
         new_items = {
-            'scanId': scan_id,
+            'scanId': self.partition_key(scan_id, data['accountId']),
             'accntId_rsrceId_rqrmntId': NCRTable.create_sort_key(data['accountId'], data['resourceId'], data['requirementId']),
             'rqrmntId_accntId': NCRTable.create_gsi_sort_key(data['accountId'], data['requirementId']),
         }
@@ -2,16 +2,33 @@ from datetime import datetime
 import json
 import random
 import string
+import uuid
+from typing import List, Optional
 
 from boto3.dynamodb.conditions import Attr, Key
 
 from lib.dynamodb.table_base import TableBase
+from lib.logger import logger
+from lib.ttl_cache import TTLCache
 
 class ScansTable(TableBase):
     SCAN = 'scan'
     COMPLETED = 'Completed'
     IN_PROGRESS = 'In Progress'
     ERRORED = 'Errored'
+    LATEST = 'latest'  # partition/sort key of the record pointing at the latest completed scan
+    EXCLUSION_JOB = 'exclusionJob'  # partition key of the records tracking exclusion jobs
+    EXCLUSION_SWEEP = 'exclusionSweep'  # partition/sort key of the record of the last sweep of expired exclusions
+    SHARDS_CACHE_TTL = 900  # seconds the number of shards of a scan is remembered for, it doesn't change
+
+    def __init__(self, table_name, ttl=None, cache_ttl=0, shards=1):
+        """
+        :param shards: number of partition keys the NCRs and scores of new scans are spread over, see ShardedScanTable
+        """
+        super().__init__(table_name, ttl=ttl)
+        self.latest_scan_cache = TTLCache(cache_ttl, maxsize=1)
+        self.shards = max(1, shards)
+        self.scan_shards_cache = TTLCache(self.SHARDS_CACHE_TTL, maxsize=16)
 
     @staticmethod
     def create_new_scan_id() -> str:
@@ -22,19 +39,149 @@ class ScansTable(TableBase):
         )
         return scan_id
 
+    def get_scan_shards(self, scan_id: str) -> int:
+        """Number of shards recorded on the scan, scans opened before shards were recorded have one"""
+        shards = self.scan_shards_cache.get(scan_id)
+        if shards is None:
+            # consistent read, the first records of a scan are written right after it is opened
+            scan = self.get_item(
+                Key={'scan': self.SCAN, 'scanId': scan_id}, ProjectionExpression='scanId, shards', ConsistentRead=True
+            ).get('Item')
+            if scan is None:
+                return 1
+            shards = int(scan.get('shards', 1))
+            self.scan_shards_cache.set(scan_id, shards)
+        return shards
+
     def get_latest_complete_scan(self):
-        # get last scan id from database
-        scans = self.query_all(
-            KeyConditionExpression=Key('scan').eq(self.SCAN),
-            ScanIndexForward=False,
-            FilterExpression=Attr('processState').eq(self.COMPLETED),
-        )
+        # read pointer maintained by the CloseScan step
+        pointer = self.get_item(Key={'scan': self.LATEST, 'scanId': self.LATEST}).get('Item')
+        if pointer:
+            return pointer['latestScanId']
+        return self.find_latest_complete_scan()
+
+    def find_latest_complete_scan(self):
+        """Search scan history for the latest completed scan, stopping at the first page with a match"""
+        query_parameters = {
+            'KeyConditionExpression': Key('scan').eq(self.SCAN),
+            'ScanIndexForward': False,
+            'FilterExpression': Attr('processState').eq(self.COMPLETED),
+        }
+        while True:
+            response = self.query(**query_parameters)
+            if response.get('Items'):
+                return response['Items'][0]['scanId']
+            if 'LastEvaluatedKey' not in response:
+                return None
+            query_parameters['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def set_latest_complete_scan(self, scan_id):
+        """Point the latest completed scan record at scan_id, unless a newer scan has already been recorded"""
         try:
-            scan_id = scans[0]['scanId']
-        except IndexError:
-            scan_id = None
+            self.update_item(
+                Key={'scan': self.LATEST, 'scanId': self.LATEST},
+                UpdateExpression='SET latestScanId = :scan_id',
+                ConditionExpression=Attr('latestScanId').not_exists() | Attr('latestScanId').lt(scan_id),
+                ExpressionAttributeValues={':scan_id': scan_id},
+                ReturnValues='NONE',
+            )
+            return True
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            logger.info('Latest scan pointer not updated, newer scan already recorded than %s', scan_id)
+            return False
 
-        return scan_id
+    def get_cached_latest_complete_scan(self):
+        """Latest completed scan id, reusing the lookup made by earlier invocations of a warm lambda container"""
+        return self.latest_scan_cache.get_or_load(self.COMPLETED, self.get_latest_complete_scan)
+
+    def create_exclusion_job(self, scan_id: str, exclusions: List[dict], work_items: List[dict], created_by: Optional[str]) -> dict:
+        """
+        Record a job applying exclusions to the ncrs of a scan, counting each work item as a partition of the job
+
+        :param work_items: {'partitionKey': partition_key} per partition key of the scan, with 'accountIds' when a partition is split by account
+        :return: the job record
+        """
+        job_id = uuid.uuid4().hex
+        now = datetime.now().isoformat()
+        job = {
+            'scan': self.EXCLUSION_JOB,
+            'scanId': job_id,
+            'jobId': job_id,
+            'rescoreScanId': scan_id,
+            'exclusions': exclusions,
+            'partitionKeys': list(dict.fromkeys(work_item['partitionKey'] for work_item in work_items)),
+            'workItems': work_items,
+            # a job without work items has nothing to wait for
+            'processState': self.IN_PROGRESS if work_items else self.COMPLETED,
+            'partitions': len(work_items),
+            'partitionsDone': 0,
+            'partitionsFailed': 0,
+            'ncrsUpdated': 0,
+            'scoresUpdated': 0,
+            'errors': [],
+            'createdBy': created_by,
+            'createdAt': now,
+            'updatedAt': now,
+        }
+        self.put_item(Item=job)
+        return job
+
+    def get_exclusion_job(self, job_id: str) -> dict:
+        return self.get_item(Key={'scan': self.EXCLUSION_JOB, 'scanId': job_id}).get('Item', {})
+
+    def add_exclusion_job_progress(self, job_id: str, ncrs: int = 0, scores: int = 0, error: Optional[str] = None) -> dict:
+        """
+        Count a partition of an exclusion job as done, failed if error is given. Counters are added to atomically,
+        as the partitions of a job are processed in parallel. The partition completing the job sets its final state.
+
+        :return: the job record after the update
+        """
+        update_expression = 'SET updatedAt = :now ADD partitionsDone :one, partitionsFailed :failed, ncrsUpdated :ncrs, scoresUpdated :scores'
+        expression_values = {':now': datetime.now().isoformat(), ':one': 1, ':failed': 1 if error else 0, ':ncrs': ncrs, ':scores': scores}
+        if error:
+            update_expression = update_expression.replace('SET ', 'SET errors = list_append(errors, :error), ')
+            expression_values[':error'] = [error]
+        job = self.update_item(
+            Key={'scan': self.EXCLUSION_JOB, 'scanId': job_id},
+            UpdateExpression=update_expression,
+            ExpressionAttributeValues=expression_values,
+            ReturnValues='ALL_NEW',
+        )['Attributes']
+        if job['partitionsDone'] < job['partitions']:
+            return job
+        job['processState'] = self.ERRORED if job['partitionsFailed'] else self.COMPLETED
+        self.update_item(
+            Key={'scan': self.EXCLUSION_JOB, 'scanId': job_id},
+            UpdateExpression='SET processState = :process_state',
+            ExpressionAttributeValues={':process_state': job['processState']},
+            ReturnValues='NONE',
+        )
+        return job
+
+    def get_exclusion_sweep(self) -> dict:
+        return self.get_item(Key={'scan': self.EXCLUSION_SWEEP, 'scanId': self.EXCLUSION_SWEEP}).get('Item', {})
+
+    def set_exclusion_sweep(self, scan_id: str, swept_date: str, job_id: Optional[str] = None, previous_swept_date: Optional[str] = None) -> None:
+        """
+        Record that the exclusions expired by swept_date (YYYY/MM/DD) have been applied to the scan
+
+        :param job_id: exclusion job applying the wildcard exclusions of the sweep, which may still fail
+        :param previous_swept_date: swept_date of the sweep before, to sweep from again if the job fails
+        """
+        self.update_item(
+            Key={'scan': self.EXCLUSION_SWEEP, 'scanId': self.EXCLUSION_SWEEP},
+            UpdateExpression=(
+                'SET rescoreScanId = :scan_id, sweptDate = :swept_date, jobId = :job_id, previousSweptDate = :previous_swept_date, updatedAt = :now'
+            ),
+            ExpressionAttributeValues={
+                ':scan_id': scan_id,
+                ':swept_date': swept_date,
+                ':job_id': job_id,
+                ':previous_swept_date': previous_swept_date,
+                ':now': datetime.now().isoformat(),
+            },
+            ReturnValues='NONE',
+        )
 
     def add_error(self, scan_id, function_name, error, is_fatal=False):
         error_info = {
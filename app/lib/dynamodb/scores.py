@@ -2,24 +2,25 @@ import numbers
 from typing import TypedDict, Optional
 from collections import defaultdict
 
-from lib.dynamodb.table_base import TableBase
+from boto3.dynamodb.conditions import Key
+
+from lib.dynamodb.sharded_scan import ShardedScanTable
 
 class DetailedScore(TypedDict):
-    scanId: str
+    scanId: str  # partition key, the scan id with the account's shard
     accountId: str
     requirementId: str
     score: dict
     accntId_rqrmntId: Optional[str]
 
 
-class ScoresTable(TableBase):
+class ScoresTable(ShardedScanTable):
     DATA_NOT_COLLECTED = 'DNC'  # in the event that data is not collected, score = DATA_NOT_COLLECTED
     NOT_APPLICABLE = 'N/A' # score for requirements that do not apply to an account
 
-    @staticmethod
-    def new_score(scan_id, account_id, requirement, num_resources, num_failing=None) -> DetailedScore:
+    def new_score(self, scan_id, account_id, requirement, num_resources, num_failing=None) -> DetailedScore:
         return {
-            'scanId': scan_id,
+            'scanId': self.partition_key(scan_id, account_id),
             'accntId_rqrmntId': f'{account_id}#{requirement["requirementId"]}',
             'accountId': account_id,
             'requirementId': requirement['requirementId'],
@@ -32,6 +33,24 @@ class ScoresTable(TableBase):
             }
         }
 
+    def get_score(self, scan_id: str, account_id: str, requirement_id: str) -> dict:
+        return self.get_item(
+            Key={'scanId': self.partition_key(scan_id, account_id), 'accntId_rqrmntId': f'{account_id}#{requirement_id}'}
+        ).get('Item', {})
+
+    def get_account_scores(self, scan_id: str, account_id: str) -> list:
+        return self.query_all(
+            KeyConditionExpression=Key('scanId').eq(self.partition_key(scan_id, account_id)) & Key('accntId_rqrmntId').begins_with(account_id)
+        )
+
+    def has_account_scores(self, scan_id: str, account_id: str) -> bool:
+        """Whether any score of the account has been written for the scan"""
+        return bool(self.query(
+            KeyConditionExpression=Key('scanId').eq(self.partition_key(scan_id, account_id)) & Key('accntId_rqrmntId').begins_with(account_id),
+            ProjectionExpression='scanId',
+            Limit=1,
+        ).get('Items'))
+
     @staticmethod
     def new_empty_score_object():
         return {
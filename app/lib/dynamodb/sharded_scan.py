@@ -0,0 +1,79 @@
+"""
+Base class for tables holding the records of a scan, keyed by scanId (NCRs and scores).
+
+With every record of a scan under the same partition key, that partition takes all of the scan's writes.
+The records are instead spread over the scan's shards, partition keys '<scanId>#<shard>', the shard being derived from
+the account id, so the records of an account are all in one partition and whole scan reads query every shard.
+The number of shards is recorded on the scan record when the scan is opened. Scans with a single shard, or opened
+before shards were recorded, keep the plain scanId as partition key.
+"""
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from boto3.dynamodb.conditions import ConditionBase, Key
+
+from lib.dynamodb.table_base import TableBase
+
+PARTITION_KEY = 'scanId'
+
+
+class ShardedScanTable(TableBase):
+    def __init__(self, table_name, ttl=None, scans_table=None):
+        """
+        :param scans_table: table of the scan records holding the number of shards of each scan, scans have a single shard without it
+        """
+        super().__init__(table_name, ttl=ttl)
+        self.scans_table = scans_table
+
+    @staticmethod
+    def get_scan_id(partition_key: str) -> str:
+        """Scan id of a partition key, scan ids are '<date>#<random>' and shards add '#<shard>'"""
+        return '#'.join(partition_key.split('#')[:2])
+
+    @staticmethod
+    def get_shard(account_id: str, shards: int) -> int:
+        return zlib.crc32(account_id.encode('utf-8')) % shards
+
+    def get_shards(self, scan_id: str) -> int:
+        """Number of partition keys the records of the scan are spread over"""
+        if self.scans_table is None:
+            return 1
+        return self.scans_table.get_scan_shards(scan_id)
+
+    def partition_key(self, scan_id: str, account_id: str) -> str:
+        """Partition key holding the records of the account in the scan, and of its new records"""
+        shards = self.get_shards(scan_id)
+        if shards == 1:
+            return scan_id
+        return f'{scan_id}#{self.get_shard(account_id, shards)}'
+
+    def partition_keys(self, scan_id: str) -> List[str]:
+        """Partition keys holding all records of the scan"""
+        shards = self.get_shards(scan_id)
+        if shards == 1:
+            return [scan_id]
+        return [f'{scan_id}#{shard}' for shard in range(shards)]
+
+    def query_scan(self, scan_id: str, sort_key_condition: Optional[ConditionBase] = None, **kwargs) -> list:
+        """
+        Query all records of a scan, querying its partition keys in parallel
+
+        :param sort_key_condition: optional condition on the sort key, e.g. Key('accntId_rqrmntId').begins_with(account_id)
+        :param kwargs: additional query parameters, e.g. IndexName or FilterExpression
+        :return: records of all partition keys, in partition key order
+        """
+        queries = [self.build_query(partition_key, sort_key_condition, **kwargs) for partition_key in self.partition_keys(scan_id)]
+        if len(queries) == 1:
+            return self.query_all(**queries[0])
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            results = list(executor.map(lambda query_parameters: self.query_all(**query_parameters), queries))
+        return [item for items in results for item in items]
+
+    @classmethod
+    def build_query(cls, partition_key: str, sort_key_condition: Optional[ConditionBase] = None, **kwargs) -> dict:
+        """Query parameters of a partition key, with the conditions built into expression strings, see build_expressions"""
+        key_condition = Key(PARTITION_KEY).eq(partition_key)
+        if sort_key_condition is not None:
+            key_condition = key_condition & sort_key_condition
+        return cls.build_expressions(KeyConditionExpression=key_condition, **kwargs)
@@ -3,13 +3,41 @@ Base class for extending boto3's dynamodb Table resource functionality
 """
 import os
 import json
+import random
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, NamedTuple, Tuple
 
 import boto3
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
 from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
 
 from lib.logger import logger
 
+BATCH_GET_LIMIT = 100  # max keys per BatchGetItem call
+BATCH_WRITE_LIMIT = 25  # max requests per BatchWriteItem call
+BATCH_WRITE_WORKERS = 8  # max BatchWriteItem calls in flight
+BATCH_WRITE_MAX_ATTEMPTS = 10  # also the max attempts of a BatchGetItem with unprocessed keys
+BATCH_WRITE_BACKOFF_BASE = 0.05  # seconds, doubled per attempt
+BATCH_WRITE_BACKOFF_MAX = 5
+THROTTLING_ERRORS = ['ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded']
+
+
+class BatchWriteMetrics(NamedTuple):
+    """Counts and duration of a batch_write_items call"""
+    items: int
+    api_calls: int
+    retries: int
+    throttles: int
+    seconds: float
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items / self.seconds if self.seconds else float(self.items)
+
 
 class TableBase():
     def __init__(self, table_name, ttl=None):
@@ -40,31 +68,79 @@ class TableBase():
         logger.debug('Deserialized %s', json.dumps(deserialized, default=str))
         return deserialized
 
+    def encode_item(self, item: dict) -> dict:
+        """Hook converting an item to the form it is stored in, applied to every item written"""
+        return item
+
+    def decode_items(self, items: list) -> list:
+        """Hook converting stored items back, applied to every item read. Gets all items of a response at once"""
+        return items
+
     def delete_item(self, *args, **kwargs):
         """Pass through to table method"""
         return self.table.delete_item(*args, **kwargs)
 
     def get_item(self, *args, **kwargs):
         """Pass through to table method"""
-        return self.table.get_item(*args, **kwargs)
+        response = self.table.get_item(*args, **kwargs)
+        if 'Item' in response:
+            response['Item'] = self.decode_items([response['Item']])[0]
+        return response
 
     def put_item(self, *args, **kwargs):
         """Pass through to table method"""
         if self.ttl and 'Item' in kwargs and 'ttl' not in kwargs['Item']:
             kwargs['Item']['ttl'] = self.get_ttl()
+        if 'Item' in kwargs:
+            kwargs['Item'] = self.encode_item(kwargs['Item'])
         return self.table.put_item(*args, **kwargs)
 
     def update_item(self, *args, **kwargs):
         """Pass through to table method"""
-        return self.table.update_item(*args, **kwargs)
+        response = self.table.update_item(*args, **kwargs)
+        if 'Attributes' in response:
+            response['Attributes'] = self.decode_items([response['Attributes']])[0]
+        return response
 
     def query(self, *args, **kwargs):
-        """Pass through to table method"""
-        return self.table.query(*args, **kwargs)
+        """Pass through to table method, see build_expressions"""
+        response = self.table.query(*args, **self.build_expressions(**kwargs))
+        if 'Items' in response:
+            response['Items'] = self.decode_items(response['Items'])
+        return response
 
     def scan(self, *args, **kwargs):
-        """Pass through to table method"""
-        return self.table.scan(*args, **kwargs)
+        """Pass through to table method, see build_expressions"""
+        response = self.table.scan(*args, **self.build_expressions(**kwargs))
+        if 'Items' in response:
+            response['Items'] = self.decode_items(response['Items'])
+        return response
+
+    @staticmethod
+    def build_expressions(**kwargs) -> dict:
+        """
+        Request parameters with the key condition and filter expression conditions built into expression strings.
+        The table resource would otherwise build them with an expression builder shared by all of its calls,
+        which is not thread safe, and tables are queried from worker threads.
+        """
+        conditions = {
+            parameter: kwargs.pop(parameter) for parameter in ['KeyConditionExpression', 'FilterExpression']
+            if isinstance(kwargs.get(parameter), ConditionBase)
+        }
+        if not conditions:
+            return kwargs
+        builder = ConditionExpressionBuilder()
+        names = dict(kwargs.pop('ExpressionAttributeNames', {}))
+        values = dict(kwargs.pop('ExpressionAttributeValues', {}))
+        for parameter, condition in conditions.items():
+            expression = builder.build_expression(condition, is_key_condition=parameter == 'KeyConditionExpression')
+            kwargs[parameter] = expression.condition_expression
+            names.update(expression.attribute_name_placeholders)
+            values.update(expression.attribute_value_placeholders)
+        kwargs['ExpressionAttributeNames'] = names
+        if values:
+            kwargs['ExpressionAttributeValues'] = values
+        return kwargs
 
     def batch_writer(self, *args, **kwargs):
         """Pass through to table method"""
@@ -73,35 +149,149 @@ class TableBase():
     def scan_all(self, **kwargs):
         """Scans all items of a table, calls successive pages if necessary"""
         scan_params = kwargs
-        response = self.table.scan(**scan_params)
+        response = self.scan(**scan_params)
         items = response.get('Items') or []
         while 'LastEvaluatedKey' in response:
             scan_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
-            response = self.table.scan(**scan_params)
+            response = self.scan(**scan_params)
             items.extend(response.get('Items') or [])
         return items
 
     def query_all(self, **kwargs):
         """Query items of a table, calls successive pages if necessary"""
         query_parameters = kwargs
-        response = self.table.query(**query_parameters)
+        response = self.query(**query_parameters)
         items = response.get('Items') or []
         while 'LastEvaluatedKey' in response:
             query_parameters['ExclusiveStartKey'] = response['LastEvaluatedKey']
-            response = self.table.query(**query_parameters)
+            response = self.query(**query_parameters)
             items.extend(response.get('Items') or [])
         return items
 
-    def batch_put_records(self, records: list) -> None:
+    def query_iter(self, **kwargs) -> Iterator[dict]:
+        """Query items of a table, only requesting the next page once the current one has been consumed"""
+        query_parameters = kwargs
+        while True:
+            response = self.query(**query_parameters)
+            yield from response.get('Items') or []
+            if 'LastEvaluatedKey' not in response:
+                return
+            query_parameters['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def scan_iter(self, **kwargs) -> Iterator[dict]:
+        """Scan items of a table, only requesting the next page once the current one has been consumed"""
+        scan_params = kwargs
+        while True:
+            response = self.scan(**scan_params)
+            yield from response.get('Items') or []
+            if 'LastEvaluatedKey' not in response:
+                return
+            scan_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def batch_put_records(self, records: Iterable[dict]) -> BatchWriteMetrics:
         """
-        Write records to table using batch_writer
-        (25 writes per api call with automatic retries)
+        Write records to table using parallel batch writes
+        (25 writes per api call with automatic retries, see batch_write_items)
 
         :param records: list of validated ddb records to put to db
-        :return: None
+        :return: metrics of the write
+        """
+        return self.batch_write_items(put_items=records)
+
+    def batch_get_items(self, keys: list, **kwargs) -> list:
+        """
+        Get items from table by key using batch_get_item
+        (100 keys per api call, unprocessed keys are requested again after the backoff of batch writes).
+        Uses the low level client, so it can be called from the worker threads of query_scan.
+
+        :param keys: list of unique primary keys to get
+        :param kwargs: additional parameters for the table request, e.g. ProjectionExpression
+        :return: list of the items found, in no particular order
         """
-        with self.table.batch_writer() as batch:
-            for record in records:
-                if self.ttl and 'ttl' not in record:
-                    record['ttl'] = self.get_ttl()
-                batch.put_item(Item=record)
+        serializer, deserializer = TypeSerializer(), TypeDeserializer()
+        keys = [serializer.serialize(key)['M'] for key in keys]
+        items = []
+        for index in range(0, len(keys), BATCH_GET_LIMIT):
+            request_items = {self.table_name: {'Keys': keys[index:index + BATCH_GET_LIMIT], **kwargs}}
+            attempt = 0
+            while request_items:
+                if attempt >= BATCH_WRITE_MAX_ATTEMPTS:
+                    raise RuntimeError(f'Keys of {self.table_name} still unprocessed after {BATCH_WRITE_MAX_ATTEMPTS} attempts')
+                self.backoff(attempt)
+                response = self.dynamodb.batch_get_item(RequestItems=request_items)
+                items.extend(self.decode_items([deserializer.deserialize({'M': item}) for item in response.get('Responses', {}).get(self.table_name) or []]))
+                request_items = response.get('UnprocessedKeys')
+                attempt += 1
+        return items
+
+    def batch_write_items(self, put_items: Iterable[dict] = (), delete_keys: Iterable[dict] = ()) -> BatchWriteMetrics:
+        """
+        Put and delete items with batch_write_item calls made in parallel
+        (25 requests per api call). Uses the low level client, which unlike the table resource is thread safe.
+        Unprocessed and throttled requests are sent again after a jittered exponential backoff, and the number of
+        calls in flight is halved each time that happens, then grows back by one per fully processed call.
+
+        :param put_items: items to put
+        :param delete_keys: primary keys of the items to delete
+        :return: metrics of the write
+        """
+        start = time.monotonic()
+        serializer = TypeSerializer()
+        requests = []
+        for item in put_items:
+            if self.ttl and 'ttl' not in item:
+                item['ttl'] = self.get_ttl()
+            requests.append({'PutRequest': {'Item': serializer.serialize(self.encode_item(item))['M']}})
+        for key in delete_keys:
+            requests.append({'DeleteRequest': {'Key': serializer.serialize(key)['M']}})
+
+        pending = deque((requests[index:index + BATCH_WRITE_LIMIT], 0) for index in range(0, len(requests), BATCH_WRITE_LIMIT))
+        in_flight: Dict[Future, Tuple[list, int]] = {}
+        concurrency = BATCH_WRITE_WORKERS
+        api_calls, retries, throttles = 0, 0, 0
+        with ThreadPoolExecutor(max_workers=BATCH_WRITE_WORKERS) as executor:
+            while pending or in_flight:
+                while pending and len(in_flight) < concurrency:
+                    chunk, attempt = pending.popleft()
+                    in_flight[executor.submit(self._batch_write_chunk, chunk, attempt)] = (chunk, attempt)
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk, attempt = in_flight.pop(future)
+                    unprocessed, throttled = future.result()
+                    api_calls += 1
+                    throttles += throttled
+                    if unprocessed:
+                        if attempt + 1 >= BATCH_WRITE_MAX_ATTEMPTS:
+                            raise RuntimeError(f'{len(unprocessed)} writes to {self.table_name} still unprocessed after {BATCH_WRITE_MAX_ATTEMPTS} attempts')
+                        retries += 1
+                        pending.append((unprocessed, attempt + 1))
+                        concurrency = max(1, concurrency // 2)
+                    else:
+                        concurrency = min(BATCH_WRITE_WORKERS, concurrency + 1)
+
+        metrics = BatchWriteMetrics(len(requests), api_calls, retries, throttles, time.monotonic() - start)
+        if requests:
+            logger.info(
+                'Wrote %d items to %s with %d calls (%d retried, %d throttled) in %.2fs, %.0f items/s',
+                metrics.items, self.table_name, metrics.api_calls, metrics.retries, metrics.throttles, metrics.seconds, metrics.items_per_second
+            )
+        return metrics
+
+    def _batch_write_chunk(self, chunk: list, attempt: int) -> Tuple[list, bool]:
+        """
+        :return: the requests left unprocessed, and whether the call was throttled
+        """
+        self.backoff(attempt)
+        try:
+            response = self.dynamodb.batch_write_item(RequestItems={self.table_name: chunk})
+        except ClientError as err:
+            if err.response.get('Error', {}).get('Code') in THROTTLING_ERRORS:
+                return chunk, True
+            raise
+        return response.get('UnprocessedItems', {}).get(self.table_name) or [], False
+
+    @staticmethod
+    def backoff(attempt: int) -> None:
+        """Full jitter exponential backoff before sending unprocessed requests again, none for the first attempt"""
+        if attempt:
+            time.sleep(random.uniform(0, min(BATCH_WRITE_BACKOFF_MAX, BATCH_WRITE_BACKOFF_BASE * 2 ** attempt)))
@@ -1,6 +1,21 @@
+import copy
+from functools import partial
+
 from lib.dynamodb.table_base import TableBase
+from lib.ttl_cache import TTLCache
 
 
 class UserTable(TableBase):
+    def __init__(self, table_name, ttl=None, cache_ttl=0):
+        super().__init__(table_name, ttl=ttl)
+        self.user_cache = TTLCache(cache_ttl, maxsize=512)
+
     def get_user(self, email):
         return self.get_item(Key={'email': email}).get('Item')
+
+    def get_cached_user(self, email):
+        """
+        Get user record, reusing lookups made by earlier invocations of a warm lambda container.
+        Returns a copy so callers are free to mutate the record.
+        """
+        return copy.deepcopy(self.user_cache.get_or_load(email, partial(self.get_user, email)))
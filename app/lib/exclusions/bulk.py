@@ -0,0 +1,267 @@
+"""
+Bulk import and export of exclusions from/to XLSX or CSV files.
+
+Rows are streamed from the file (openpyxl read-only mode for XLSX), validated in parallel the way the admin
+api validates a new exclusion, and written with parallel batch writes. Rows that can't be imported are reported
+with their row number instead of stopping the import.
+
+Columns are the exclusion attributes (accountId, requirementId, resourceId, expirationDate, status, type,
+hidesResources, adminComments, lastModifiedByAdmin) and formFields.<field> for each form field. The columns of
+the legacy exclusions sheet (hidden, approval, Type, reason) are accepted too.
+"""
+import csv
+import datetime
+import json
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from openpyxl import Workbook, load_workbook
+
+from lib.dynamodb import exclusions_table
+from lib.exclusions import exclusions, state_machine, validators
+from lib.lambda_decorator.exceptions import HttpException
+from lib.logger import logger
+
+DEFAULT_SHEET = 'exceptions'
+DEFAULT_STATUS = exclusions.APPROVED
+BATCH_SIZE = 1000  # rows validated and written at a time
+FORM_FIELD_PREFIX = 'formFields.'
+LEGACY_COLUMNS = {'hidden': 'hidesResources', 'approval': 'lastModifiedByAdmin', 'Type': 'type', 'reason': f'{FORM_FIELD_PREFIX}reason'}
+EXPORT_COLUMNS = [
+    'accountId', 'requirementId', 'resourceId', 'type', 'status', 'expirationDate', 'hidesResources',
+    'adminComments', 'lastModifiedByAdmin', 'lastModifiedByUser', 'lastStatusChangeDate',
+]
+REQUIRED_COLUMNS = ['accountId', 'requirementId', 'resourceId', 'expirationDate']
+IMPORTED_STATUSES = [exclusions.INITIAL, exclusions.APPROVED, exclusions.REJECTED, exclusions.ARCHIVED]
+HISTORICAL_STATUSES = [exclusions.REJECTED, exclusions.ARCHIVED]
+# rejected, archived and expired exclusions are records of past exclusions, their expirationDate is only checked to be a date
+HISTORICAL_STATE_TRANSITIONS = {
+    state_machine.States.start: {
+        state_machine.States.initial: {**state_machine.ADMIN_CREATE, 'expirationDate': (True, validators.expiration_date_format)},
+    },
+}
+TRUE_VALUES = ['true', 'yes', 'y', '1']
+FALSE_VALUES = ['false', 'no', 'n', '0', '']
+
+
+class RowFailure(NamedTuple):
+    row: int
+    exclusion_id: str
+    error: str
+
+
+class ImportResult(NamedTuple):
+    rows: int
+    imported: int
+    failures: List[RowFailure]
+
+
+def read_rows(filename: str, sheet_name: str = DEFAULT_SHEET) -> Iterator[Tuple[int, dict]]:
+    """
+    Streams the rows of an XLSX or CSV file, the first row holding the column names
+
+    :return: (row number, {column: value}) for each non empty row, empty cells left out
+    """
+    if filename.lower().endswith('.csv'):
+        with open(filename, newline='', encoding='utf-8-sig') as csv_file:
+            for row_number, row in enumerate(csv.DictReader(csv_file), start=2):
+                values = {column: value for column, value in row.items() if column and value not in (None, '')}
+                if values:
+                    yield row_number, values
+        return
+    workbook = load_workbook(filename=filename, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        columns = next(rows, ())
+        for row_number, row in enumerate(rows, start=2):
+            values = {column: value for column, value in zip(columns, row) if column and value is not None}
+            if values:
+                yield row_number, values
+    finally:
+        workbook.close()
+
+
+def row_to_exclusion(row: dict, requirement_types: Dict[str, str]) -> dict:
+    """
+    :param requirement_types: exclusion type of each requirement, for rows without a type
+    :return: the exclusion described by the row
+    """
+    row = {LEGACY_COLUMNS.get(column, column): value for column, value in row.items()}
+    account_id = row.get('accountId', '')
+    exclusion = {
+        'accountId': str(account_id).zfill(12) if isinstance(account_id, int) else str(account_id).strip(),
+        'requirementId': str(row.get('requirementId', '')).strip(),
+        'resourceId': str(row.get('resourceId', '')).strip(),
+        'status': str(row.get('status') or DEFAULT_STATUS).strip(),
+        'formFields': {column[len(FORM_FIELD_PREFIX):]: str(value) for column, value in row.items() if column.startswith(FORM_FIELD_PREFIX)},
+        'hidesResources': parse_bool(row.get('hidesResources', False)),
+    }
+    exclusion['type'] = str(row.get('type') or requirement_types.get(exclusion['requirementId'], '')).strip()
+    expiration_date = row.get('expirationDate', '')
+    if isinstance(expiration_date, (datetime.date, datetime.datetime)):
+        expiration_date = expiration_date.strftime('%Y/%m/%d')
+    exclusion['expirationDate'] = str(expiration_date).strip()
+    for column in ['adminComments', 'lastModifiedByAdmin', 'lastModifiedByUser', 'lastStatusChangeDate']:
+        if row.get(column) is not None:
+            exclusion[column] = str(row[column])
+    exclusion.setdefault('lastStatusChangeDate', datetime.datetime.now().isoformat())
+    exclusion['rqrmntId_rsrceRegex'] = f'{exclusion["requirementId"]}#{exclusion["resourceId"]}'
+    exclusion['exclusionId'] = exclusions_table.get_exclusion_id(exclusion)
+    return exclusion
+
+
+def parse_bool(value) -> object:
+    """Booleans of spreadsheet cells, which can be text, other values are left for validation to reject"""
+    if isinstance(value, str) and value.strip().lower() in TRUE_VALUES + FALSE_VALUES:
+        return value.strip().lower() in TRUE_VALUES
+    return value
+
+
+def validate_exclusion(exclusion: dict, exclusion_types: dict, requirement_types: Dict[str, str]) -> Optional[str]:
+    """
+    Validates an imported exclusion as the admin api validates a new exclusion, whatever its status.
+    The expirationDate of rejected, archived and expired exclusions only needs to be a date, see is_historical.
+
+    :return: why the exclusion is invalid, None if it is valid
+    """
+    missing_columns = [column for column in REQUIRED_COLUMNS if not exclusion[column]]
+    if missing_columns:
+        return f'Missing {", ".join(missing_columns)}'
+    if exclusion['requirementId'] not in requirement_types:
+        return f'Requirement not found: {exclusion["requirementId"]}'
+    if exclusion['type'] not in exclusion_types:
+        return f'Cannot find exclusion type: {exclusion["type"]}'
+    if exclusion['status'] not in IMPORTED_STATUSES:
+        return f'Exclusion status invalid: {exclusion["status"]}'
+    create_request = {key: exclusion[key] for key in state_machine.ADMIN_CREATE if key in exclusion}
+    create_request['status'] = exclusions.INITIAL
+    machine = HISTORICAL_STATE_TRANSITIONS if is_historical(exclusion) else state_machine.ADMIN_STATE_TRANSITIONS
+    try:
+        exclusions.validate_update_request({}, create_request, machine, exclusion_types[exclusion['type']], True)
+    except HttpException as err:
+        return json.dumps(err.body, default=str)
+    return None
+
+
+def is_historical(exclusion: dict) -> bool:
+    """Whether the exclusion no longer applies, being rejected, archived or expired"""
+    if exclusion['status'] in HISTORICAL_STATUSES:
+        return True
+    try:
+        return datetime.datetime.strptime(exclusion['expirationDate'], '%Y/%m/%d') < datetime.datetime.now()
+    except ValueError:
+        return False
+
+
+def validate_row(numbered_row: Tuple[int, dict], exclusion_types: dict, requirement_types: Dict[str, str]) -> Tuple[int, dict, Optional[str]]:
+    """:return: (row number, exclusion, error), for use by an executor"""
+    row_number, row = numbered_row
+    try:
+        exclusion = row_to_exclusion(row, requirement_types)
+    except Exception as err: # pylint: disable=broad-except
+        return row_number, {}, f'Unable to read row: {err}'
+    return row_number, exclusion, validate_exclusion(exclusion, exclusion_types, requirement_types)
+
+
+def import_exclusions(rows: Iterable[Tuple[int, dict]], exclusion_types: dict, requirement_types: Dict[str, str], workers: int = 1,
+                      batch_size: int = BATCH_SIZE, dry_run: bool = False) -> ImportResult:
+    """
+    Validates and writes exclusions, a batch of rows at a time. Writes are puts by exclusion key, so importing
+    a file again after a failure is safe. Rows of the same exclusion as an earlier row are not imported.
+
+    :param rows: (row number, row) as read by read_rows
+    :param workers: processes validating rows, validation is done in this process if 1
+    :param dry_run: only validate the rows
+    """
+    row_count, imported, failures = 0, 0, []
+    first_rows: Dict[str, int] = {}
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            row_count += len(batch)
+            arguments = ([exclusion_types] * len(batch), [requirement_types] * len(batch))
+            results = executor.map(validate_row, batch, *arguments, chunksize=100) if executor else map(validate_row, batch, *arguments)
+            valid_rows = []
+            for row_number, exclusion, error in results:
+                exclusion_id = exclusion.get('exclusionId', '')
+                if not error and exclusion_id in first_rows:
+                    error = f'Duplicate of row {first_rows[exclusion_id]}'
+                if error:
+                    failures.append(RowFailure(row_number, exclusion_id, error))
+                    continue
+                first_rows[exclusion_id] = row_number
+                valid_rows.append((row_number, exclusion))
+            if not dry_run:
+                unwritten = write_exclusions(valid_rows)
+                failures.extend(unwritten)
+                imported += len(valid_rows) - len(unwritten)
+            logger.info('Read %d rows, imported %d, %d failed', row_count, imported, len(failures))
+    finally:
+        if executor:
+            executor.shutdown()
+    return ImportResult(row_count, imported, failures)
+
+
+def write_exclusions(numbered_exclusions: List[Tuple[int, dict]]) -> List[RowFailure]:
+    """
+    Writes the exclusions with parallel batch writes, retrying unprocessed and throttled writes.
+    If the batch can't be written, the exclusions are put one by one to find the rows that fail.
+
+    :return: rows that could not be written
+    """
+    try:
+        exclusions_table.batch_put_records([exclusion for _, exclusion in numbered_exclusions])
+        return []
+    except Exception: # pylint: disable=broad-except
+        logger.warning('Batch write failed, writing %d exclusions one by one', len(numbered_exclusions), exc_info=True)
+    failures = []
+    for row_number, exclusion in numbered_exclusions:
+        try:
+            exclusions_table.put_item(Item=exclusion)
+        except Exception as err: # pylint: disable=broad-except
+            failures.append(RowFailure(row_number, exclusion['exclusionId'], f'Unable to write: {err}'))
+    return failures
+
+
+def write_failures(filename: str, failures: List[RowFailure]) -> None:
+    with open(filename, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['row', 'exclusionId', 'error'])
+        writer.writerows(failures)
+
+
+def exclusion_to_row(exclusion: dict, form_fields: List[str]) -> list:
+    row = [exclusion.get(column, '') for column in EXPORT_COLUMNS]
+    return row + [exclusion.get('formFields', {}).get(form_field, '') for form_field in form_fields]
+
+
+def export_exclusions(filename: str, exclusion_records: Iterable[dict], form_fields: List[str], sheet_name: str = DEFAULT_SHEET) -> int:
+    """
+    Writes exclusions to an XLSX (openpyxl write-only mode) or CSV file as they are read, in the format read by read_rows
+
+    :param form_fields: form fields of the exclusion types, each gets a column
+    :return: number of exclusions written
+    """
+    header = EXPORT_COLUMNS + [f'{FORM_FIELD_PREFIX}{form_field}' for form_field in form_fields]
+    count = 0
+    if filename.lower().endswith('.csv'):
+        with open(filename, 'w', newline='', encoding='utf-8') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(header)
+            for exclusion in exclusion_records:
+                writer.writerow(exclusion_to_row(exclusion, form_fields))
+                count += 1
+        return count
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(sheet_name)
+    worksheet.append(header)
+    for exclusion in exclusion_records:
+        worksheet.append(exclusion_to_row(exclusion, form_fields))
+        count += 1
+    workbook.save(filename)
+    return count
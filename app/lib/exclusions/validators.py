@@ -33,20 +33,21 @@ def expiration_date(old_exclusion: dict, update_request: dict, exclusion_config:
     return True, None
 
 
+def expiration_date_format(old_exclusion: dict, update_request: dict, exclusion_config: dict, is_admin: bool):
+    try:
+        datetime.strptime(update_request['expirationDate'], '%Y/%m/%d')
+    except ValueError as err:
+        logger.debug('Error parsing datetime %s', err, exc_info=True)
+        return False, 'Unable to parse datetime'
+    return True, None
+
+
 def resource_id(old_exclusion: dict, update_request: dict, exclusion_config: dict, is_admin: bool):
     if not is_admin:
         if '*' in update_request['resourceId']:
             return False, 'User cannot manage wildcard exclusions'
         latest_scan_id = scans_table.get_latest_complete_scan()
-        key = {
-            'scanId': latest_scan_id,
-            'accntId_rsrceId_rqrmntId': ncr_table.create_sort_key(
-                update_request['accountId'],
-                update_request['resourceId'],
-                update_request['requirementId'],
-            ),
-        }
-        ncr = ncr_table.get_item(Key=key).get('Item', {})
+        ncr = ncr_table.get_ncr(latest_scan_id, update_request['accountId'], update_request['resourceId'], update_request['requirementId'])
         if not ncr:
             return False, 'Cannot find resource'
     return True, None
@@ -20,6 +20,11 @@ def serializer(obj):
     return obj.__dict__
 
 
+# built once, and without the circular reference check since bodies are built from dynamodb items.
+# Separators are the json.dumps ones, GET /scans sizes its pages with this format
+ENCODER = json.JSONEncoder(default=serializer, check_circular=False)
+
+
 def parse_event(event):
     """Parses incoming API gateway event"""
     if event.get('isBase64Encoded'):
@@ -36,7 +41,7 @@ def parse_event(event):
 def format_result(result):
     """JSON dumps with custom serializer"""
     if isinstance(result, dict):
-        return json.dumps(result, default=serializer)
+        return ENCODER.encode(result)
     return result
 
 
@@ -83,7 +88,7 @@ def api_decorator(func):
             response['statusCode'] = err.status
             response['body'] = err.body
         response['body'] = format_result(response['body'])
-        logger.info('Response: %s', json.dumps(response, default=str))
+        logger.info('Response: %s', json.dumps({key: value for key, value in response.items() if key != 'body'}, default=str))
         logger.debug('Response Body: %s', response['body'])
         return response
 
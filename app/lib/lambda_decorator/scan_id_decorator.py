@@ -6,7 +6,7 @@ from lib.dynamodb import scans_table
 def get_scan_id_decorator(func):
     @wraps(func)
     def wrapper(event, context):
-        scan_id = scans_table.get_latest_complete_scan()
+        scan_id = scans_table.get_cached_latest_complete_scan()
         logger.debug('Latest completed scan: %s', scan_id)
         # add to event object
         event['scanId'] = scan_id
@@ -1,4 +1,4 @@
-import json
+import functools
 
 from lib import authz
 from lib.logger import logger
@@ -6,26 +6,48 @@ from lib.exclusions import exclusions, state_machine
 
 
 def get_allowed_actions(user, account_id, requirement, exclusion):
+    """
+    Determine the actions the user can take on an ncr. The result only depends on the user's permissions for the account,
+    whether the requirement can be remediated and the exclusion state, so it is memoized on those.
+
+    :param user: A dict representing the user.
+    :param account_id: A string representing the account of the ncr.
+    :param requirement: A dict representing the requirement of the ncr.
+    :param exclusion: A dict representing the exclusion applied to the ncr.
+
+    :returns dict: remediate, requestExclusion and requestExclusionChange booleans.
+    """
+    return dict(get_allowed_actions_for_permissions(
+        authz.can_request_exclusion(user, account_id)[0],
+        authz.can_remediate(user, account_id)[0],
+        can_requirement_be_remediated(requirement),
+        exclusions.get_state(exclusion),
+    ))
+
+
+@functools.lru_cache(maxsize=128)
+def get_allowed_actions_for_permissions(can_request_exclusion, can_remediate, can_be_remediated, current_state):
+    """
+    Memoized part of get_allowed_actions, callers must not mutate the returned dict.
+    """
     allowed_actions = {
         'remediate': False,
         'requestExclusion': False,
         'requestExclusionChange': False,
     }
-    current_state = exclusions.get_state(exclusion)
-    valid_state_transitions = state_machine.USER_STATE_TRANSITIONS.get(current_state, {}).keys()
+    valid_state_transitions = set(state_machine.USER_STATE_TRANSITIONS.get(current_state, {}).keys())
     logger.debug('Current state: %s', current_state)
     logger.debug('Valid state transitions: %s', str(valid_state_transitions))
-    logger.debug('User: %s', json.dumps(user))
 
-    if authz.can_request_exclusion(user, account_id)[0]:
-        if set(valid_state_transitions) & set(exclusions.REQUEST_EXCLUSION_STATES):
+    if can_request_exclusion:
+        if valid_state_transitions & set(exclusions.REQUEST_EXCLUSION_STATES):
             allowed_actions['requestExclusion'] = True
-        if set(valid_state_transitions) & set(exclusions.REQUEST_EXCLUSION_CHANGE_STATES):
+        if valid_state_transitions & set(exclusions.REQUEST_EXCLUSION_CHANGE_STATES):
             allowed_actions['requestExclusionChange'] = True
 
     # Determine If can remediate
-    if can_requirement_be_remediated(requirement):
-        allowed_actions['remediate'] = authz.can_remediate(user, account_id)[0]
+    if can_be_remediated:
+        allowed_actions['remediate'] = can_remediate
     return allowed_actions
 
 
@@ -0,0 +1,46 @@
+"""
+Helpers for paginated api responses
+"""
+import json
+from typing import Optional
+
+from lib import base64
+from lib.lambda_decorator.exceptions import HttpInvalidException
+
+
+def parse_limit(limit: Optional[str]) -> Optional[int]:
+    """
+    :param limit: the limit querystring parameter
+    :return: the limit as a positive integer, None if not given
+    """
+    if not limit:
+        return None
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise HttpInvalidException('limit must be an integer')
+    if limit < 1:
+        raise HttpInvalidException('limit must be positive')
+    return limit
+
+
+def encode_token(position: dict) -> str:
+    """
+    :param position: json serializable dict describing where the next page starts
+    :return: opaque nextToken
+    """
+    return base64.string_to_base64(json.dumps(position, default=str))
+
+
+def decode_token(next_token: str) -> dict:
+    """
+    :param next_token: nextToken created by encode_token
+    :return: dict describing where the next page starts
+    """
+    try:
+        position = json.loads(base64.base64_to_string(next_token))
+    except Exception:  # pylint: disable=broad-except
+        raise HttpInvalidException('invalid nextToken')
+    if not isinstance(position, dict):
+        raise HttpInvalidException('invalid nextToken')
+    return position
@@ -0,0 +1,31 @@
+"""
+Incremental parsing of large JSON objects read from S3, so a lambda doesn't have to hold
+the raw bytes and the whole parsed document in memory at once.
+"""
+from typing import Any, Iterable, Iterator, Tuple
+
+import ijson
+
+
+def iter_values(body, prefixes: Iterable[str]) -> Iterator[Tuple[str, Any]]:
+    """
+    Yields the values found at any of the given prefixes in a single pass over the document,
+    everything else in the document is skipped without being built.
+
+    :param body: file like object, e.g. the StreamingBody of an S3 get_object response
+    :param prefixes: ijson prefixes of the values to yield, e.g. 'resultsData.item' for each item of resultsData
+    :return: iterator of (prefix, value)
+    """
+    prefixes = set(prefixes)
+    builder, builder_prefix = None, None
+    for prefix, event, value in ijson.parse(body):
+        if builder:
+            builder.event(event, value)
+            if prefix == builder_prefix and event in ('end_map', 'end_array'):
+                yield builder_prefix, builder.value
+                builder = None
+        elif prefix in prefixes and event in ('start_map', 'start_array'):
+            builder, builder_prefix = ijson.ObjectBuilder(), prefix
+            builder.event(event, value)
+        elif prefix in prefixes and event not in ('map_key', 'end_map', 'end_array'):
+            yield prefix, value
@@ -1,2 +1,36 @@
+import datetime
+import gzip
+
 import boto3
+from botocore.exceptions import ClientError
+
 S3 = boto3.client('s3')
+
+
+def get_fresh_object(bucket: str, key: str, max_age: datetime.timedelta) -> dict:
+    """
+    get_object conditional on the object having been modified within max_age,
+    s3 answers a stale object with 304 Not Modified so its body is never transferred.
+
+    :return: get_object response
+    :raises Exception: if the object is older than max_age
+    """
+    modified_since = datetime.datetime.now(datetime.timezone.utc) - max_age
+    try:
+        response = S3.get_object(Bucket=bucket, Key=key, IfModifiedSince=modified_since)
+    except ClientError as err:
+        if err.response.get('Error', {}).get('Code') in ('304', 'NotModified'):
+            raise Exception(f's3 object too old, key: {key}, bucket: {bucket}')
+        raise
+    if response['LastModified'].replace(tzinfo=None) < modified_since.replace(tzinfo=None):
+        raise Exception(f's3 object too old, key: {key}, bucket: {bucket}')
+    return response
+
+
+def open_body(response: dict, key: str):
+    """
+    :return: body of a get_object response, decompressed as it is read if the object is gzipped
+    """
+    if key.endswith('.gz') or response.get('ContentEncoding') == 'gzip':
+        return gzip.GzipFile(fileobj=response['Body'], mode='rb')
+    return response['Body']
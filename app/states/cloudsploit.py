@@ -3,25 +3,46 @@ Contains lambdahandler functions for cloudsploit scanning / population
 steps of the scanning step function.
 """
 import datetime
+import heapq
 import json
 import os
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from typing import Dict, Iterator, List, Optional, Tuple
 from lib.logger import logger
 
 from lib.dynamodb import requirements_table, accounts_table, ncr_table, scores_table, scans_table
-from lib.s3.s3_buckets import S3
+from lib.s3 import json_stream
+from lib.s3 import s3_buckets
 from lib.lambda_decorator.decorator import states_decorator
 
 
 bucket_name = os.getenv('CLOUDSPLOIT_RESULT_BUCKET')
 cloudsploit_prefix = os.getenv('CLOUDSPLOIT_PREFIX')
+result_file = os.getenv('CLOUDSPLOIT_RESULT_FILE', 'latest.json')  # latest.json.gz for gzipped results
 
 MAX_S3_OBJECT_AGE = datetime.timedelta(hours=24)
+MAX_WORKERS = 8  # accounts populated concurrently by cloudsploit_populate_batch
 
-def object_expiration_check(s3_response, s3_key):
-    last_update_time = s3_response['LastModified'].replace(tzinfo=None)
-    if datetime.datetime.utcnow() - last_update_time > MAX_S3_OBJECT_AGE:
-        raise Exception(f's3 object too old, key: {s3_key}, bucket: {bucket_name}')
+def load_results(body, sources) -> dict:
+    """
+    Parses a cloudsploit results file incrementally, keeping only the resultsData
+    and the collectionData of the given sources instead of the whole document.
+
+    :param body: streaming body of the results file
+    :param sources: 'service.apiCall' of the collectionData needed to count resources
+    :return: results with 'resultsData' and 'collectionData' keys, as in the file
+    """
+    result: dict = {'resultsData': [], 'collectionData': {'aws': defaultdict(dict)}}
+    source_prefixes = {f'collectionData.aws.{source}': source for source in sources}
+    for prefix, value in json_stream.iter_values(body, ['resultsData.item', *source_prefixes]):
+        if prefix == 'resultsData.item':
+            result['resultsData'].append(value)
+        else:
+            service_name, api_call = source_prefixes[prefix].split('.')
+            result['collectionData']['aws'][service_name][api_call] = value
+    return result
 
 @states_decorator
 def cloudsploit_populate(event, context):
@@ -41,86 +62,138 @@ def cloudsploit_populate(event, context):
         raise TypeError(f'scanId should be str, not {type(scan_id)}')
 
     account = accounts_table.get_account(account_id)
+    cloudsploit_based_requirements = requirements_table.get_cloudsploit_based_requirements()
+
+    ncrs, scores_to_put = populate_account(scan_id, account, cloudsploit_based_requirements)
+    ncr_table.batch_put_records(ncrs)
+    scores_table.batch_put_records(scores_to_put)
+
+
+@states_decorator
+def cloudsploit_populate_batch(event, context):
+    """
+    Import cloudsploit findings of several accounts, loading the requirements once and
+    populating the accounts concurrently. The NCRs and scores of each account are written as soon
+    as it is converted, so only the accounts in progress are held in memory.
+    An account that fails gets data not collected scores and its error is added to the scan,
+    as cloudsploit_error would for a single account.
+
+    Expected input event format
+    {
+        scanId: string,
+        accountIds: list of account ids, null for accounts whose cloudsploit scan failed,
+    }
+    """
+    scan_id = event['scanId']
+    if not isinstance(scan_id, str):
+        raise TypeError(f'scanId should be str, not {type(scan_id)}')
+    account_ids = [account_id for account_id in event['accountIds'] if account_id]
+
+    accounts = accounts_table.get_accounts(account_ids)
+    cloudsploit_based_requirements = requirements_table.get_cloudsploit_based_requirements()
+
+    def populate(account_id):
+        if account_id not in accounts:
+            raise KeyError(f'account {account_id} not found')
+        ncrs, scores_to_put = populate_account(scan_id, accounts[account_id], cloudsploit_based_requirements)
+        ncr_table.batch_write_items(put_items=ncrs)
+        scores_table.batch_write_items(put_items=scores_to_put)
+
+    error_scores = []
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {account_id: executor.submit(populate, account_id) for account_id in account_ids}
+    for account_id, future in futures.items():
+        try:
+            future.result()
+        except Exception as err: # pylint: disable=broad-except
+            logger.exception('Unable to populate cloudsploit results of account %s', account_id)
+            error_scores.extend(make_error_scores(scan_id, accounts.get(account_id, {'accountId': account_id}), cloudsploit_based_requirements))
+            scans_table.add_error(scan_id, context.function_name, {'Error': type(err).__name__, 'Cause': str(err), 'accountId': account_id})
+    scores_table.batch_write_items(put_items=error_scores)
+
+
+def populate_account(scan_id: str, account: dict, cloudsploit_based_requirements: list) -> Tuple[list, list]:
+    """
+    Converts an account's cloudsploit results to NCRs and scores
 
+    :param account: account record
+    :param cloudsploit_based_requirements: all cloudsploit requirements
+    :return: NCR records and score records to put
+    """
+    account_id = account['accountId']
     # keys here will be the ncr's sort key which will uniquely identify it
     # since the partion key will be the scanId for all ncrs created.
     all_ncrs = {}
     scores_to_put = []
 
-    cloudsploit_based_requirements = requirements_table.get_cloudsploit_based_requirements()
-
     # split requirements based on whether they apply to the account
     applying_requirements, not_applying_requirements = split_requirements(cloudsploit_based_requirements, account)
 
-    s3_key = cloudsploit_prefix + '/' + account_id + '/latest.json'
+    s3_key = cloudsploit_prefix + '/' + account_id + '/' + result_file
 
-    # load cloudsploit results
+    # load cloudsploit results, stale results are refused by s3 before they are downloaded
     logger.info('Getting Cloudsploit results from s3://%s/%s', bucket_name, s3_key)
-    response = S3.get_object(Bucket=bucket_name, Key=s3_key)
-    object_expiration_check(response, s3_key)
-    result = json.loads(response['Body'].read())
+    response = s3_buckets.get_fresh_object(bucket_name, s3_key, MAX_S3_OBJECT_AGE)
+    sources = {requirement['cloudsploit']['source'] for requirement in applying_requirements if requirement['cloudsploit'].get('source')}
+    result = load_results(s3_buckets.open_body(response, s3_key), sources)
 
 
-    # group cloudsploit results by finding
-    grouped_results_data = defaultdict(list)
-    for result_object in result['resultsData']:
-        grouped_results_data[result_object['title']].append(result_object)
+    # index cloudsploit results by finding and status, and cache work shared by requirements using the same findings
+    results_index = index_results(result['resultsData'])
+    resource_counts: Dict[str, int] = {}
+    resource_ids: Dict[str, Tuple[Optional[str], str]] = {}
 
     # add NCRs based on cloudsploit requirements
     for requirement in applying_requirements:
         requirement_titles = requirement['cloudsploit']['finding']
         if isinstance(requirement_titles, str):
             requirement_titles = [requirement_titles]
-        relevant_results = []
-        for requirement_title in requirement_titles:
-            relevant_results.extend(grouped_results_data.get(requirement_title, []))
 
         failing_statuses = determine_failing_statuses(requirement)
 
-        # create NCR for each cloudsploit result
-        for finding_object in relevant_results:
-            if finding_object['status'] in failing_statuses:
-                resource_type = None
-                # set resource if cloudsploit didn't provide one
-                if finding_object['resource'] == ncr_table.CLOUDSPLOIT_FINDING_NA and requirement['cloudsploit'].get('regional', False) is True:
-                    resource_id = finding_object['region']
-                elif finding_object['resource'] == ncr_table.CLOUDSPLOIT_FINDING_NA:
-                    resource_id = str(account_id)
-                else:
-                    (resource_type, resource_id) = extract_resource_id(finding_object['resource'])
-
-                # Set the resource type based on the requirement spec (not cloudsploit), if it wasn't overridden by extract_resource_id()
-                if resource_type is None:
-                    resource_type = f'{requirement["service"]}-{requirement["component"]}'
-
-                ncr_key = ncr_table.create_sort_key(account_id, resource_id, requirement['requirementId'])
-                if ncr_key in all_ncrs:
-                    all_ncrs[ncr_key]['reason'][finding_object['message']] = None
-                else:
-                    all_ncrs[ncr_key] = ncr_table.new_ncr_record(
-                        {
-                            'accountId': account_id,
-                            'accountName': account['account_name'],
-                            'requirementId': requirement['requirementId'],
-                            'resourceId': resource_id,
-                            'resourceType': resource_type,
-                            'region': finding_object['region'],
-                            'reason': {finding_object['message']: None}, # dict as set with 1 item (set to deduplicate reasons)
-                            'cloudsploitStatus': finding_object['status'] # Send the cloudsploit status to the NCR Record
-                        },
-                        scan_id
-                    )
+        # create NCR for each failing cloudsploit result
+        for finding_object in get_findings(results_index, requirement_titles, failing_statuses):
+            resource_type = None
+            # set resource if cloudsploit didn't provide one
+            if finding_object['resource'] == ncr_table.CLOUDSPLOIT_FINDING_NA and requirement['cloudsploit'].get('regional', False) is True:
+                resource_id = finding_object['region']
+            elif finding_object['resource'] == ncr_table.CLOUDSPLOIT_FINDING_NA:
+                resource_id = str(account_id)
+            else:
+                if finding_object['resource'] not in resource_ids:
+                    resource_ids[finding_object['resource']] = extract_resource_id(finding_object['resource'])
+                (resource_type, resource_id) = resource_ids[finding_object['resource']]
+
+            # Set the resource type based on the requirement spec (not cloudsploit), if it wasn't overridden by extract_resource_id()
+            if resource_type is None:
+                resource_type = f'{requirement["service"]}-{requirement["component"]}'
+
+            ncr_key = ncr_table.create_sort_key(account_id, resource_id, requirement['requirementId'])
+            if ncr_key in all_ncrs:
+                all_ncrs[ncr_key]['reason'][finding_object['message']] = None
+            else:
+                all_ncrs[ncr_key] = ncr_table.new_ncr_record(
+                    {
+                        'accountId': account_id,
+                        'accountName': account['account_name'],
+                        'requirementId': requirement['requirementId'],
+                        'resourceId': resource_id,
+                        'resourceType': resource_type,
+                        'region': finding_object['region'],
+                        'reason': {finding_object['message']: None}, # dict as set with 1 item (set to deduplicate reasons)
+                        'cloudsploitStatus': finding_object['status'] # Send the cloudsploit status to the NCR Record
+                    },
+                    scan_id
+                )
 
         # determine number of resources for score
-        if requirement['cloudsploit'].get('source'):
-            service_name, api_call = requirement['cloudsploit'].get('source').split('.')
-            cloudsploit_data = result['collectionData']['aws'][service_name][api_call]
-            try:
-                num_resources = sum(len(region_object['data']) for region_object in cloudsploit_data.values() if 'err' not in region_object)
-            except KeyError:
-                raise RuntimeError(f'{service_name}, {api_call} collectionData contained region object lacking both "data" and "err" keys"')
+        source = requirement['cloudsploit'].get('source')
+        if source:
+            if source not in resource_counts:
+                resource_counts[source] = count_source_resources(result, source)
+            num_resources = resource_counts[source]
         else:
-            num_resources = len(relevant_results)
+            num_resources = sum(len(findings) for title in requirement_titles for findings in results_index.get(title, {}).values())
 
         scores_to_put.append(scores_table.new_score(scan_id, account_id, requirement, num_resources))
     # add N/A score for requirements that don't apply
@@ -129,9 +202,8 @@ def cloudsploit_populate(event, context):
 
     for ncr in all_ncrs.values():
         ncr['reason'] = '\n'.join(ncr['reason'].keys())
-        logger.info('Adding ncrs: %s', json.dumps(all_ncrs))
-    ncr_table.batch_put_records(all_ncrs.values())
-    scores_table.batch_put_records(scores_to_put)
+    logger.info('Adding ncrs: %s', json.dumps(all_ncrs))
+    return list(all_ncrs.values()), scores_to_put
 
 
 @states_decorator
@@ -177,26 +249,46 @@ def cloudsploit_error(event, context):
     """
     Handle errors in cloudsploit setup or populate. Invoked by step function.
     Adds a DNC score for each cloudsploit based requirement for the account
-    that failed. Also records error in scan record.
+    that failed, or each account of a failed populate batch. Also records error in scan record.
+    Accounts of a failed batch that already have scores were populated, or handled one by one,
+    before the batch failed (e.g. timed out), and are left as they are.
 
     Expected input event format
     {
-        'accountId': account_id,
+        'accountId': account_id, or
+        'accountIds': list of account ids, null for accounts already handled,
         'scanId': scan_id,
     }
     """
-    account_id = event['accountId']
     scan_id = event['scanId']
+    if 'accountIds' in event:
+        account_ids = [
+            account_id for account_id in event['accountIds'] if account_id and not scores_table.has_account_scores(scan_id, account_id)
+        ]
+    else:
+        account_ids = [event['accountId']]
     error = event['error']
     # remove traceback for cloudsploit errors
     try:
         error['Cause'] = json.dumps({**json.loads(error['Cause']), 'trace': None})
     except: # pylint: disable=bare-except
         pass
-    account = accounts_table.get_account(account_id)
 
     cloudsploit_based_requirements = requirements_table.get_cloudsploit_based_requirements()
 
+    accounts = accounts_table.get_accounts(account_ids)
+    scores_to_put = []
+    for account_id in account_ids:
+        scores_to_put.extend(make_error_scores(scan_id, accounts.get(account_id, {'accountId': account_id}), cloudsploit_based_requirements))
+
+    scores_table.batch_put_records(scores_to_put)
+    if account_ids:
+        scans_table.add_error(scan_id, context.function_name, event['error'])
+
+def make_error_scores(scan_id: str, account: dict, cloudsploit_based_requirements: list) -> list:
+    """
+    :return: DNC scores for the requirements that apply to the account, N/A scores for the others
+    """
     applying_requirements, not_applying_requirements = split_requirements(cloudsploit_based_requirements, account)
 
     scores_to_put = []
@@ -204,7 +296,7 @@ def cloudsploit_error(event, context):
         scores_to_put.append(
             scores_table.new_score(
                 scan_id,
-                account_id,
+                account['accountId'],
                 requirement,
                 scores_table.DATA_NOT_COLLECTED,
                 scores_table.DATA_NOT_COLLECTED,
@@ -214,15 +306,13 @@ def cloudsploit_error(event, context):
         scores_to_put.append(
             scores_table.new_score(
                 scan_id,
-                account_id,
+                account['accountId'],
                 requirement,
                 scores_table.NOT_APPLICABLE,
                 scores_table.NOT_APPLICABLE,
             )
         )
-
-    scores_table.batch_put_records(scores_to_put)
-    scans_table.add_error(scan_id, context.function_name, event['error'])
+    return scores_to_put
 
 def split_requirements(requirements, account):
     """Filters requirements list into two lists, one that applies to the account, the other that does not"""
@@ -235,6 +325,39 @@ def split_requirements(requirements, account):
             not_applying_requirements.append(requirement)
     return applying_requirements, not_applying_requirements
 
+def index_results(results_data: list) -> Dict[str, Dict[str, List[Tuple[int, dict]]]]:
+    """
+    :param results_data: cloudsploit findings
+    :return: findings grouped by title then status, each with its position in results_data
+    """
+    results_index: Dict[str, Dict[str, List[Tuple[int, dict]]]] = defaultdict(lambda: defaultdict(list))
+    for position, result_object in enumerate(results_data):
+        results_index[result_object['title']][result_object['status']].append((position, result_object))
+    return results_index
+
+
+def get_findings(results_index: dict, titles: list, statuses: list) -> Iterator[dict]:
+    """Findings with any of the titles and statuses, by title then in results_data order"""
+    for title in titles:
+        findings_by_status = results_index.get(title, {})
+        yield from (
+            finding for _, finding in heapq.merge(*(findings_by_status.get(status, []) for status in statuses), key=itemgetter(0))
+        )
+
+
+def count_source_resources(result: dict, source: str) -> int:
+    """
+    :param source: 'service.apiCall' of the collectionData to count
+    :return: number of resources cloudsploit collected across regions, regions that errored are skipped
+    """
+    service_name, api_call = source.split('.')
+    cloudsploit_data = result['collectionData']['aws'][service_name][api_call]
+    try:
+        return sum(len(region_object['data']) for region_object in cloudsploit_data.values() if 'err' not in region_object)
+    except KeyError:
+        raise RuntimeError(f'{service_name}, {api_call} collectionData contained region object lacking both "data" and "err" keys"')
+
+
 def determine_failing_statuses(requirement_object: dict) -> list:
     failing_statuses = []
     if requirement_object['cloudsploit'].get('treatWarnAsPass') is not True:
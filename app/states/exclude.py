@@ -7,8 +7,6 @@ from fnmatch import fnmatch
 from functools import partial
 from typing import Callable, Iterable, List
 
-from boto3.dynamodb.conditions import Key
-
 from lib.dynamodb import config_table, exclusions_table, ncr_table
 from lib.lambda_decorator.decorator import states_decorator
 from lib.logger import logger
@@ -111,6 +109,14 @@ def update_ncr_exclusion(ncr: dict, exclusion: dict, exclusion_types: dict) -> d
     return ncr
 
 
+def clear_ncr_exclusion(ncr: dict) -> dict:
+    """Remove exclusion no longer matching an NCR"""
+    ncr['isHidden'] = False
+    ncr['exclusionApplied'] = False
+    ncr.pop('exclusion', None)
+    return ncr
+
+
 @states_decorator
 def exclude_handler(event, context):
     """
@@ -122,7 +128,8 @@ def exclude_handler(event, context):
     }
     """
     exclusion_types = config_table.get_config(config_table.EXCLUSIONS)
-    ncrs = ncr_table.query_all(KeyConditionExpression=Key('scanId').eq(event['openScan']['scanId']))
+    # matching ncrs get their exclusion replaced, the exclusions applied to the others don't need to be looked up
+    ncrs = ncr_table.without_exclusion_lookup().query_scan(event['openScan']['scanId'])
 
     all_exclusions = exclusions_table.scan_all()
     grouped_exclusions = group_exclusions(all_exclusions)
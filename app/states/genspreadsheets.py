@@ -6,11 +6,11 @@ import json
 import os
 from enum import Enum, auto
 from datetime import date
-from typing import Dict, List, NewType, Optional, Tuple
+from typing import Any, Dict, List, NewType, Optional, Tuple
 
-from boto3.dynamodb.conditions import Key
 from openpyxl import Workbook
 
+from lib.account_index import AccountIndex
 from lib.dynamodb import accounts_table, ncr_table, requirements_table, scans_table, scores_table, user_table
 from lib.dynamodb.scores import ScoresTable
 from lib.lambda_decorator.decorator import states_decorator
@@ -26,8 +26,6 @@ DATA_NOT_COLLECTED = ScoresTable.DATA_NOT_COLLECTED
 BUCKET = os.environ.get('SCORECARD_BUCKET')
 PREFIX = os.environ.get('SCORECARD_PREFIX')
 
-SPONSOR_FIELD = 'exec_sponsor_email'
-NO_SPONSOR_VALUE = 'No executive sponsor'
 class SheetTypes(Enum):
     SINGLE_ACCOUNT = auto()
     PAYER_ACCOUNT = auto()
@@ -35,7 +33,7 @@ class SheetTypes(Enum):
     GLOBAL = auto()
 
 
-CACHE: Dict[str, Dict] = {}
+CACHE: Dict[str, Any] = {}
 CACHED_SCAN = {
     'scanId': None
 }
@@ -44,8 +42,8 @@ CACHED_SCAN = {
 def gen_spreadsheets_handler(event, context):
     scan_id = event['openScan']['scanId']
 
-    # clear CACHE if the scan has changed
-    if CACHED_SCAN['scanId'] != scan_id:
+    # clear CACHE if the scan has changed, or scores were changed since by a rescore
+    if CACHED_SCAN['scanId'] != scan_id or event.get('refresh'):
         logger.debug('Clearing cache')
         CACHE.clear()
         CACHED_SCAN['scanId'] = scan_id
@@ -98,18 +96,16 @@ def add_accounts_tab(workbook: Workbook, accounts: List, scores: Scores):
 def add_sponsor_tab(workbook: Workbook, accounts: List, scores: Scores):
     accounts_worksheet = workbook.create_sheet()
     account_overall_scores = build_overall_score(accounts, scores)
-    rows = defaultdict(lambda: {'executiveSponsor':'', 'accountCount': 0, 'sumOfScores': 0})
-
-    for account in accounts:
-        if SPONSOR_FIELD in account and isinstance(account[SPONSOR_FIELD], str):
-            sponsor = account[SPONSOR_FIELD].lower()
-        else:
-            sponsor = NO_SPONSOR_VALUE
-        rows[sponsor]['executiveSponsor'] = sponsor
-        rows[sponsor]['accountCount'] += 1
-        rows[sponsor]['sumOfScores'] += account_overall_scores[account['accountId']]
+    account_index = AccountIndex(accounts)
+    rows = [
+        {
+            'executiveSponsor': sponsor,
+            'accountCount': len(sponsor_accounts),
+            'sumOfScores': sum(account_overall_scores[account['accountId']] for account in sponsor_accounts),
+        } for sponsor, sponsor_accounts in account_index.by_sponsor.items()
+    ]
 
-    sponsors_tab.create_sponsors_tab(accounts_worksheet, rows.values())
+    sponsors_tab.create_sponsors_tab(accounts_worksheet, rows)
 
 def create_base_workbook(ncr_data: List, accounts: List, requirements: dict, scores: Scores) -> Workbook:
     account_overall_scores = build_overall_score(accounts, scores)
@@ -160,35 +156,36 @@ def get_accounts(payload: dict) -> Tuple[List, str, SheetTypes]:
         return accounts, prefix, SheetTypes.SINGLE_ACCOUNT
     elif 'payerId' in payload:
         prefix = '{}/by-payer/{}.xlsx'.format(PREFIX, payload['payerId'])
-        accounts = [a for a in get_all_accounts().values() if a.get('payer_id') == payload['payerId']]
+        accounts = get_account_index().get_payer_accounts(payload['payerId'])
         return accounts, prefix, SheetTypes.PAYER_ACCOUNT
     elif 'userEmail' in payload:
         prefix = '{}/by-user/{}.xlsx'.format(PREFIX, payload['userEmail'])
         user = user_table.get_user(payload['userEmail'])
-        accounts = []
-        for account_id in user.get('accounts', {}).keys():
-            account = get_account(account_id)
-            if account:
-                accounts.append(account)
+        accounts = get_account_index().get_accounts(user.get('accounts', {}))
         return accounts, prefix, SheetTypes.USER
     else:
         return list(get_all_accounts().values()), '{}/global/scorecard-latest.xlsx'.format(PREFIX), SheetTypes.GLOBAL
 
 
 ###---DDB QUERY---###
-def get_all_accounts() -> Dict[str, Dict]:
+def get_account_index() -> AccountIndex:
     """
     Wrapper for ddb query to getting all accounts. This also loads into cache for future lookups.
 
     Returns:
-    dict: accounts indexed by account id.
+    AccountIndex: accounts indexed by account id, payer id, sponsor and scorecard profile.
     """
-    if 'accounts' not in CACHE:
+    if 'account_index' not in CACHE:
         logger.debug('Getting accounts for cache')
-        CACHE['accounts'] = { # index accounts by account id
-            account['accountId']: account for account in accounts_table.scan_all()
-        }
-    return CACHE['accounts']
+        CACHE['account_index'] = AccountIndex(accounts_table.scan_all())
+    return CACHE['account_index']
+
+def get_all_accounts() -> Dict[str, Dict]:
+    """
+    Returns:
+    dict: accounts indexed by account id.
+    """
+    return get_account_index().accounts
 
 def get_account(account_id) -> Optional[dict]:
     """Get account by account id from cache"""
@@ -227,9 +224,7 @@ def load_scores(accounts: List) -> None:
         account_id = account['accountId']
         if account_id not in CACHE['account_detail_scores']:
             logger.debug('Querying account scores')
-            account_scores = scores_table.query_all(
-                KeyConditionExpression=Key('scanId').eq(scan_id) & Key('accntId_rqrmntId').begins_with(account_id)
-            )
+            account_scores = scores_table.get_account_scores(scan_id, account_id)
             CACHE['account_detail_scores'][account_id] = defaultdict(dict, {
                 score['requirementId']: score for score in account_scores
             })
@@ -337,15 +332,10 @@ def get_ncr(scan_id: str, accounts: list, sheet_type: SheetTypes) -> list:
     logger.debug('Getting NCRs')
     scan_results = []
     if sheet_type == SheetTypes.GLOBAL:
-        scan_results = ncr_table.query_all(
-            KeyConditionExpression=Key('scanId').eq(scan_id)
-        )
+        scan_results = ncr_table.query_scan(scan_id)
     else:
         for account in accounts:
-            results = ncr_table.query_all(
-                KeyConditionExpression=Key('scanId').eq(scan_id) &
-                Key('accntId_rsrceId_rqrmntId').begins_with(account['accountId'])
-            )
+            results = ncr_table.get_all_account_ncrs(scan_id, account['accountId'])
             scan_results.extend(results)
     return scan_results
 
@@ -1,127 +1,230 @@
+import hashlib
 import json
 import os
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
 
 import boto3
+import ijson
 import yaml
+from botocore.exceptions import ClientError
 
+from lib import bootstrap
+from lib.account_index import AccountIndex
 from lib.dynamodb import accounts_table, requirements_table, user_table, config_table
 from lib.lambda_decorator.decorator import states_decorator
+from lib.logger import logger
 
 client_s3 = boto3.client('s3')
 
 user_bucket = os.getenv('USER_BUCKET')
 account_bucket = os.getenv('ACCOUNT_BUCKET')
 requirements_bucket = os.getenv('REQUIREMENTS_BUCKET')
+scorecard_bucket = os.getenv('SCORECARD_BUCKET')
+
+# etag and item hashes of each imported file as of its last sync
+SYNC_STATE_PREFIX = f'{os.getenv("SCORECARD_PREFIX")}/load-state'
+ACCOUNTS_SOURCE = 'accounts'
+USERS_SOURCE = 'users'
+REQUIREMENTS_SOURCE = 'requirements'
 
 
 @states_decorator
 def load_handler(event, context):
     """
-    Imports users, accounts, and requirements files.
+    Imports users, accounts, and requirements files,
+    then refreshes the bootstrap document served by the user status api.
 
     Returns assorted information regarding the scan
     including account ids, accounts to scan with
     cloudsploit, payer account ids, cloudsploit settings,
-    user emails, s3 import requirements, etc
+    user emails, s3 import requirements (also grouped by s3 object), etc
 
     Expected input event format
     {}
     """
-    accounts = load_accounts()
+    account_index = AccountIndex(load_accounts())
     load_user()
     requirements = load_requirements()
+    refresh_bootstrap(account_index)
 
     return {
-        'accountIds': list({a['accountId'] for a in accounts}),
-        'payerIds': list({a.get('payer_id') for a in accounts if a.get('payer_id')}),
+        'accountIds': list(account_index.accounts),
+        'payerIds': account_index.payer_ids(),
         's3RequirementIds': list({r_id for r_id, r in requirements['requirements'].items() if r.get('source') == 's3Import'}),
+        's3RequirementGroups': group_s3_requirements(requirements['requirements']),
         'cloudsploitSettingsMap': requirements['cloudsploitSettingsMap']
     }
 
 
-def load_accounts():
-    """Syncs accounts in accounts table with those present in the S3 bucket"""
-    account_ids_to_delete = []
-    accounts_to_add = []
+def refresh_bootstrap(account_index: AccountIndex) -> None:
+    """
+    Rebuilds and saves the bootstrap document. Errors are only logged, the user status api builds
+    the document itself while it is missing, and a stale one is replaced by the next scan.
+    """
+    try:
+        bootstrap.save_bootstrap(bootstrap.build_bootstrap(account_index=account_index))
+    except Exception: # pylint: disable=broad-except
+        logger.exception('Unable to refresh the bootstrap document')
 
-    s3_response = client_s3.get_object(Bucket=account_bucket, Key=os.getenv('ACCOUNT_FILE_PATH'))
-    account_list_from_s3 = json.loads(s3_response['Body'].read())['accounts']
 
-    for account in account_list_from_s3:
-        accounts_table.normalize_account_record(account)
+def group_s3_requirements(requirements: dict) -> List[List[str]]:
+    """
+    :param requirements: all requirements, by id
+    :return: ids of the s3 import requirements, grouped by the s3 object they import from
+    """
+    groups: Dict[tuple, List[str]] = {}
+    for requirement_id, requirement in requirements.items():
+        if requirement.get('source') != 's3Import':
+            continue
+        s3_import = requirement.get('s3Import') or {}
+        location = (s3_import.get('s3Bucket'), s3_import.get('s3Key')) if s3_import.get('s3Key') else (None, requirement_id)
+        groups.setdefault(location, []).append(requirement_id)
+    return list(groups.values())
 
-    accounts_from_s3 = {account['accountId']: account for account in account_list_from_s3}
 
-    ddb_data = accounts_table.scan_all()
-    accounts_from_ddb = {account['accountId']: account for account in ddb_data}
+def get_sync_state(source: str) -> dict:
+    """
+    :param source: name of the imported file, e.g. accounts
+    :return: etag and per item content hashes of the file as of its last sync, empty if it was never synced
+    """
+    try:
+        s3_response = client_s3.get_object(Bucket=scorecard_bucket, Key=f'{SYNC_STATE_PREFIX}/{source}.json')
+    except ClientError as err:
+        logger.info('No sync state for %s: %s', source, err)
+        return {}
+    return json.loads(s3_response['Body'].read())
+
+
+def save_sync_state(source: str, etag: Optional[str], hashes: Dict[str, str]) -> None:
+    client_s3.put_object(
+        Bucket=scorecard_bucket,
+        Key=f'{SYNC_STATE_PREFIX}/{source}.json',
+        Body=json.dumps({'etag': etag, 'hashes': hashes}).encode('utf-8'),
+        ContentType='application/json',
+    )
 
-    for account_id in accounts_from_ddb:
-        if account_id in accounts_from_s3:
-            if accounts_from_ddb[account_id] != accounts_from_s3[account_id]:
-                accounts_to_add.append(accounts_from_s3[account_id])
-        else:
-            account_ids_to_delete.append(account_id)
 
-    for account_id in accounts_from_s3:
-        if account_id not in accounts_from_ddb:
-            accounts_to_add.append(accounts_from_s3[account_id])
+def hash_serializer(value):
+    """Numbers read from dynamodb or parsed from a stream are Decimals, whole ones hash like ints"""
+    if isinstance(value, Decimal) and value == value.to_integral_value():
+        return int(value)
+    return str(value)
 
-    with accounts_table.batch_writer() as batch:
-        for account_id in account_ids_to_delete:
-            batch.delete_item(Key={'accountId': account_id})
-        for account in accounts_to_add:
-            batch.put_item(Item=account)
+
+def content_hash(item: dict) -> str:
+    """Hash of an item's content, the same for a record read from s3 or from dynamodb"""
+    return hashlib.sha1(json.dumps(item, sort_keys=True, default=hash_serializer).encode('utf-8')).hexdigest()
+
+
+def get_changes(items: Dict[str, dict], known_hashes: Dict[str, str]) -> Tuple[List[str], List[str]]:
+    """
+    :param items: current items, by key
+    :param known_hashes: content hashes of the items as last written, by key
+    :return: keys of the items that are new or changed, and keys of the items that are gone
+    """
+    changed = [key for key, item in items.items() if known_hashes.get(key) != content_hash(item)]
+    removed = [key for key in known_hashes if key not in items]
+    return changed, removed
+
+
+def load_accounts():
+    """
+    Syncs accounts in accounts table with those present in the S3 bucket.
+    Nothing is written if the file is unchanged since the last sync, otherwise only the accounts
+    whose content hash changed are, without scanning the table.
+    """
+    s3_response = client_s3.get_object(Bucket=account_bucket, Key=os.getenv('ACCOUNT_FILE_PATH'))
+    account_list_from_s3 = []
+    for account in ijson.items(s3_response['Body'], 'accounts.item'):
+        accounts_table.normalize_account_record(account)
+        account_list_from_s3.append(account)
+
+    etag = s3_response.get('ETag')
+    sync_state = get_sync_state(ACCOUNTS_SOURCE)
+    if etag and sync_state.get('etag') == etag:
+        logger.info('Accounts file unchanged, skipping sync')
+        return account_list_from_s3
+
+    accounts_from_s3 = {account['accountId']: account for account in account_list_from_s3}
+    if 'hashes' in sync_state:
+        known_hashes = sync_state['hashes']
+    else:
+        known_hashes = {account['accountId']: content_hash(account) for account in accounts_table.scan_all()}
+    account_ids_to_add, account_ids_to_delete = get_changes(accounts_from_s3, known_hashes)
+
+    accounts_table.batch_write_items(
+        put_items=[accounts_from_s3[account_id] for account_id in account_ids_to_add],
+        delete_keys=[{'accountId': account_id} for account_id in account_ids_to_delete],
+    )
+    save_sync_state(ACCOUNTS_SOURCE, etag, {account_id: content_hash(account) for account_id, account in accounts_from_s3.items()})
 
     return account_list_from_s3
 
 
 def load_user():
     """Syncs users in user's table with those present in S3 bucket,
-    ensures admin permissions are retained"""
-    user_emails_to_delete = []
-    users_to_add = []
-
+    ensures admin permissions are retained.
+    Like accounts, only users whose content hash changed are written."""
     s3_response = client_s3.get_object(Bucket=user_bucket, Key=os.getenv('USER_FILE_PATH'))
-    user_list_from_s3 = json.loads(s3_response['Body'].read())
-
+    user_list_from_s3 = []
     users_from_s3 = {}
-    for user in user_list_from_s3:
+    for user in ijson.items(s3_response['Body'], 'item'):
         user['email'] = user['email'].lower()
+        user_list_from_s3.append(user)
         users_from_s3[user['email']] = user
 
-    ddb_data = user_table.scan_all()
-    users_from_ddb = {user['email']: user for user in ddb_data}
-
-    for user_email, existing_user in users_from_ddb.items():
-        if user_email in users_from_s3:
-            if existing_user != users_from_s3[user_email]:
-                if existing_user.get('isAdmin', False):
-                    # update incoming user
-                    users_to_add.append(dict(
-                        users_from_s3[user_email],
-                        **{
-                            'isAdmin': existing_user.get('isAdmin'),
-                        }))
-                else:
-                    users_to_add.append(users_from_s3[user_email])
-        else:
-            if existing_user.get('isAdmin', False):
-                users_to_add.append({
-                    'email': existing_user.get('email'),
-                    'isAdmin': existing_user.get('isAdmin'),
-                })
-            else:
-                user_emails_to_delete.append(user_email)
+    etag = s3_response.get('ETag')
+    sync_state = get_sync_state(USERS_SOURCE)
+    if etag and sync_state.get('etag') == etag:
+        logger.info('Users file unchanged, skipping sync')
+        return user_list_from_s3
+
+    if 'hashes' in sync_state:
+        known_hashes = sync_state['hashes']
+        user_emails_to_add, removed_emails = get_changes(users_from_s3, known_hashes)
+        # admin is only set in the table, so look it up for every user about to be written or deleted. New users of the
+        # file can already be in the table without a hash, e.g. admins added by hand or kept after leaving the file
+        users_from_ddb = {
+            user['email']: user
+            for user in user_table.batch_get_items(
+                [{'email': user_email} for user_email in user_emails_to_add + removed_emails], ProjectionExpression='email, isAdmin'
+            )
+        }
+    else:
+        users_from_ddb = {user['email']: user for user in user_table.scan_all()}
+        user_emails_to_add, removed_emails = get_changes(
+            users_from_s3, {user_email: content_hash(user) for user_email, user in users_from_ddb.items()})
 
-    for user_email in users_from_s3:
-        if user_email not in users_from_ddb:
+    users_to_add = []
+    for user_email in user_emails_to_add:
+        existing_user = users_from_ddb.get(user_email, {})
+        if existing_user.get('isAdmin', False):
+            # update incoming user
+            users_to_add.append(dict(
+                users_from_s3[user_email],
+                **{
+                    'isAdmin': existing_user.get('isAdmin'),
+                }))
+        else:
             users_to_add.append(users_from_s3[user_email])
 
-    with user_table.batch_writer() as batch:
-        for user_email in user_emails_to_delete:
-            batch.delete_item(Key={'email': user_email})
-        for user in users_to_add:
-            batch.put_item(Item=user)
+    user_emails_to_delete = []
+    for user_email in removed_emails:
+        existing_user = users_from_ddb.get(user_email, {})
+        if existing_user.get('isAdmin', False):
+            users_to_add.append({
+                'email': user_email,
+                'isAdmin': existing_user.get('isAdmin'),
+            })
+        else:
+            user_emails_to_delete.append(user_email)
+
+    user_table.batch_write_items(
+        put_items=users_to_add,
+        delete_keys=[{'email': user_email} for user_email in user_emails_to_delete],
+    )
+    save_sync_state(USERS_SOURCE, etag, {user_email: content_hash(user) for user_email, user in users_from_s3.items()})
 
     return user_list_from_s3
 
@@ -131,7 +234,7 @@ def load_requirements():
     requirements in requirements table along with
     various other configs"""
     s3_response = client_s3.get_object(Bucket=requirements_bucket, Key=os.getenv('REQUIREMENTS_FILE_PATH'))
-    requirements_file = yaml.safe_load(s3_response['Body'].read())
+    requirements_file = yaml.safe_load(s3_response['Body'])
 
     cloudsploit_settings_map = requirements_file['cloudsploitSettings']
     severity_weight_map = requirements_file['severityWeightings']
@@ -146,7 +249,7 @@ def load_requirements():
         requirement['requirementId'] = requirement_id
         requirement['weight'] = severity_weight_map[requirement['severity']]
 
-    update_requirements(requirements)
+    update_requirements(requirements, s3_response.get('ETag'))
 
     update_exclusion_types(exclusion_types)
     update_version(version)
@@ -160,31 +263,26 @@ def load_requirements():
     }
 
 
-def update_requirements(requirements):
+def update_requirements(requirements, etag=None):
     """Syncs requirements in requirements table
-    with the parameters that are passed"""
-    requirement_ids_to_delete = []
-    reqs_to_add = []
-    # load requirements saved in dynamodb
-    ddb_data = requirements_table.scan_all()
-    requirements_from_ddb = {requirement['requirementId']: requirement for requirement in ddb_data}
-
-    for requirement_id in requirements_from_ddb:
-        if requirement_id in requirements:
-            if requirements_from_ddb[requirement_id] != requirements[requirement_id]:
-                reqs_to_add.append(requirements[requirement_id])
-        else:
-            requirement_ids_to_delete.append(requirement_id)
-
-    for requirement_id in requirements:
-        if requirement_id not in requirements_from_ddb:
-            reqs_to_add.append(requirements[requirement_id])
-
-    with requirements_table.batch_writer() as batch:
-        for requirement_id in requirement_ids_to_delete:
-            batch.delete_item(Key={'requirementId': requirement_id})
-        for requirement in reqs_to_add:
-            batch.put_item(Item=requirement)
+    with the parameters that are passed, skipped if the requirements file's etag is unchanged"""
+    sync_state = get_sync_state(REQUIREMENTS_SOURCE)
+    if etag and sync_state.get('etag') == etag:
+        logger.info('Requirements file unchanged, skipping sync')
+        return
+
+    if 'hashes' in sync_state:
+        known_hashes = sync_state['hashes']
+    else:
+        # load requirements saved in dynamodb
+        known_hashes = {requirement['requirementId']: content_hash(requirement) for requirement in requirements_table.scan_all()}
+    requirement_ids_to_add, requirement_ids_to_delete = get_changes(requirements, known_hashes)
+
+    requirements_table.batch_write_items(
+        put_items=[requirements[requirement_id] for requirement_id in requirement_ids_to_add],
+        delete_keys=[{'requirementId': requirement_id} for requirement_id in requirement_ids_to_delete],
+    )
+    save_sync_state(REQUIREMENTS_SOURCE, etag, {requirement_id: content_hash(requirement) for requirement_id, requirement in requirements.items()})
 
 
 def update_version(version):
@@ -0,0 +1,214 @@
+"""
+Incremental re-scoring of the latest scan after exclusions change, so its NCRs, scores and account spreadsheets
+reflect the change before the next scan. Only the NCRs the changed exclusions can match are re-evaluated,
+and only the scores of the (account, requirement) pairs and accounts they belong to are recomputed.
+"""
+import fnmatch
+import json
+import numbers
+import os
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import boto3
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import Decimal
+from botocore.exceptions import ClientError
+
+from lib.dynamodb import account_scores_table, accounts_table, exclusions_table, ncr_table, scores_table
+from lib.logger import logger
+from states.exclude import clear_ncr_exclusion, exclusion_prioritizer, group_exclusions, match_exclusions, pick_exclusion, update_ncr_exclusion
+
+SPREADSHEETS_FUNCTION = os.getenv('SPREADSHEETS_FUNCTION')
+MAX_WORKERS = 8  # exclusion queries in flight
+lambda_client = boto3.client('lambda')
+
+
+class RescoreResult(NamedTuple):
+    ncrs: int  # ncrs whose exclusion changed
+    scores: int  # requirement scores that changed
+    account_ids: List[str]  # accounts with requirement scores that changed
+
+
+def rescore_exclusions(scan_id: str, changed_exclusions: Iterable[dict], exclusion_types: dict, partition_key: Optional[str] = None,
+                       account_ids: Optional[List[str]] = None) -> RescoreResult:
+    """
+    Re-applies exclusions to the ncrs of the scan the changed exclusions match, or matched before they changed,
+    then recomputes the scores of the affected accounts and queues the regeneration of their spreadsheets.
+
+    :param changed_exclusions: exclusions as they are now and, for deleted or replaced exclusions, as they were
+    :param exclusion_types: exclusion type configs
+    :param partition_key: only rescore the ncrs under this partition key of the scan, see get_partition_keys
+    :param account_ids: only rescore the ncrs of these accounts, see get_account_ids
+    """
+    prioritizer = partial(exclusion_prioritizer, exclusion_types)
+    changed_ncrs = []
+    pair_ncrs: Dict[Tuple[str, str], list] = {}
+    affected_pairs = set()
+    for requirement_id, exclusions in group_by_requirement(changed_exclusions).items():
+        ncrs = get_requirement_ncrs(scan_id, requirement_id, {exclusion['accountId'] for exclusion in exclusions}, partition_key, account_ids)
+        grouped_exclusions = group_exclusions(get_requirement_exclusions(requirement_id, {ncr['accountId'] for ncr in ncrs}))
+        matches_resource = resource_matcher(exclusions)
+        for ncr in ncrs:
+            pair_ncrs.setdefault((ncr['accountId'], requirement_id), []).append(ncr)
+            if not matches_resource(ncr['resourceId']):
+                continue
+            affected_pairs.add((ncr['accountId'], requirement_id))
+            before = exclusion_state(ncr)
+            ncr_exclusion = pick_exclusion(match_exclusions(ncr, grouped_exclusions), prioritizer)
+            if ncr_exclusion:
+                update_ncr_exclusion(ncr, ncr_exclusion, exclusion_types)
+            else:
+                clear_ncr_exclusion(ncr)
+            if exclusion_state(ncr) != before:
+                changed_ncrs.append(ncr)
+    ncr_table.batch_put_records(changed_ncrs)
+
+    # the ncrs may have been updated before, e.g. by the api changing the exclusion, so all matched pairs are rescored
+    changed_scores = rescore_requirements(scan_id, {pair: pair_ncrs[pair] for pair in affected_pairs})
+    account_ids = list(dict.fromkeys(score['accountId'] for score in changed_scores))
+    rescore_accounts(scan_id, account_ids)
+    queue_spreadsheets(scan_id, account_ids)
+
+    logger.info('Rescored %d ncrs, %d scores and %d accounts of scan %s', len(changed_ncrs), len(changed_scores), len(account_ids), scan_id)
+    return RescoreResult(len(changed_ncrs), len(changed_scores), account_ids)
+
+
+def group_by_requirement(exclusions: Iterable[dict]) -> Dict[str, List[dict]]:
+    grouped = defaultdict(list)
+    for exclusion in exclusions:
+        if exclusion:
+            grouped[exclusion['requirementId']].append(exclusion)
+    return grouped
+
+
+def resource_matcher(exclusions: Iterable[dict]) -> Callable[[str], bool]:
+    """
+    :return: function telling if a resource id matches the resource id pattern of any of the exclusions,
+    the patterns compiled into a single regular expression instead of matching them one by one per ncr
+    """
+    pattern = re.compile('|'.join(fnmatch.translate(exclusion['resourceId']) for exclusion in exclusions))
+    return lambda resource_id: pattern.match(resource_id) is not None
+
+
+def get_partition_keys(scan_id: str, exclusions: Iterable[dict]) -> List[str]:
+    """
+    :return: partition keys of the scan holding the ncrs the exclusions can match, all of them for exclusions of all accounts
+    """
+    account_ids = {exclusion['accountId'] for exclusion in exclusions if exclusion}
+    if '*' in account_ids:
+        return ncr_table.partition_keys(scan_id)
+    return sorted({ncr_table.partition_key(scan_id, account_id) for account_id in account_ids})
+
+
+def get_account_ids(exclusions: Iterable[dict]) -> List[str]:
+    """
+    :return: accounts holding the ncrs the exclusions can match, all accounts for exclusions of all accounts
+    """
+    account_ids = {exclusion['accountId'] for exclusion in exclusions if exclusion}
+    if '*' in account_ids:
+        account_ids = {account['accountId'] for account in accounts_table.scan_all(ProjectionExpression='accountId')}
+    return sorted(account_ids)
+
+
+def exclusion_state(ncr: dict) -> tuple:
+    return ncr.get('exclusionApplied', False), ncr.get('isHidden', False), ncr.get('exclusion', {})
+
+
+def get_requirement_ncrs(scan_id: str, requirement_id: str, account_ids: set, partition_key: Optional[str] = None,
+                         only_account_ids: Optional[List[str]] = None) -> list:
+    """
+    :param account_ids: account ids of the exclusions, '*' for all accounts
+    :param partition_key: only get the ncrs under this partition key of the scan
+    :param only_account_ids: only get the ncrs of these accounts
+    :return: all ncrs of the requirement in the accounts
+    """
+    if only_account_ids is not None:
+        account_ids = set(only_account_ids) if '*' in account_ids else account_ids & set(only_account_ids)
+    elif '*' in account_ids:
+        requirement_condition = Key('rqrmntId_accntId').begins_with(f'{requirement_id}#')
+        if partition_key:
+            return ncr_table.query_all(**ncr_table.build_query(partition_key, requirement_condition, IndexName='by-scanId'))
+        return ncr_table.query_scan(scan_id, requirement_condition, IndexName='by-scanId')
+    if partition_key:
+        account_ids = {account_id for account_id in account_ids if ncr_table.partition_key(scan_id, account_id) == partition_key}
+    return [
+        ncr for account_id in sorted(account_ids)
+        for ncr in ncr_table.get_all_account_ncrs_by_requirement_id(scan_id, account_id, requirement_id)
+    ]
+
+
+def get_requirement_exclusions(requirement_id: str, account_ids: set) -> list:
+    """
+    :return: exclusions of the requirement that can apply to ncrs of the accounts, wildcard account exclusions included,
+    queried per account in parallel
+    """
+    def query_account(account_id):
+        return exclusions_table.query_all(
+            KeyConditionExpression=Key('accountId').eq(account_id) & Key('rqrmntId_rsrceRegex').begins_with(f'{requirement_id}#')
+        )
+
+    account_ids = ['*', *sorted(account_ids - {'*'})]
+    with ThreadPoolExecutor(max_workers=min(len(account_ids), MAX_WORKERS)) as executor:
+        return [exclusion for exclusions in executor.map(query_account, account_ids) for exclusion in exclusions]
+
+
+def rescore_requirements(scan_id: str, pair_ncrs: Dict[Tuple[str, str], list]) -> list:
+    """
+    Recounts the failing resources of (account, requirement) pairs, as the score step does
+
+    :param pair_ncrs: all ncrs of each pair, with their exclusions applied
+    :return: scores that changed, as written
+    """
+    changed_scores = []
+    for (account_id, requirement_id), ncrs in pair_ncrs.items():
+        score = scores_table.get_score(scan_id, account_id, requirement_id)
+        num_failing = Decimal(sum(1 for ncr in ncrs if not ncr.get('exclusionApplied', False)))
+        changed = False
+        for score_object in score.get('score', {}).values():
+            # data not collected, not applicable and not yet scored requirements are left as they are
+            if isinstance(score_object['numFailing'], numbers.Number) and score_object['numFailing'] != num_failing:
+                score_object['numFailing'] = num_failing
+                changed = True
+        if changed:
+            changed_scores.append(score)
+    scores_table.batch_put_records(changed_scores)
+    return changed_scores
+
+
+def rescore_accounts(scan_id: str, account_ids: List[str]) -> None:
+    """Recomputes the overall score records of the accounts for the scan, and their score history"""
+    date = scan_id[0:10]
+    account_scores = []
+    for account_id in account_ids:
+        account_score = account_scores_table.get_item(Key={'accountId': account_id, 'date': date}).get('Item')
+        if not account_score or account_score.get('scanId') != scan_id:
+            continue
+        account_score['score'] = scores_table.weighted_score_aggregate_calc(scores_table.get_account_scores(scan_id, account_id))
+        account_scores.append(account_score)
+
+    histories = account_scores_table.get_histories([account_score['accountId'] for account_score in account_scores])
+    account_scores.extend([
+        account_scores_table.update_history(histories.get(account_score['accountId']), account_score)
+        for account_score in account_scores
+    ])
+    account_scores_table.batch_put_records(account_scores)
+
+
+def queue_spreadsheets(scan_id: str, account_ids: List[str]) -> None:
+    """Invokes the spreadsheet generation of each account asynchronously, with the scores cached for the scan refreshed"""
+    if not SPREADSHEETS_FUNCTION:
+        logger.warning('No spreadsheet function configured, not regenerating spreadsheets of %d accounts', len(account_ids))
+        return
+    for account_id in account_ids:
+        try:
+            lambda_client.invoke(
+                FunctionName=SPREADSHEETS_FUNCTION,
+                InvocationType='Event',
+                Payload=json.dumps({'openScan': {'scanId': scan_id}, 'accountId': account_id, 'refresh': True}).encode('utf-8'),
+            )
+        except ClientError as err:
+            logger.warning('Unable to queue spreadsheet of account %s: %s', account_id, err)
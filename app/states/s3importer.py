@@ -3,77 +3,101 @@ This module provides an entry point to the logic for the
 S3 Import Map Iterator.
 """
 import datetime
-import json
+from typing import Dict, Tuple
+
+import ijson
 
 from lib.dynamodb import ncr_table, requirements_table, scores_table
 from lib.lambda_decorator.decorator import states_decorator
-from lib.s3.s3_buckets import S3
+from lib.s3 import s3_buckets
 from lib.logger import logger
 
+NCR_WRITE_BATCH_SIZE = 5000  # ncrs held before they are written
+MAX_S3_OBJECT_AGE = datetime.timedelta(hours=24)
+
 @states_decorator
 def s3import_handler(event, context=None):
     """
     Imports NCRs from S3 based on requirement definition.
-    Add scores for all accounts for the requirement
+    Add scores for all accounts for the requirement.
+    Requirements importing from the same s3 object can be imported together,
+    the object is then downloaded and parsed once for all of them.
 
     Expected input event format
     {
         "accountIds": list of account_ids
         "scanId": scan_id,
-        "requirementId": requirement_id
+        "requirementId": requirement_id, or
+        "requirementIds": list of requirement_ids sharing an s3 object
     }
     """
     all_account_ids = event['accountIds']
-    requirement_id = event['requirementId']
+    requirement_ids = event.get('requirementIds') or [event['requirementId']]
     scan_id = event['scanId']
-    requirement_def = requirements_table.get_item(Key={'requirementId': requirement_id})['Item']
-    s3_key = requirement_def['s3Import']['s3Key']
-    s3_import_bucket_name = requirement_def['s3Import']['s3Bucket']
-    if requirement_def.get('ignore', False):
-        logger.info('Nothing to do. Ignoring s3 import requirement: %s', requirement_id)
+    requirement_defs = []
+    for requirement_id in requirement_ids:
+        requirement_def = requirements_table.get_item(Key={'requirementId': requirement_id})['Item']
+        if requirement_def.get('ignore', False):
+            logger.info('Nothing to do. Ignoring s3 import requirement: %s', requirement_id)
+        else:
+            requirement_defs.append(requirement_def)
+    if not requirement_defs:
         return
 
     if not isinstance(scan_id, str):
         raise TypeError(f'scanId should be str, not {type(scan_id)}')
 
+    s3_key = requirement_defs[0]['s3Import']['s3Key']
+    s3_import_bucket_name = requirement_defs[0]['s3Import']['s3Bucket']
     if not isinstance(s3_key, str):
         raise TypeError(f's3key should be str, not {type(s3_key)}')
+    for requirement_def in requirement_defs:
+        if (requirement_def['s3Import']['s3Bucket'], requirement_def['s3Import']['s3Key']) != (s3_import_bucket_name, s3_key):
+            raise ValueError(f'requirement {requirement_def["requirementId"]} does not import from s3://{s3_import_bucket_name}/{s3_key}')
 
-    response = S3.get_object(Bucket=s3_import_bucket_name, Key=s3_key)
-    last_update_time = response['LastModified'].replace(tzinfo=None)
-    if datetime.datetime.utcnow() - last_update_time > datetime.timedelta(hours=24):
-        raise Exception(f's3 object too old, key: {s3_key}, bucket: {s3_import_bucket_name}')
-    result = json.loads(response['Body'].read())
+    # stale objects are refused by s3 before they are downloaded
+    response = s3_buckets.get_fresh_object(s3_import_bucket_name, s3_key, MAX_S3_OBJECT_AGE)
 
-    ncrs_to_put = []
-    scores_to_put = []
+    expected_account_ids = set(all_account_ids)
+    imported_account_ids = set()
+    # by table key, a batch write can't hold the same key twice. Later records of a key replace earlier ones
+    ncrs_to_put: Dict[Tuple[str, str], dict] = {}
+    scores_to_put: Dict[Tuple[str, str], dict] = {}
 
-    for account_id, import_object in result.items():
+    # each account's import object is parsed as it is read, rather than the whole file at once
+    for account_id, import_object in ijson.kvitems(s3_buckets.open_body(response, s3_key), ''):
         num_resources = import_object['totalResourceCount']
 
-        try:
-            all_account_ids.remove(account_id)
-        except ValueError:
+        if account_id in imported_account_ids:
+            logger.warning('Account %s found more than once in import, its later records replace the earlier ones', account_id)
+        elif account_id not in expected_account_ids:
             logger.warning('Account %s found in import but not present in accounts table', account_id)
+        imported_account_ids.add(account_id)
 
         for failing_resource in import_object['failingResources']:
-            failing_resource['requirementId'] = requirement_id  # overwrite reqId from import_object
-            ncrs_to_put.append(
-                ncr_table.new_ncr_record(failing_resource, scan_id)
-            )
-        scores_to_put.append(
-            scores_table.new_score(scan_id, account_id, requirement_def, num_resources)
-        )
+            for requirement_def in requirement_defs:
+                # overwrite reqId from import_object
+                ncr = ncr_table.new_ncr_record({**failing_resource, 'requirementId': requirement_def['requirementId']}, scan_id)
+                ncrs_to_put[ncr['scanId'], ncr['accntId_rsrceId_rqrmntId']] = ncr
+        for requirement_def in requirement_defs:
+            score = scores_table.new_score(scan_id, account_id, requirement_def, num_resources)
+            scores_to_put[score['scanId'], score['accntId_rqrmntId']] = score
+        # write as we go so org wide imports don't hold every ncr in memory
+        if len(ncrs_to_put) >= NCR_WRITE_BATCH_SIZE:
+            ncr_table.batch_put_records(list(ncrs_to_put.values()))
+            ncrs_to_put = {}
 
-    for missing_account in all_account_ids:  # accounts present in the s3 import were removed from this list
-        scores_to_put.append(
-            scores_table.new_score(
+    for missing_account in dict.fromkeys(all_account_ids):
+        if missing_account in imported_account_ids:
+            continue
+        for requirement_def in requirement_defs:
+            score = scores_table.new_score(
                 scan_id,
                 missing_account,
                 requirement_def,
                 scores_table.DATA_NOT_COLLECTED,
                 scores_table.DATA_NOT_COLLECTED
             )
-        )
-    ncr_table.batch_put_records(ncrs_to_put)
-    scores_table.batch_put_records(scores_to_put)
+            scores_to_put[score['scanId'], score['accntId_rqrmntId']] = score
+    ncr_table.batch_put_records(list(ncrs_to_put.values()))
+    scores_table.batch_put_records(list(scores_to_put.values()))
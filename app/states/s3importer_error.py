@@ -13,18 +13,19 @@ from lib.lambda_decorator.decorator import states_decorator
 def s3import_error_handler(event, context=None):
     """
     Creates DNC scores for all accounts for the provided
-    requirement id
+    requirement id, or each of the requirement ids imported together
 
     Expected input event format
     {
        "scanId": scan_id,
-       "requirementId": requirement_id
+       "requirementId": requirement_id, or
+       "requirementIds": list of requirement_ids
     }
 
     """
     scan_id = event['scanId']
-    requirement_id = event['requirementId']
-    requirement_def = requirements_table.get_item(Key={'requirementId': requirement_id})['Item']
+    requirement_ids = event.get('requirementIds') or [event['requirementId']]
+    requirement_defs = [requirements_table.get_item(Key={'requirementId': requirement_id})['Item'] for requirement_id in requirement_ids]
     unique_account_ids = set(event['accountIds'])
 
     if not isinstance(scan_id, str):
@@ -32,16 +33,17 @@ def s3import_error_handler(event, context=None):
 
     scores_to_put = []
 
-    for missing_account in unique_account_ids:
-        scores_to_put.append(
-            scores_table.new_score(
-                scan_id,
-                missing_account,
-                requirement_def,
-                scores_table.DATA_NOT_COLLECTED,
-                scores_table.DATA_NOT_COLLECTED
+    for requirement_def in requirement_defs:
+        for missing_account in unique_account_ids:
+            scores_to_put.append(
+                scores_table.new_score(
+                    scan_id,
+                    missing_account,
+                    requirement_def,
+                    scores_table.DATA_NOT_COLLECTED,
+                    scores_table.DATA_NOT_COLLECTED
+                )
             )
-        )
     scores_table.batch_put_records(scores_to_put)
 
     scans_table.add_error(event['scanId'], context.function_name, event['error'])
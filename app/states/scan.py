@@ -11,7 +11,8 @@ from lib.lambda_decorator.decorator import states_decorator
 @states_decorator
 def open_handler(event, context):
     """
-    Adds a new entry to scans-table with a randomly generated scan_id and TTL of 30 days
+    Adds a new entry to scans-table with a randomly generated scan_id, the number of shards
+    its NCRs and scores are spread over and TTL of 30 days
 
     Expected input event format
     {}
@@ -22,6 +23,7 @@ def open_handler(event, context):
             'scan': scans_table.SCAN,
             'processState': scans_table.IN_PROGRESS,
             'scanId': scan_id,
+            'shards': scans_table.shards,
             'ttl': int(time.time()) + 2592000,  # Adding 30 days to current time
         }
     )
@@ -36,6 +38,7 @@ def open_handler(event, context):
 def close_handler(event, context):
     """
     Updates the specific scan_id entry in scans-table to completed
+    and points the latest completed scan record at it
 
     Expected input event format
     {
@@ -50,6 +53,7 @@ def close_handler(event, context):
         ExpressionAttributeValues={':updated_state': scans_table.COMPLETED},
         ReturnValues='UPDATED_NEW',
     )
+    scans_table.set_latest_complete_scan(scan_id)
 
     return {}
 
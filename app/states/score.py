@@ -5,7 +5,6 @@ as well as overall account score.
 from collections import defaultdict
 
 from boto3.dynamodb.types import Decimal
-from boto3.dynamodb.conditions import Key
 
 from lib.dynamodb import account_scores_table, ncr_table, requirements_table, scores_table, accounts_table
 from lib.lambda_decorator.decorator import states_decorator
@@ -33,13 +32,9 @@ def score_calc_handler(event, context):
         account_name = accounts_table.get_account(account_id).get('account_name')
         scores_to_put = {
             record['requirementId']: record
-            for record in scores_table.query_all(
-                KeyConditionExpression=Key('scanId').eq(scan_id) & Key('accntId_rqrmntId').begins_with(account_id)
-            )
+            for record in scores_table.get_account_scores(scan_id, account_id)
         }
-        existing_ncr_records = ncr_table.query_all(
-            KeyConditionExpression=Key('scanId').eq(scan_id) & Key('accntId_rsrceId_rqrmntId').begins_with(account_id),
-        )
+        existing_ncr_records = ncr_table.without_exclusion_lookup().get_all_account_ncrs(scan_id, account_id)
 
         grouped_ncr_data = defaultdict(list)
         for ncr_object in existing_ncr_records:
@@ -78,5 +73,12 @@ def score_calc_handler(event, context):
         }
         all_account_scores.append(account_score)
 
+    # roll the new account scores into each account's score history, read by the account summary api
+    histories = account_scores_table.get_histories(account_ids)
+    all_account_scores.extend([
+        account_scores_table.update_history(histories.get(account_score['accountId']), account_score)
+        for account_score in all_account_scores
+    ])
+
     scores_table.batch_put_records(all_scores_to_put)
     account_scores_table.batch_put_records(all_account_scores)
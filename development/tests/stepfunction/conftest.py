@@ -4,6 +4,8 @@ import json
 import boto3
 import pytest
 
+from tests.stepfunction.helpers import CLOUDSPLOIT_BATCH_SIZE
+
 STEP_FUNCTION_URL = 'http://localhost:8083'
 
 def lambda_arn(name: str) -> str:
@@ -17,7 +19,7 @@ def step_function():
         step_function_definition = file.read()
 
     with open('templates/cloudsploit-iterator.asl.json') as file:
-        cs_iterator_definition = file.read()
+        cs_iterator_definition = file.read().replace('${CloudSploitBatchSize}', str(CLOUDSPLOIT_BATCH_SIZE))
     # Using the hash of the definition lets us not worry about deleting old versions
 
     step_function_name = 'sf-main-' + hashlib.md5(step_function_definition.encode('utf-8')).hexdigest()
@@ -32,10 +34,13 @@ def step_function():
         ['CloudSploitSetup']['Resource'] = lambda_arn('CloudSploitSetup')
     cs_iterator_definition_parsed['States']\
         ['IterateCloudSploitAccounts']['Iterator']['States']\
+        ['CloudSploitError']['Resource'] = lambda_arn('CloudSploitError')
+    cs_iterator_definition_parsed['States']\
+        ['IterateCloudSploitBatches']['Iterator']['States']\
         ['CloudSploitPopulate']['Resource'] = lambda_arn('CloudSploitPopulate')
     cs_iterator_definition_parsed['States']\
-        ['IterateCloudSploitAccounts']['Iterator']['States']\
-        ['CloudSploitError']['Resource'] = lambda_arn('CloudSploitError')
+        ['IterateCloudSploitBatches']['Iterator']['States']\
+        ['CloudSploitBatchError']['Resource'] = lambda_arn('CloudSploitError')
 
     step_function_definition_parsed['States']\
         ['OpenScan']['Resource'] = lambda_arn('OpenScan')
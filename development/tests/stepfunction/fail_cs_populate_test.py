@@ -1,7 +1,7 @@
 import json
 
 from tests.stepfunction.step_function_runner import step_function_run
-from tests.stepfunction.helpers import lambda_response, get_success_expected_calls
+from tests.stepfunction.helpers import get_success_expected_calls
 
 error = {
     'errorMessage': 'division by zero',
@@ -17,8 +17,7 @@ cs_populate_failure['CloudSploitPopulate'][0][0].update({ # inject the failure
 # add the error handler call
 cs_populate_failure['CloudSploitError'] = [
     {
-        'expected': {**cs_populate_failure['CloudSploitSetup'][0][0]['expected'], **{
-            'cloudsploitSetup': lambda_response(cs_populate_failure['CloudSploitSetup'][0][0]['reply']),
+        'expected': {**cs_populate_failure['CloudSploitPopulate'][0][0]['expected'], **{
             'error': {
                 'Error': error['errorType'],
                 'Cause': json.dumps(error)
@@ -1,9 +1,12 @@
+CLOUDSPLOIT_BATCH_SIZE = 10
+
 def lambda_response(payload):
     return payload
 
 def get_success_expected_calls(num_of_accounts=4):
     account_ids = ['000000000000' + str(i + 1) for i in range(num_of_accounts)]
     s3_requirements_ids = ['req1', 'req2', 'req3']
+    s3_requirement_groups = [['req1', 'req2'], ['req3']]
     scan_id = '2020/04/20T12:00:00.123#qwerasdf'
     user_emails = ['a@example.com', 'b@example.com']
     payer_ids = ['p1', 'p2', 'p3']
@@ -40,6 +43,7 @@ def get_success_expected_calls(num_of_accounts=4):
             'reply': {
                 'accountIds': account_ids,
                 's3RequirementIds': s3_requirements_ids,
+                's3RequirementGroups': s3_requirement_groups,
                 'payerIds': payer_ids,
                 'cloudsploitSettingsMap': cloudsploit_settings_map
             }
@@ -48,10 +52,10 @@ def get_success_expected_calls(num_of_accounts=4):
             [{
                 'expected': {
                     'scanId': scan_id,
-                    'requirementId': req,
+                    'requirementIds': group,
                     'accountIds': account_ids
                 }, 'reply': {}
-            } for req in s3_requirements_ids]
+            } for group in s3_requirement_groups]
         ],
         'CloudSploitSetup': [
             [{
@@ -72,13 +76,11 @@ def get_success_expected_calls(num_of_accounts=4):
         'CloudSploitPopulate': [
             [{
                 'expected': {
-                    'accountId': account_id,
                     'scanId': scan_id,
-                    'cloudsploitSetup': lambda_response(cloudsploit_scanner_data),
-                    'cloudsploitSettingsMap': cloudsploit_settings_map
+                    'accountIds': account_ids[index:index + CLOUDSPLOIT_BATCH_SIZE],
                 },
                 'reply': {}
-            } for account_id in account_ids]
+            } for index in range(0, len(account_ids), CLOUDSPLOIT_BATCH_SIZE)]
         ],
         'Exclude': [{
             'expected': {
@@ -86,6 +88,7 @@ def get_success_expected_calls(num_of_accounts=4):
                 'load': {
                     'accountIds': account_ids,
                     's3RequirementIds': s3_requirements_ids,
+                    's3RequirementGroups': s3_requirement_groups,
                     'payerIds': payer_ids,
                     'cloudsploitSettingsMap': cloudsploit_settings_map,
                 },
@@ -98,6 +101,7 @@ def get_success_expected_calls(num_of_accounts=4):
                 'load': {
                     'accountIds': account_ids,
                     's3RequirementIds': s3_requirements_ids,
+                    's3RequirementGroups': s3_requirement_groups,
                     'payerIds': payer_ids,
                     'cloudsploitSettingsMap': cloudsploit_settings_map,
                 },
@@ -111,6 +115,7 @@ def get_success_expected_calls(num_of_accounts=4):
                     'load': {
                         'accountIds': account_ids,
                         's3RequirementIds': s3_requirements_ids,
+                        's3RequirementGroups': s3_requirement_groups,
                         'payerIds': payer_ids,
                         'cloudsploitSettingsMap': cloudsploit_settings_map,
                     },
@@ -128,6 +133,7 @@ def get_success_expected_calls(num_of_accounts=4):
                     'load': {
                         'accountIds': account_ids,
                         's3RequirementIds': s3_requirements_ids,
+                        's3RequirementGroups': s3_requirement_groups,
                         'payerIds': payer_ids,
                         'cloudsploitSettingsMap': cloudsploit_settings_map,
                     },
@@ -163,6 +169,7 @@ def get_success_expected_calls(num_of_accounts=4):
                 'load': {
                     'accountIds': account_ids,
                     's3RequirementIds': s3_requirements_ids,
+                    's3RequirementGroups': s3_requirement_groups,
                     'payerIds': payer_ids,
                     'cloudsploitSettingsMap': cloudsploit_settings_map,
                 },
@@ -101,11 +101,11 @@ DESIRED_OUTPUT = {
 
 
 class TestAccountDetailedScores:
-    @patch.object(accounts_table, 'get_account')
+    @patch.object(accounts_table, 'get_accounts')
     @patch.object(user_table, 'get_user')
     @patch.object(scans_table, 'get_latest_complete_scan')
-    def test_valid_event(self, mock_query_scans, mock_get_user, mock_get_account):
-        mock_get_account.side_effect = TEST_ACCOUNTS
+    def test_valid_event(self, mock_query_scans, mock_get_user, mock_get_accounts):
+        mock_get_accounts.return_value = {account['accountId']: account for account in TEST_ACCOUNTS}
         mock_query_scans.return_value = SCAN_ID
         mock_get_user.return_value = {
             'accounts': {
@@ -131,11 +131,11 @@ class TestAccountDetailedScores:
         response = account_detailed_scores_handler(invalid_event, None)
         assert response['statusCode'] == 403
 
-    @patch.object(accounts_table, 'get_account')
+    @patch.object(accounts_table, 'get_accounts')
     @patch.object(user_table, 'get_user')
     @patch.object(scans_table, 'get_latest_complete_scan')
-    def test_admin_user(self, mock_query_scans, mock_get_user, mock_get_account):
-        mock_get_account.side_effect = TEST_ACCOUNTS
+    def test_admin_user(self, mock_query_scans, mock_get_user, mock_get_accounts):
+        mock_get_accounts.return_value = {account['accountId']: account for account in TEST_ACCOUNTS}
         mock_query_scans.return_value = SCAN_ID
         mock_get_user.return_value = {
             'isAdmin': True,
@@ -144,3 +144,16 @@ class TestAccountDetailedScores:
         response = account_detailed_scores_handler(EVENT, None)
         assert response['statusCode'] == 200
         assert loads(response['body']) == DESIRED_OUTPUT
+
+    @patch.object(accounts_table, 'get_accounts')
+    @patch.object(user_table, 'get_user')
+    @patch.object(scans_table, 'get_latest_complete_scan')
+    def test_missing_account(self, mock_query_scans, mock_get_user, mock_get_accounts):
+        mock_get_accounts.return_value = {ACCOUNT_ID: TEST_ACCOUNTS[0]}
+        mock_query_scans.return_value = SCAN_ID
+        mock_get_user.return_value = {
+            'isAdmin': True,
+        }
+
+        response = account_detailed_scores_handler(EVENT, None)
+        assert response['statusCode'] == 404
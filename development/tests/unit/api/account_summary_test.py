@@ -137,3 +137,23 @@ class TestAccountSummary:
         response = account_summary_handler(EVENT, None)
         assert response['statusCode'] == 200
         assert loads(response['body']) == DESIRED_OUTPUT
+
+    @patch.object(S3, 'generate_presigned_url')
+    @patch.object(account_scores_table, 'get_histories')
+    @patch.object(accounts_table, 'get_accounts')
+    @patch.object(user_table, 'get_user')
+    def test_score_history(self, mock_get_user, mock_get_accounts, mock_get_histories, mock_s3_genpresignedurl):
+        mock_get_user.return_value = {'isAdmin': True}
+        mock_get_accounts.return_value = {account['accountId']: account for account in TEST_ACCOUNTS}
+        history = None
+        for record in sorted(TEST_SCORE[:3], key=lambda record: record['date']):
+            history = account_scores_table.update_history(history, record)
+        mock_get_histories.return_value = {
+            ACCOUNT_ID: history,
+            ACCOUNT_ID2: account_scores_table.update_history(None, TEST_SCORE[3]),
+        }
+        mock_s3_genpresignedurl.return_value = 'url-example'
+
+        response = account_summary_handler(EVENT, None)
+        assert response['statusCode'] == 200
+        assert loads(response['body']) == DESIRED_OUTPUT
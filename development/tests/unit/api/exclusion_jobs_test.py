@@ -0,0 +1,207 @@
+import json
+from datetime import datetime
+from unittest.mock import patch, Mock
+
+from botocore.exceptions import ClientError
+
+from api import exclusion_jobs
+from lib.dynamodb import config_table, exclusions_table, scans_table, user_table
+from states import rescore
+from tests.unit.api.test_setup_resources import sample_records
+
+EVENT = {
+    'requestContext': {'authorizer': {'claims': {'email': 'test@test.com'}}},
+    'queryStringParameters': {},
+    'pathParameters': {'jobId': 'job01'},
+}
+SCAN_ID = '2020-06-15T00:00:00#abcdefgh'
+JOB = {
+    'scan': scans_table.EXCLUSION_JOB,
+    'scanId': 'job01',
+    'jobId': 'job01',
+    'rescoreScanId': SCAN_ID,
+    'exclusions': [sample_records.EXCLUSION_APPROVED],
+    'partitionKeys': [f'{SCAN_ID}#0', f'{SCAN_ID}#1'],
+    'workItems': [{'partitionKey': f'{SCAN_ID}#0'}, {'partitionKey': f'{SCAN_ID}#1'}],
+    'processState': scans_table.IN_PROGRESS,
+    'partitions': 2,
+    'partitionsDone': 0,
+    'partitionsFailed': 0,
+}
+
+
+class TestStartExclusionJob:
+    @patch.object(exclusion_jobs, 'EXCLUSION_JOB_FUNCTION', 'exclusion-job-function')
+    @patch.object(exclusion_jobs.lambda_client, 'invoke')
+    @patch.object(rescore, 'get_partition_keys', Mock(return_value=JOB['partitionKeys']))
+    @patch.object(scans_table, 'create_exclusion_job', Mock(return_value=JOB))
+    def test_start_exclusion_job(self, invoke: Mock):
+        job = exclusion_jobs.start_exclusion_job(SCAN_ID, JOB['exclusions'], 'test@test.com')
+        assert job['jobId'] == 'job01'
+        assert 'scan' not in job
+        assert [json.loads(call.kwargs['Payload']) for call in invoke.call_args_list] == [
+            {'jobId': 'job01', 'partitionKey': f'{SCAN_ID}#0'},
+            {'jobId': 'job01', 'partitionKey': f'{SCAN_ID}#1'},
+        ]
+        assert all(call.kwargs['InvocationType'] == 'Event' for call in invoke.call_args_list)
+
+    @patch.object(exclusion_jobs.lambda_client, 'invoke', Mock(side_effect=ClientError({'Error': {'Code': 'TooManyRequestsException'}}, 'Invoke')))
+    @patch.object(rescore, 'get_partition_keys', Mock(return_value=JOB['partitionKeys']))
+    @patch.object(scans_table, 'create_exclusion_job', Mock(return_value=JOB))
+    @patch.object(scans_table, 'add_exclusion_job_progress')
+    def test_start_exclusion_job_invoke_error(self, add_progress: Mock):
+        add_progress.return_value = {**JOB, 'processState': scans_table.ERRORED}
+        job = exclusion_jobs.start_exclusion_job(SCAN_ID, JOB['exclusions'])
+        # partitions that could not be started count as failed, so the job still completes
+        assert add_progress.call_count == 2
+        assert add_progress.call_args.kwargs['error'] == f'{SCAN_ID}#1: unable to start'
+        assert job['processState'] == scans_table.ERRORED
+
+    @patch.object(rescore, 'get_partition_keys', Mock(return_value=[SCAN_ID]))
+    @patch.object(rescore, 'get_account_ids', Mock(return_value=[str(account_id) for account_id in range(120)]))
+    def test_get_work_items_unsharded(self):
+        # a scan with a single partition key is split by account
+        work_items = exclusion_jobs.get_work_items(SCAN_ID, JOB['exclusions'])
+        assert [len(work_item['accountIds']) for work_item in work_items] == [50, 50, 20]
+        assert all(work_item['partitionKey'] == SCAN_ID for work_item in work_items)
+        assert exclusion_jobs.describe_work_item(work_items[2]) == f'{SCAN_ID} accounts 100-119'
+
+    @patch.object(rescore, 'get_partition_keys', Mock(return_value=JOB['partitionKeys']))
+    def test_get_work_items(self):
+        assert exclusion_jobs.get_work_items(SCAN_ID, JOB['exclusions']) == JOB['workItems']
+
+
+class TestGetExclusionJob:
+    @patch.object(user_table, 'get_user', Mock(return_value=sample_records.ADMIN_USER))
+    @patch.object(scans_table, 'get_exclusion_job', Mock(return_value=JOB))
+    def test_get_exclusion_job(self):
+        result = exclusion_jobs.get_exclusion_job_handler(EVENT, None)
+        assert result['statusCode'] == 200
+        body = json.loads(result['body'])
+        assert body['jobId'] == 'job01'
+        assert body['processState'] == scans_table.IN_PROGRESS
+        assert 'scan' not in body
+
+    @patch.object(user_table, 'get_user', Mock(return_value=sample_records.ADMIN_USER))
+    @patch.object(scans_table, 'get_exclusion_job', Mock(return_value={}))
+    def test_get_exclusion_job_not_found(self):
+        result = exclusion_jobs.get_exclusion_job_handler(EVENT, None)
+        assert result['statusCode'] == 404
+
+    @patch.object(user_table, 'get_user', Mock(return_value=sample_records.REGULAR_USER))
+    def test_get_exclusion_job_user(self):
+        result = exclusion_jobs.get_exclusion_job_handler(EVENT, None)
+        assert result['statusCode'] == 403
+
+
+class TestExclusionJobWorker:
+    @patch.object(config_table, 'get_config', Mock(return_value=sample_records.EXCLUSION_TYPES))
+    @patch.object(scans_table, 'get_exclusion_job', Mock(return_value=JOB))
+    @patch.object(scans_table, 'add_exclusion_job_progress')
+    @patch.object(rescore, 'rescore_exclusions')
+    def test_exclusion_job_worker(self, rescore_exclusions: Mock, add_progress: Mock):
+        rescore_exclusions.return_value = rescore.RescoreResult(5, 2, ['123123123123'])
+        add_progress.return_value = {**JOB, 'processState': scans_table.IN_PROGRESS}
+        result = exclusion_jobs.exclusion_job_worker_handler({'jobId': 'job01', 'partitionKey': f'{SCAN_ID}#1'})
+        rescore_exclusions.assert_called_once_with(
+            SCAN_ID, JOB['exclusions'], sample_records.EXCLUSION_TYPES, partition_key=f'{SCAN_ID}#1', account_ids=None
+        )
+        add_progress.assert_called_once_with('job01', ncrs=5, scores=2)
+        assert result == {'jobId': 'job01', 'processState': scans_table.IN_PROGRESS}
+
+    @patch.object(config_table, 'get_config', Mock(return_value=sample_records.EXCLUSION_TYPES))
+    @patch.object(scans_table, 'get_exclusion_job', Mock(return_value=JOB))
+    @patch.object(scans_table, 'add_exclusion_job_progress')
+    @patch.object(rescore, 'rescore_exclusions', Mock(side_effect=Exception('throttled')))
+    def test_exclusion_job_worker_error(self, add_progress: Mock):
+        add_progress.return_value = {**JOB, 'processState': scans_table.ERRORED}
+        result = exclusion_jobs.exclusion_job_worker_handler({'jobId': 'job01', 'partitionKey': f'{SCAN_ID}#1'})
+        add_progress.assert_called_once_with('job01', error=f'{SCAN_ID}#1: throttled')
+        assert result['processState'] == scans_table.ERRORED
+
+
+class TestExclusionJobFailure:
+    @patch.object(scans_table, 'add_exclusion_job_progress')
+    def test_exclusion_job_failure(self, add_progress: Mock):
+        add_progress.return_value = {**JOB, 'processState': scans_table.ERRORED}
+        event = {
+            'requestContext': {'condition': 'RetriesExhausted'},
+            'requestPayload': {'jobId': 'job01', 'partitionKey': SCAN_ID, 'accountIds': ['111111111111', '222222222222']},
+            'responsePayload': {'errorMessage': 'Task timed out after 900.00 seconds'},
+        }
+        result = exclusion_jobs.exclusion_job_failure_handler(event)
+        add_progress.assert_called_once_with('job01', error=f'{SCAN_ID} accounts 111111111111-222222222222: Task timed out after 900.00 seconds')
+        assert result == {'jobId': 'job01', 'processState': scans_table.ERRORED}
+
+        # invocations that expired before running have no response
+        event = {'requestContext': {'condition': 'EventAgeExceeded'}, 'requestPayload': {'jobId': 'job01', 'partitionKey': f'{SCAN_ID}#1'}}
+        exclusion_jobs.exclusion_job_failure_handler(event)
+        assert add_progress.call_args.kwargs['error'] == f'{SCAN_ID}#1: EventAgeExceeded'
+
+
+class TestExpireExclusions:
+    TODAY = datetime.now().strftime('%Y/%m/%d')
+    EXPIRED = {**sample_records.EXCLUSION_APPROVED, 'expirationDate': TODAY}
+    EXPIRED_WILDCARD = {**EXPIRED, 'accountId': '*'}
+
+    @patch.object(scans_table, 'get_latest_complete_scan', Mock(return_value=SCAN_ID))
+    @patch.object(scans_table, 'get_exclusion_sweep', Mock(return_value={}))
+    @patch.object(config_table, 'get_config', Mock(return_value=sample_records.EXCLUSION_TYPES))
+    @patch.object(scans_table, 'set_exclusion_sweep')
+    @patch.object(exclusion_jobs, 'start_exclusion_job')
+    @patch.object(rescore, 'rescore_exclusions')
+    @patch.object(exclusions_table, 'query_by_expiration')
+    def test_expire_exclusions(self, query_by_expiration: Mock, rescore_exclusions: Mock, start_exclusion_job: Mock, set_exclusion_sweep: Mock):
+        query_by_expiration.side_effect = lambda index_name, status, **kwargs: [self.EXPIRED, self.EXPIRED_WILDCARD] if status == 'approved' else []
+        start_exclusion_job.return_value = JOB
+
+        result = exclusion_jobs.expire_exclusions_handler({})
+
+        # exclusions expired by the day of the scan were applied by the scan
+        assert [call.args[1] for call in query_by_expiration.call_args_list] == ['approved', 'initial']
+        assert query_by_expiration.call_args.kwargs['expiring_between'] == ('2020/06/16', self.TODAY)
+        start_exclusion_job.assert_called_once_with(SCAN_ID, [self.EXPIRED_WILDCARD], exclusion_jobs.SWEEPER)
+        rescore_exclusions.assert_called_once_with(SCAN_ID, [self.EXPIRED], sample_records.EXCLUSION_TYPES)
+        set_exclusion_sweep.assert_called_once_with(SCAN_ID, self.TODAY, 'job01', '2020/06/15')
+        assert result == {'scanId': SCAN_ID, 'sweptDate': self.TODAY, 'expired': 2, 'jobId': 'job01'}
+
+    @patch.object(scans_table, 'get_latest_complete_scan', Mock(return_value=SCAN_ID))
+    @patch.object(scans_table, 'get_exclusion_sweep', Mock(return_value={}))
+    @patch.object(scans_table, 'set_exclusion_sweep')
+    @patch.object(exclusion_jobs, 'start_exclusion_job')
+    @patch.object(exclusions_table, 'query_by_expiration')
+    def test_expire_exclusions_job_error(self, query_by_expiration: Mock, start_exclusion_job: Mock, set_exclusion_sweep: Mock):
+        query_by_expiration.side_effect = lambda index_name, status, **kwargs: [self.EXPIRED_WILDCARD] if status == 'approved' else []
+        start_exclusion_job.return_value = {**JOB, 'partitionsFailed': 1}
+        # partitions that failed to start are swept again by the next sweep
+        result = exclusion_jobs.expire_exclusions_handler({})
+        set_exclusion_sweep.assert_not_called()
+        assert result == {'scanId': SCAN_ID, 'sweptDate': '2020/06/15', 'expired': 1, 'jobId': 'job01'}
+
+    @patch.object(scans_table, 'get_exclusion_job')
+    def test_get_swept_date(self, get_exclusion_job: Mock):
+        sweep = {'rescoreScanId': SCAN_ID, 'sweptDate': self.TODAY, 'jobId': 'job01', 'previousSweptDate': '2020/06/16'}
+        get_exclusion_job.return_value = {**JOB, 'processState': scans_table.COMPLETED}
+        assert exclusion_jobs.get_swept_date(SCAN_ID, sweep) == self.TODAY
+        # the job of the last sweep failed, its exclusions are swept again
+        get_exclusion_job.return_value = {**JOB, 'processState': scans_table.ERRORED}
+        assert exclusion_jobs.get_swept_date(SCAN_ID, sweep) == '2020/06/16'
+        assert exclusion_jobs.get_swept_date(SCAN_ID, {**sweep, 'jobId': None}) == self.TODAY
+        assert exclusion_jobs.get_swept_date(SCAN_ID, {}) == '2020/06/15'
+
+    @patch.object(scans_table, 'get_latest_complete_scan', Mock(return_value=SCAN_ID))
+    @patch.object(scans_table, 'set_exclusion_sweep')
+    @patch.object(exclusions_table, 'query_by_expiration')
+    @patch.object(scans_table, 'get_exclusion_sweep')
+    def test_expire_exclusions_swept(self, get_exclusion_sweep: Mock, query_by_expiration: Mock, set_exclusion_sweep: Mock):
+        get_exclusion_sweep.return_value = {'rescoreScanId': SCAN_ID, 'sweptDate': self.TODAY}
+        assert exclusion_jobs.expire_exclusions_handler({})['expired'] == 0
+        query_by_expiration.assert_not_called()
+        set_exclusion_sweep.assert_not_called()
+
+        # a sweep of an older scan does not apply to the latest one
+        get_exclusion_sweep.return_value = {'rescoreScanId': '2020-06-14T00:00:00#abcdefgh', 'sweptDate': self.TODAY}
+        query_by_expiration.return_value = []
+        assert exclusion_jobs.expire_exclusions_handler({})['expired'] == 0
+        assert query_by_expiration.call_args.kwargs['expiring_between'] == ('2020/06/16', self.TODAY)
+        set_exclusion_sweep.assert_called_once_with(SCAN_ID, self.TODAY, None, '2020/06/15')
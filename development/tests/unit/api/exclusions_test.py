@@ -6,7 +6,8 @@ import pytest
 from lib.dynamodb import user_table, exclusions_table, audit_table, requirements_table, scans_table, ncr_table, config_table
 from lib.exclusions import exclusions as exclusions_lib
 from lib.lambda_decorator import exceptions
-from api import exclusions
+from api import exclusion_jobs, exclusions
+from states import rescore
 from tests.unit.api.test_setup_resources import sample_records
 
 
@@ -22,6 +23,32 @@ EVENT = {
 }
 
 
+def create_exclusion(resource_id: str, status: str, expiration_date: str, extra: dict = None) -> dict:
+    return {
+        'accountId': '123123123123',
+        'requirementId': 'requirement01',
+        'resourceId': resource_id,
+        'rqrmntId_rsrceRegex': f'requirement01#{resource_id}',
+        'status': status,
+        'expirationDate': expiration_date,
+        **(extra or {}),
+    }
+
+
+def query_index(stored_exclusions: dict, **kwargs) -> dict:
+    """Query of the by-status index of stored_exclusions, one exclusion per page"""
+    key_condition = kwargs['KeyConditionExpression'].get_expression()['values']
+    status = key_condition[0].get_expression()['values'][1]
+    expiring_before = key_condition[1].get_expression()['values'][1]
+    items = [exclusion for exclusion in stored_exclusions.get(status, []) if exclusion['expirationDate'] < expiring_before]
+    if 'ExclusiveStartKey' in kwargs:
+        start_key = kwargs['ExclusiveStartKey']
+        items = items[[exclusions_table.get_index_key(exclusions_table.STATUS_INDEX, item) for item in items].index(start_key) + 1:]
+    if len(items) > 1:
+        return {'Items': items[:1], 'LastEvaluatedKey': exclusions_table.get_index_key(exclusions_table.STATUS_INDEX, items[0])}
+    return {'Items': items}
+
+
 class TestGetExclusions:
     @patch.object(exclusions_table, 'scan')
     @patch.object(user_table, 'get_user')
@@ -50,8 +77,129 @@ class TestGetExclusions:
         result = exclusions.get_exclusions_handler(EVENT, None)
         assert result['statusCode'] == 403
 
+    @patch.object(user_table, 'get_user', Mock(return_value=sample_records.ADMIN_USER))
+    @patch.object(exclusions_table, 'query')
+    def test_get_exclusions_by_status(self, query: Mock):
+        stored_exclusions = {
+            'initial': [create_exclusion('a', 'initial', '2021/01/01'), create_exclusion('b', 'initial', '2021/03/01')],
+            'approved': [
+                create_exclusion('c', 'approved', '2021/02/01', {'updateRequested': {'expirationDate': '2021/05/01'}}),
+                create_exclusion('d', 'approved', '2021/02/15'),
+                create_exclusion('e', 'approved', '2021/04/01', {'updateRequested': {'expirationDate': '2021/05/01'}}),
+            ],
+        }
+        query.side_effect = lambda **kwargs: query_index(stored_exclusions, **kwargs)
+        event = {
+            **EVENT,
+            'queryStringParameters': {'limit': '2', 'expiringBefore': '2021/06/01'},
+            'multiValueQueryStringParameters': {'status': ['initial,approvedPendingChanges']},
+        }
+
+        body = json.loads(exclusions.get_exclusions_handler(event, None)['body'])
+        assert [exclusion['resourceId'] for exclusion in body['exclusions']] == ['a', 'c']
+        assert body['exclusions'][0]['exclusionId'] == '123123123123#requirement01#a'
+        assert query.call_args.kwargs['IndexName'] == exclusions_table.STATUS_INDEX
+        assert query.call_args.kwargs['ScanIndexForward'] is True
+
+        event['queryStringParameters']['nextToken'] = body['nextToken']
+        body = json.loads(exclusions.get_exclusions_handler(event, None)['body'])
+        assert [exclusion['resourceId'] for exclusion in body['exclusions']] == ['b', 'e']
+        assert body['nextToken'] is None
+
+        # tokens only continue the query they were returned for
+        event['queryStringParameters']['order'] = 'desc'
+        assert exclusions.get_exclusions_handler(event, None)['statusCode'] == 400
+
+    @patch.object(user_table, 'get_user', Mock(return_value=sample_records.ADMIN_USER))
+    @patch.object(exclusions_table, 'scan', Mock(return_value={'Items': []}))
+    @patch.object(exclusions_table, 'query')
+    def test_get_exclusions_by_account(self, query: Mock):
+        wildcard_exclusion = {**create_exclusion('c', 'approved', '2021/02/01'), 'accountId': '*'}
+        account_exclusions = {
+            '123123123123': [create_exclusion('b', 'approved', '2021/03/01'), create_exclusion('a', 'initial', '2021/01/01')],
+            '*': [wildcard_exclusion],
+        }
+        queried_account_ids = []
+
+        def query_account(**kwargs):
+            queried_account_ids.append(kwargs['KeyConditionExpression'].get_expression()['values'][1])
+            return {'Items': account_exclusions[queried_account_ids[-1]]}
+
+        query.side_effect = query_account
+        event = {**EVENT, 'queryStringParameters': {'accountId': '123123123123', 'requirementId': 'requirement01', 'order': 'desc'}}
+        body = json.loads(exclusions.get_exclusions_handler(event, None)['body'])
+        # exclusions of all accounts apply to the account too
+        assert [exclusion['resourceId'] for exclusion in body['exclusions']] == ['b', 'c', 'a']
+        assert queried_account_ids == ['123123123123', '*']
+        assert query.call_args.kwargs['IndexName'] == exclusions_table.ACCOUNT_INDEX
+        assert query.call_args.kwargs['ScanIndexForward'] is False
+        assert query.call_args.kwargs['FilterExpression'].get_expression()['values'][1] == 'requirement01'
+
+    @patch.object(user_table, 'get_user', Mock(return_value=sample_records.ADMIN_USER))
+    @patch.object(exclusions_table, 'scan')
+    @patch.object(exclusions_table, 'query')
+    def test_get_exclusions_undated(self, query: Mock, scan: Mock):
+        # exclusions without an expirationDate are not indexed, they are scanned for after the indexed ones
+        undated_exclusions = [create_exclusion('u1', 'initial', None), create_exclusion('u2', 'rejected', None)]
+        for exclusion in undated_exclusions:
+            exclusion.pop('expirationDate')
+        query.return_value = {'Items': [create_exclusion('a', 'initial', '2021/01/01')]}
+        table_keys = [{key: exclusion[key] for key in exclusions_table.TABLE_KEYS} for exclusion in undated_exclusions]
+        scan.side_effect = lambda **kwargs: {
+            'Items': undated_exclusions[table_keys.index(kwargs['ExclusiveStartKey']) + 1:] if 'ExclusiveStartKey' in kwargs else undated_exclusions
+        }
+        event = {**EVENT, 'queryStringParameters': {'requirementId': 'requirement01', 'limit': '2'}}
+
+        body = json.loads(exclusions.get_exclusions_handler(event, None)['body'])
+        assert [exclusion['resourceId'] for exclusion in body['exclusions']] == ['a', 'u1']
+        scan_filter = exclusions_table.build_expressions(**scan.call_args.kwargs)
+        assert scan_filter['FilterExpression'] == '(attribute_not_exists(#n0) AND #n1 IN (:v0))'
+        assert scan_filter['ExpressionAttributeNames']['#n0'] == 'expirationDate'
+        assert query.call_count == 1
+
+        event['queryStringParameters']['nextToken'] = body['nextToken']
+        body = json.loads(exclusions.get_exclusions_handler(event, None)['body'])
+        assert [exclusion['resourceId'] for exclusion in body['exclusions']] == ['u2']
+        assert body['nextToken'] is None
+        assert query.call_count == 1
+        assert scan.call_args.kwargs['ExclusiveStartKey'] == {'accountId': '123123123123', 'rqrmntId_rsrceRegex': 'requirement01#u1'}
+
+        # they never expire
+        event['queryStringParameters'] = {'requirementId': 'requirement01', 'expiringBefore': '2021/06/01'}
+        body = json.loads(exclusions.get_exclusions_handler(event, None)['body'])
+        assert [exclusion['resourceId'] for exclusion in body['exclusions']] == ['a']
+
+    @patch.object(user_table, 'get_user', Mock(return_value=sample_records.ADMIN_USER))
+    @patch.object(exclusions_table, 'indexes', [exclusions_table.STATUS_INDEX])
+    @patch.object(exclusions_table, 'query')
+    @patch.object(exclusions_table, 'scan')
+    def test_get_exclusions_index_not_created(self, scan: Mock, query: Mock):
+        scan.return_value = {'Items': [create_exclusion('a', 'initial', '2021/01/01'), create_exclusion('b', 'approved', '2021/01/01')]}
+        event = {
+            **EVENT,
+            'queryStringParameters': {'accountId': '123123123123', 'limit': '10'},
+            'multiValueQueryStringParameters': {'status': ['initial']},
+        }
+        body = json.loads(exclusions.get_exclusions_handler(event, None)['body'])
+        # the table is scanned while the account index is being created
+        query.assert_not_called()
+        assert scan.call_args.kwargs['Limit'] == 10
+        filters = [condition.get_expression() for condition in scan.call_args.kwargs['FilterExpression'].get_expression()['values']]
+        assert filters[0]['values'][1] == ['123123123123', '*']
+        assert filters[1]['values'][1] == ['initial']
+        assert [exclusion['resourceId'] for exclusion in body['exclusions']] == ['a']
+
+    @patch.object(user_table, 'get_user', Mock(return_value=sample_records.ADMIN_USER))
+    def test_get_exclusions_invalid_parameters(self):
+        for parameters in [{'expiringBefore': '2021-06-01'}, {'order': 'newest'}, {'limit': 'all'}, {'accountId': '1', 'nextToken': 'invalid'}]:
+            event = {**EVENT, 'queryStringParameters': parameters}
+            assert exclusions.get_exclusions_handler(event, None)['statusCode'] == 400
+        event = {**EVENT, 'multiValueQueryStringParameters': {'status': ['pending']}}
+        assert exclusions.get_exclusions_handler(event, None)['statusCode'] == 400
+
 
 class TestPutExclusions:
+    @patch.object(rescore, 'rescore_exclusions')
     @patch.object(exclusions, 'update_requires_replacement', Mock(return_value=False))
     @patch.object(user_table, 'get_user', Mock(return_value=sample_records.ADMIN_USER))
     @patch.object(requirements_table, 'get', Mock(return_value={'exclusionType': 'exception'}))
@@ -59,7 +207,9 @@ class TestPutExclusions:
     @patch.object(exclusions_table, 'update_exclusion')
     @patch.object(exclusions_lib, 'update_exclusion')
     @patch.object(exclusions, 'get_current_exclusion')
-    def test_put_exclusions_admin(self, mock_get_current_exclusion: Mock, mock_update_exclusion: Mock, mock_table_update_exclusion: Mock):
+    def test_put_exclusions_admin(
+        self, mock_get_current_exclusion: Mock, mock_update_exclusion: Mock, mock_table_update_exclusion: Mock, rescore_exclusions: Mock
+    ):
         mock_get_current_exclusion.return_value = sample_records.EXCLUSION_INITIAL
         mock_update_exclusion.return_value = sample_records.EXCLUSION_APPROVED
         event = {
@@ -75,11 +225,13 @@ class TestPutExclusions:
         }
         result = exclusions.put_exclusions_handler(event, None)
         mock_table_update_exclusion.assert_called()
+        rescore_exclusions.assert_called_once()
         assert result['statusCode'] == 200
         body = json.loads(result['body'])
         assert body['newExclusion']
         assert not body['deleteExclusion']
 
+    @patch.object(rescore, 'rescore_exclusions')
     @patch.object(exclusions, 'update_requires_replacement', Mock(return_value=True))
     @patch.object(user_table, 'get_user', Mock(return_value=sample_records.ADMIN_USER))
     @patch.object(requirements_table, 'get', Mock(return_value={'exclusionType': 'exception'}))
@@ -87,7 +239,9 @@ class TestPutExclusions:
     @patch.object(exclusions_table, 'update_exclusion')
     @patch.object(exclusions_lib, 'update_exclusion')
     @patch.object(exclusions, 'get_current_exclusion')
-    def test_put_exclusions_admin_requires_replacement(self, mock_get_current_exclusion: Mock, mock_update_exclusion: Mock, mock_table_update_exclusion: Mock):
+    def test_put_exclusions_admin_requires_replacement(
+        self, mock_get_current_exclusion: Mock, mock_update_exclusion: Mock, mock_table_update_exclusion: Mock, rescore_exclusions: Mock
+    ):
         mock_get_current_exclusion.return_value = sample_records.EXCLUSION_INITIAL
         mock_update_exclusion.return_value = sample_records.EXCLUSION_APPROVED
         event = {
@@ -103,6 +257,7 @@ class TestPutExclusions:
         }
         result = exclusions.put_exclusions_handler(event, None)
         mock_table_update_exclusion.assert_called()
+        rescore_exclusions.assert_called_once()
         assert result['statusCode'] == 200
         body = json.loads(result['body'])
         assert body['newExclusion']
@@ -129,6 +284,7 @@ class TestPutExclusions:
 
 
 class TestPutExclusionsUser:
+    @patch.object(rescore, 'rescore_exclusions')
     @patch.object(user_table, 'get_user', Mock(return_value=sample_records.ADMIN_USER))
     @patch.object(requirements_table, 'get', Mock(return_value={'exclusionType': 'exception'}))
     @patch.object(config_table, 'get_config', Mock(return_value=sample_records.EXCLUSION_TYPES))
@@ -137,7 +293,7 @@ class TestPutExclusionsUser:
     @patch.object(audit_table, 'put_audit_trail')
     @patch.object(ncr_table, 'get_ncr')
     @patch.object(exclusions_table, 'update_exclusion')
-    def test_put_exclusions_admin(self, table_update_exclusion: Mock, get_ncr: Mock, put_audit: Mock):
+    def test_put_exclusions_admin(self, table_update_exclusion: Mock, get_ncr: Mock, put_audit: Mock, rescore_exclusions: Mock):
         get_ncr.return_value = sample_records.NCR_DATA[0]
         event = {
             **EVENT,
@@ -151,10 +307,12 @@ class TestPutExclusionsUser:
         result = exclusions.put_exclusions_for_user_handler(event, None)
         table_update_exclusion.assert_called()
         put_audit.assert_called()
+        rescore_exclusions.assert_called_once()
         assert result['statusCode'] == 200
         body = json.loads(result['body'])
         assert body['newExclusion']
 
+    @patch.object(rescore, 'rescore_exclusions')
     @patch.object(user_table, 'get_user', Mock(return_value=sample_records.REGULAR_USER))
     @patch.object(requirements_table, 'get', Mock(return_value={'exclusionType': 'exception'}))
     @patch.object(scans_table, 'get_latest_complete_scan', Mock(return_value='latest-scan-date#randomness'))
@@ -163,7 +321,7 @@ class TestPutExclusionsUser:
     @patch.object(audit_table, 'put_audit_trail')
     @patch.object(ncr_table, 'get_ncr')
     @patch.object(exclusions_table, 'update_exclusion')
-    def test_put_exclusions_user(self, table_update_exclusion: Mock, get_ncr: Mock, put_audit: Mock):
+    def test_put_exclusions_user(self, table_update_exclusion: Mock, get_ncr: Mock, put_audit: Mock, rescore_exclusions: Mock):
         get_ncr.return_value = sample_records.NCR_DATA[0]
         event = {
             **EVENT,
@@ -177,6 +335,7 @@ class TestPutExclusionsUser:
         result = exclusions.put_exclusions_for_user_handler(event, None)
         table_update_exclusion.assert_called()
         put_audit.assert_called()
+        rescore_exclusions.assert_called_once()
         assert result['statusCode'] == 200
         body = json.loads(result['body'])
         assert body['newExclusion']
@@ -194,6 +353,27 @@ class TestPutExclusionsUser:
         assert result['statusCode'] == 400
 
 
+class TestRescoreLatestScan:
+    @patch.object(rescore, 'rescore_exclusions')
+    def test_rescore_latest_scan(self, rescore_exclusions: Mock):
+        exclusions.rescore_latest_scan('latest-scan-date#randomness', [sample_records.EXCLUSION_APPROVED, {}], sample_records.EXCLUSION_TYPES)
+        rescore_exclusions.assert_called_once_with('latest-scan-date#randomness', [sample_records.EXCLUSION_APPROVED], sample_records.EXCLUSION_TYPES)
+
+    @patch.object(exclusion_jobs, 'start_exclusion_job')
+    @patch.object(rescore, 'rescore_exclusions')
+    def test_rescore_latest_scan_wildcard(self, rescore_exclusions: Mock, start_exclusion_job: Mock):
+        exclusion = {**sample_records.EXCLUSION_APPROVED, 'accountId': '*'}
+        job = exclusions.rescore_latest_scan('latest-scan-date#randomness', [exclusion], sample_records.EXCLUSION_TYPES, 'test@test.com')
+        rescore_exclusions.assert_not_called()
+        start_exclusion_job.assert_called_once_with('latest-scan-date#randomness', [exclusion], 'test@test.com')
+        assert job == start_exclusion_job.return_value
+
+    @patch.object(rescore, 'rescore_exclusions', Mock(side_effect=Exception('throttled')))
+    def test_rescore_latest_scan_error(self):
+        # the exclusion is saved already, the request must not fail
+        exclusions.rescore_latest_scan('latest-scan-date#randomness', [sample_records.EXCLUSION_APPROVED], sample_records.EXCLUSION_TYPES)
+
+
 class TestGetCurrentExclusion:
     @patch.object(exclusions_table, 'get_exclusion')
     def test_get_current_exclusion(self, mock_get_exclusion):
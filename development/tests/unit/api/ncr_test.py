@@ -178,6 +178,7 @@ class TestNCR:
         assert resp['statusCode'] == 200
         assert json.loads(resp['body']) == {
             'scanId': '2020-05-27T15:11:29.949427#wbnpjzzr',
+            'nextToken': None,
             'ncrRecords': [{
                 'ncrId': '2020-05-27T15:11:29.949427#wbnpjzzr#12345678901_arn:aws:lambda:us-west-2:12345678901:function:test-function_requirementId01',
                 'allowedActions': {
@@ -252,6 +253,7 @@ class TestNCR:
         assert resp['statusCode'] == 200
         assert json.loads(resp['body']) == {
             'scanId': '2020-05-27T15:11:29.949427#wbnpjzzr',
+            'nextToken': None,
             'ncrRecords': [{
                 'ncrId': '2020-05-27T15:11:29.949427#wbnpjzzr#12345678901_arn:aws:lambda:us-west-2:12345678901:function:test-function_requirementId01',
                 'allowedActions': {
@@ -310,6 +312,7 @@ class TestNCR:
         assert resp['statusCode'] == 200
         assert json.loads(resp['body']) == {
             'scanId': '2020-05-27T15:11:29.949427#wbnpjzzr',
+            'nextToken': None,
             'ncrRecords': [{
                 'ncrId': '2020-05-27T15:11:29.949427#wbnpjzzr#12345678901_arn:aws:lambda:us-west-2:12345678901:function:test-function_requirementId01',
                 'allowedActions': {
@@ -384,6 +387,7 @@ class TestNCR:
         assert resp['statusCode'] == 200
         assert json.loads(resp['body']) == {
             'scanId': '2020-05-27T15:11:29.949427#wbnpjzzr',
+            'nextToken': None,
             'ncrRecords': [{
                 'ncrId': '2020-05-27T15:11:29.949427#wbnpjzzr#12345678901_arn:aws:lambda:us-west-2:12345678901:function:test-function_requirementId01',
                 'allowedActions': {
@@ -463,6 +467,7 @@ class TestNCR:
         assert resp['statusCode'] == 200
         assert json.loads(resp['body']) == {
             'scanId': '2020-05-27T15:11:29.949427#wbnpjzzr',
+            'nextToken': None,
             'ncrRecords': [{
                 'ncrId': '2020-05-27T15:11:29.949427#wbnpjzzr#12345678901_arn:aws:lambda:us-west-2:12345678901:function:test-function_requirementId01',
                 'allowedActions': {
@@ -535,6 +540,7 @@ class TestNCR:
         assert resp['statusCode'] == 200
         assert json.loads(resp['body']) == {
             'scanId': '2020-05-27T15:11:29.949427#wbnpjzzr',
+            'nextToken': None,
             'ncrRecords': [{
                 'ncrId': '2020-05-27T15:11:29.949427#wbnpjzzr#12345678901_arn:aws:lambda:us-west-2:12345678901:function:test-function_requirementId01',
                 'allowedActions': {
@@ -550,3 +556,112 @@ class TestNCR:
                 }
             }]
         }
+
+    ###############
+    ##PAGINATION##
+    ###############
+    @staticmethod
+    def make_ncr(account_id, resource_id, requirement_id='requirementId01', **kwargs):
+        scan_id = '2020-05-27T15:11:29.949427#wbnpjzzr'
+        return {
+            'accountId': account_id,
+            'resourceId': resource_id,
+            'scanId': scan_id,
+            'accntId_rsrceId_rqrmntId': f'{account_id}#{resource_id}#{requirement_id}',
+            'rqrmntId_accntId': f'{requirement_id}#{account_id}',
+            'requirementId': requirement_id,
+            **kwargs,
+        }
+
+    @patch.object(scans_table, 'get_latest_complete_scan')
+    @patch.object(user_table, 'get_user')
+    @patch.object(requirements_table, 'scan_all')
+    @patch.object(ncr_table, 'query')
+    def test_get_ncr_pagination(self, mock_query, mock_get_requirement, mock_get_user, mock_get_latest_complete_scan):
+        other_account_id = '10987654321'
+        mock_get_user.return_value = {'email': user, 'isAdmin': True}
+        mock_get_requirement.return_value = [{'requirementId': 'requirementId01', 'severity': 'high'}]
+        mock_get_latest_complete_scan.return_value = '2020-05-27T15:11:29.949427#wbnpjzzr'
+        first_account_ncrs = [self.make_ncr(test_account_id, 'aaa'), self.make_ncr(test_account_id, 'bbb')]
+        mock_query.side_effect = [{'Items': first_account_ncrs}, {'Items': [self.make_ncr(other_account_id, 'ccc')]}]
+        event = create_event()
+        event['multiValueQueryStringParameters']['accountId'] = [test_account_id, other_account_id]
+        event['queryStringParameters'] = {'limit': '2'}
+
+        resp = ncr.ncr_handler(event, None)
+        assert resp['statusCode'] == 200
+        body = json.loads(resp['body'])
+        assert [record['resource']['resourceId'] for record in body['ncrRecords']] == ['aaa', 'bbb']
+        assert mock_query.call_args_list[0][1]['Limit'] == 3
+        assert body['nextToken']
+
+        mock_query.reset_mock()
+        mock_query.side_effect = [{'Items': []}, {'Items': [self.make_ncr(other_account_id, 'ccc')]}]
+        event['queryStringParameters']['nextToken'] = body['nextToken']
+        resp = ncr.ncr_handler(event, None)
+        body = json.loads(resp['body'])
+        assert [record['resource']['resourceId'] for record in body['ncrRecords']] == ['ccc']
+        assert body['nextToken'] is None
+        assert mock_query.call_args_list[0][1]['ExclusiveStartKey'] == {
+            'scanId': '2020-05-27T15:11:29.949427#wbnpjzzr',
+            'accntId_rsrceId_rqrmntId': f'{test_account_id}#bbb#requirementId01',
+        }
+        assert 'ExclusiveStartKey' not in mock_query.call_args_list[1][1]
+
+    @patch.object(scans_table, 'get_latest_complete_scan')
+    @patch.object(user_table, 'get_user')
+    @patch.object(requirements_table, 'scan_all')
+    @patch.object(ncr_table, 'query')
+    def test_get_ncr_invalid_next_token(self, mock_query, mock_get_requirement, mock_get_user, mock_get_latest_complete_scan):
+        mock_get_user.return_value = {'email': user, 'isAdmin': True}
+        mock_get_requirement.return_value = []
+        mock_get_latest_complete_scan.return_value = '2020-05-27T15:11:29.949427#wbnpjzzr'
+        event = create_event()
+        event['queryStringParameters'] = {'limit': '2', 'nextToken': 'not-a-token'}
+        resp = ncr.ncr_handler(event, None)
+        assert resp['statusCode'] == 400
+        mock_query.assert_not_called()
+
+    @patch.object(ncr_util, 'get_allowed_actions')
+    @patch.object(scans_table, 'get_latest_complete_scan')
+    @patch.object(user_table, 'get_user')
+    @patch.object(requirements_table, 'scan_all')
+    @patch.object(ncr_table, 'query_all')
+    def test_get_ncr_filters_and_fields(self, mock_get_ncr, mock_get_requirement, mock_get_user, mock_get_latest_complete_scan, mock_get_allowed_actions):
+        mock_get_user.return_value = {'email': user, 'isAdmin': True}
+        mock_get_requirement.return_value = [
+            {'requirementId': 'requirementId01', 'severity': 'high'},
+            {'requirementId': 'requirementId02', 'severity': 'low'},
+        ]
+        mock_get_latest_complete_scan.return_value = '2020-05-27T15:11:29.949427#wbnpjzzr'
+        mock_get_allowed_actions.return_value = {'remediate': False, 'requestExclusion': True, 'requestExclusionChange': False}
+        mock_get_ncr.return_value = [
+            self.make_ncr(test_account_id, 'aaa', region='us-east-1', reason='a'),
+            self.make_ncr(test_account_id, 'bbb', region='us-east-1', reason='b'),
+            self.make_ncr(test_account_id, 'ccc', region='us-east-1', exclusion={'status': 'initial'}),
+            self.make_ncr(test_account_id, 'ddd', 'requirementId02', region='us-east-1'),
+        ]
+        event = create_event()
+        event['multiValueQueryStringParameters'].update({'severity': ['high'], 'region': ['us-east-1'], 'exclusionState': ['start']})
+        event['queryStringParameters'] = {'fields': 'resourceId,region'}
+
+        resp = ncr.ncr_handler(event, None)
+        assert resp['statusCode'] == 200
+        assert [record['resource'] for record in json.loads(resp['body'])['ncrRecords']] == [
+            {'resourceId': 'aaa', 'region': 'us-east-1'},
+            {'resourceId': 'bbb', 'region': 'us-east-1'},
+        ]
+        query_parameters = mock_get_ncr.call_args[1]
+        assert 'FilterExpression' in query_parameters
+        assert set(query_parameters['ExpressionAttributeNames'].values()) == set(ncr.REQUIRED_FIELDS + ['resourceId', 'region'])
+        assert mock_get_allowed_actions.call_count == 1
+
+    @patch.object(scans_table, 'get_latest_complete_scan')
+    @patch.object(user_table, 'get_user')
+    def test_get_ncr_invalid_exclusion_state(self, mock_get_user, mock_get_latest_complete_scan):
+        mock_get_user.return_value = {'email': user, 'isAdmin': True}
+        mock_get_latest_complete_scan.return_value = '2020-05-27T15:11:29.949427#wbnpjzzr'
+        event = create_event()
+        event['multiValueQueryStringParameters']['exclusionState'] = ['bogus']
+        resp = ncr.ncr_handler(event, None)
+        assert resp['statusCode'] == 400
@@ -31,10 +31,39 @@ class TestScans:
         result = scans.make_max_return(records, 350)
         assert result == {'scans': [record for _ in range(2)]}
 
-    @patch.object(scans_table, 'query_all')
-    def test_scans_handler(self, mock_query_all):
-        mock_query_all.return_value = SCAN_DATA
+    def test_cap_records_limit(self):
+        records = [dict(SCAN_DATA[0]) for _ in range(3)]
+        result, has_more = scans.cap_records(iter(records), scans.BYTE_LIMIT, 2)
+        assert len(result) == 2
+        assert has_more
+
+        result, has_more = scans.cap_records(iter(records), scans.BYTE_LIMIT)
+        assert len(result) == 3
+        assert not has_more
+
+    @patch.object(scans_table, 'query')
+    def test_scans_handler(self, mock_query):
+        mock_query.return_value = {'Items': SCAN_DATA}
         result = scans.scans_handler({}, {})
 
         assert result['statusCode'] == 200
         assert json.loads(result['body'])['scans'] == SCAN_DATA
+        assert json.loads(result['body'])['nextToken'] is None
+
+    @patch.object(scans_table, 'query')
+    def test_scans_handler_pagination(self, mock_query):
+        records = [dict(record) for record in SCAN_DATA[:2]]
+        mock_query.return_value = {'Items': records}
+        result = scans.scans_handler({'queryStringParameters': {'limit': '1'}}, {})
+        body = json.loads(result['body'])
+
+        assert mock_query.call_args[1]['Limit'] == 2
+        assert body['scans'] == [records[0]]
+        assert body['nextToken']
+
+        scans.scans_handler({'queryStringParameters': {'nextToken': body['nextToken']}}, {})
+        assert mock_query.call_args[1]['ExclusiveStartKey'] == {'scan': scans_table.SCAN, 'scanId': records[0]['scanId']}
+
+    def test_scans_handler_invalid_next_token(self):
+        result = scans.scans_handler({'queryStringParameters': {'nextToken': 'invalid'}}, {})
+        assert result['statusCode'] == 400
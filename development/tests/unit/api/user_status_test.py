@@ -1,6 +1,7 @@
 from json import loads
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import Mock, patch
+from lib import bootstrap
 from lib.dynamodb import user_table, accounts_table, scans_table
 from api.user_status import user_status_handler
 from tests.unit.api.test_setup_resources import sample_records
@@ -31,6 +32,7 @@ class TestUserStatusHandler(TestCase):
         assert response['statusCode'] == 200
         assert 'email' not in body.keys()
 
+    @patch.object(bootstrap, 'get_bootstrap', Mock(return_value=(None, None)))
     @patch.object(scans_table, 'get_latest_complete_scan')
     @patch.object(user_table, 'get_user')
     def test_user(self, mock_get_user, mock_get_latest_complete_scan):
@@ -45,6 +47,7 @@ class TestUserStatusHandler(TestCase):
         assert not body.get('payerAccounts')
         assert 'spreadsheetUrl' in body
 
+    @patch.object(bootstrap, 'get_bootstrap', Mock(return_value=(None, None)))
     @patch.object(scans_table, 'get_latest_complete_scan')
     @patch.object(accounts_table, 'scan_all')
     @patch.object(user_table, 'scan_all')
@@ -69,6 +72,7 @@ class TestUserStatusHandler(TestCase):
         assert response['statusCode'] == 400
         assert 'email' not in body.keys()
 
+    @patch.object(bootstrap, 'get_bootstrap', Mock(return_value=(None, None)))
     @patch.object(scans_table, 'get_latest_complete_scan')
     @patch.object(accounts_table, 'scan_all')
     @patch.object(user_table, 'scan_all')
@@ -88,3 +92,41 @@ class TestUserStatusHandler(TestCase):
         assert body.get('payerAccounts')[0]['accountName'] == 'not available'
         assert len(body.get('payerAccounts')[0]['accountList']) == 1
         assert 'spreadsheetUrl' in body
+
+    @patch.object(scans_table, 'get_latest_complete_scan')
+    @patch.object(bootstrap, 'get_bootstrap')
+    @patch.object(user_table, 'get_user')
+    def test_bootstrap_document(self, mock_get_user, mock_get_bootstrap, mock_get_latest_complete_scan):
+        mock_get_latest_complete_scan.return_value = sample_records.LATEST_SCAN['scanId']
+        mock_get_bootstrap.return_value = ({
+            'requirements': [{'requirementId': 'abc'}],
+            'severityColors': {'high': 'red'},
+            'usersList': [{'email': 'admin2@gmail.com'}],
+            'accountList': [{'accountId': '123', 'accountName': 'account'}],
+            'payerAccounts': [],
+        }, '"bootstrap-etag"')
+
+        mock_get_user.return_value = sample_records.REGULAR_USER
+        response = user_status_handler(make_event('example1@gmail.com'), None)
+        body = loads(response['body'])
+        assert response['statusCode'] == 200
+        assert body['requirements'] == [{'requirementId': 'abc'}]
+        assert body['severityColors'] == {'high': 'red'}
+        assert not body['isAdmin']
+        assert 'usersList' not in body
+        etag = response['headers']['ETag']
+
+        event = make_event('example1@gmail.com')
+        event['headers'] = {'If-None-Match': etag}
+        response = user_status_handler(event, None)
+        assert response['statusCode'] == 304
+        assert response['body'] == ''
+
+        mock_get_user.return_value = sample_records.ADMIN_USER
+        response = user_status_handler(event, None)
+        body = loads(response['body'])
+        assert response['statusCode'] == 200
+        assert response['headers']['ETag'] != etag
+        assert body['isAdmin']
+        assert body['usersList'] == [{'email': 'admin2@gmail.com'}]
+        assert body['accountList'] == [{'accountId': '123', 'accountName': 'account'}]
@@ -27,6 +27,10 @@ def create_tables():
             if 'TimeToLiveSpecification' in table:
                 del table['TimeToLiveSpecification']
             table['ProvisionedThroughput'] = PROVISIONED_CAPACITY
+            # conditional attributes and indexes are created, as in a stack with all of them enabled
+            for key in ['AttributeDefinitions', 'GlobalSecondaryIndexes']:
+                if key in table:
+                    table[key] = [item['Fn::If'][1] if 'Fn::If' in item else item for item in table[key]]
             if 'GlobalSecondaryIndexes' in table:
                 for gsi in table['GlobalSecondaryIndexes']:
                     gsi['ProvisionedThroughput'] = PROVISIONED_CAPACITY
@@ -0,0 +1,36 @@
+from lib.account_index import AccountIndex, NO_SPONSOR_VALUE, get_sponsor
+
+ACCOUNTS = [
+    {'accountId': '1', 'payer_id': '1', 'exec_sponsor_email': 'Boss@example.com', 'scorecard_profile': 'prod'},
+    {'accountId': '2', 'payer_id': '1', 'exec_sponsor_email': 'boss@example.com'},
+    {'accountId': '3', 'payer_id': '4', 'scorecard_profile': 'prod'},
+    {'accountId': '5'},
+]
+USERS = [
+    {'email': 'user@example.com', 'accounts': {'2': {}, '3': {}, 'unknown': {}}},
+    {'email': 'other@example.com'},
+]
+
+
+class TestAccountIndex:
+    def test_lookups(self):
+        index = AccountIndex(ACCOUNTS, USERS)
+        assert index.get_account('3') == ACCOUNTS[2]
+        assert index.get_account('unknown') is None
+        assert index.get_accounts(['3', 'unknown', '2']) == [ACCOUNTS[2], ACCOUNTS[1]]
+        assert index.payer_ids() == ['1', '4']
+        assert index.get_payer_accounts('1') == ACCOUNTS[:2]
+        assert index.get_payer_accounts('unknown') == []
+        assert index.get_sponsor_accounts('BOSS@example.com') == ACCOUNTS[:2]
+        assert index.get_sponsor_accounts(NO_SPONSOR_VALUE) == ACCOUNTS[2:]
+        assert index.get_profile_accounts('prod') == [ACCOUNTS[0], ACCOUNTS[2]]
+        assert index.get_user_accounts('user@example.com') == [ACCOUNTS[1], ACCOUNTS[2]]
+        assert index.get_user_accounts('other@example.com') == []
+
+    def test_without_users(self):
+        assert AccountIndex(ACCOUNTS).get_user_accounts('user@example.com') == []
+
+    def test_get_sponsor(self):
+        assert get_sponsor(ACCOUNTS[0]) == 'boss@example.com'
+        assert get_sponsor(ACCOUNTS[1]) == 'boss@example.com'
+        assert get_sponsor(ACCOUNTS[2]) == NO_SPONSOR_VALUE
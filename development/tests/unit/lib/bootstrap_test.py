@@ -0,0 +1,74 @@
+from io import BytesIO
+from unittest.mock import patch, Mock
+
+import botocore.stub
+import pytest
+
+from lib import bootstrap
+from lib.account_index import AccountIndex
+from lib.dynamodb import accounts_table, config_table, requirements_table, user_table
+
+
+@pytest.fixture(scope='function')
+def s3_stubber():
+    with botocore.stub.Stubber(bootstrap.S3) as s3_stubber:
+        yield s3_stubber
+        s3_stubber.assert_no_pending_responses()
+
+
+class TestBootstrap:
+    def test_get_payer_accounts(self):
+        accounts = {
+            '1': {'accountId': '1', 'account_name': 'payer', 'payer_id': '1'},
+            '2': {'accountId': '2', 'account_name': 'two', 'payer_id': '1'},
+            '3': {'accountId': '3', 'account_name': 'three', 'payer_id': '4'},
+            '5': {'accountId': '5', 'account_name': 'five'},
+            '6': {'accountId': '6', 'payer_id': '4'},
+        }
+        payer_accounts = sorted(bootstrap.get_payer_accounts(AccountIndex(accounts.values())), key=lambda payer: payer['id'])
+        assert payer_accounts == [
+            {
+                'id': '1',
+                'accountName': 'payer',
+                'accountList': [{'accountId': '1', 'accountName': 'payer'}, {'accountId': '2', 'accountName': 'two'}],
+            },
+            {
+                'id': '4',
+                'accountName': 'not available',
+                'accountList': [{'accountId': '3', 'accountName': 'three'}, {'accountId': '6', 'accountName': ''}],
+            },
+        ]
+
+    @patch.object(requirements_table, 'scan_all', Mock(return_value=[]))
+    @patch.object(config_table, 'get_config', Mock(return_value={}))
+    @patch.object(user_table, 'scan_all', Mock(return_value=[{'email': 'user@example.com', 'accounts': {'1': {}}}]))
+    @patch.object(accounts_table, 'scan_all')
+    def test_build_bootstrap_account_index(self, accounts_scan_all: Mock):
+        account_index = AccountIndex([{'accountId': '1', 'account_name': 'one', 'payer_id': '1'}])
+        document = bootstrap.build_bootstrap(account_index=account_index)
+        # the accounts the caller already read are not scanned again
+        accounts_scan_all.assert_not_called()
+        assert document['accountList'] == [{'accountId': '1', 'accountName': 'one'}]
+        assert document['usersList'][0]['accountList'] == [{'accountId': '1', 'accountName': 'one'}]
+        assert document['payerAccounts'][0]['id'] == '1'
+
+    def test_get_bootstrap_revalidates(self, s3_stubber):
+        bootstrap.cached_bootstrap.update({'etag': None, 'document': None})
+        s3_stubber.add_response(
+            'get_object',
+            {'Body': BytesIO(b'{"requirements": []}'), 'ETag': '"abc"'},
+            {'Bucket': bootstrap.BUCKET, 'Key': bootstrap.KEY}
+        )
+        s3_stubber.add_client_error(
+            'get_object',
+            service_error_code='304',
+            http_status_code=304,
+            expected_params={'Bucket': bootstrap.BUCKET, 'Key': bootstrap.KEY, 'IfNoneMatch': '"abc"'}
+        )
+        assert bootstrap.get_bootstrap() == ({'requirements': []}, '"abc"')
+        assert bootstrap.get_bootstrap() == ({'requirements': []}, '"abc"')
+
+    def test_get_bootstrap_missing(self, s3_stubber):
+        bootstrap.cached_bootstrap.update({'etag': None, 'document': None})
+        s3_stubber.add_client_error('get_object', service_error_code='NoSuchKey', http_status_code=404)
+        assert bootstrap.get_bootstrap() == (None, None)
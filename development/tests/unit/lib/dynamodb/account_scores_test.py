@@ -0,0 +1,46 @@
+from decimal import Decimal
+
+from lib.dynamodb import account_scores_table
+
+
+def make_account_score(date, num_failing=1, critical_failing=0):
+    return {
+        'accountId': '123',
+        'date': date,
+        'scanId': f'{date}T00:00:00',
+        'score': {
+            'high': {'weight': Decimal(10), 'numResources': Decimal(5), 'numFailing': Decimal(num_failing)},
+            'critical': {'weight': Decimal(20), 'numResources': Decimal(5), 'numFailing': Decimal(critical_failing)},
+        }
+    }
+
+
+class TestAccountScoresTable:
+    def test_update_history_new(self):
+        history = account_scores_table.update_history(None, make_account_score('2020-06-01', critical_failing=2))
+        entry = {'date': '2020-06-01', 'scanId': '2020-06-01T00:00:00', 'score': 50, 'criticalCount': 2}
+        assert history == {
+            'accountId': '123',
+            'date': account_scores_table.HISTORY,
+            'daily': [entry],
+            'weekly': [entry],  # 2020-06-01 is a monday
+        }
+
+    def test_update_history_rolling_window(self):
+        history = None
+        for day in range(1, 31):
+            history = account_scores_table.update_history(history, make_account_score(f'2020-06-{day:02}'))
+        assert [entry['date'] for entry in history['daily']] == [f'2020-06-{day}' for day in range(30, 23, -1)]
+        assert [entry['date'] for entry in history['weekly']] == ['2020-06-29', '2020-06-22', '2020-06-15', '2020-06-08', '2020-06-01']
+
+    def test_update_history_same_date_replaced(self):
+        history = account_scores_table.update_history(None, make_account_score('2020-06-01', num_failing=1))
+        history = account_scores_table.update_history(history, make_account_score('2020-06-01', num_failing=3))
+        assert [entry['score'] for entry in history['daily']] == [30]
+        assert [entry['score'] for entry in history['weekly']] == [30]
+
+    def test_update_history_drops_expired(self):
+        history = account_scores_table.update_history(None, make_account_score('2020-01-06'))
+        history = account_scores_table.update_history(history, make_account_score('2020-06-02'))
+        assert [entry['date'] for entry in history['daily']] == ['2020-06-02']
+        assert history['weekly'] == []
@@ -1,4 +1,9 @@
+from unittest.mock import Mock
+
+from boto3.dynamodb.types import Binary
+
 from lib.dynamodb import ncr_table
+from lib.dynamodb.ncr import COMPRESSION_MIN_LENGTH, NCRTable
 
 
 class TestNcrTable:
@@ -47,3 +52,69 @@ class TestNcrTable:
             'accntId_rsrceId_rqrmntId': 'bbb#ddd#ccc',
             'rqrmntId_accntId': 'ccc#bbb'
         }
+
+    def test_encode_decode(self):
+        exclusion = {
+            'accountId': '*',
+            'requirementId': 'ccc',
+            'resourceId': 'arn:*',
+            'rqrmntId_rsrceRegex': 'ccc#arn:*',
+            'status': 'approved',
+        }
+        exclusions_table = Mock()
+        exclusions_table.batch_get_items.return_value = [exclusion]
+        table = NCRTable('ncr-table', exclusions_table=exclusions_table)
+        ncr = {
+            'scanId': 'sample',
+            'accntId_rsrceId_rqrmntId': 'bbb#ddd#ccc',
+            'reason': 'x' * COMPRESSION_MIN_LENGTH,
+            'exclusion': exclusion,
+        }
+
+        encoded = table.encode_item(ncr)
+        assert isinstance(encoded['reason'], Binary)
+        assert len(encoded['reason'].value) < COMPRESSION_MIN_LENGTH
+        assert encoded['exclusionId'] == '*#ccc#arn:*'
+        assert encoded['exclusionSnapshot'] == {'status': 'approved'}
+        assert 'exclusion' not in encoded
+        # the item given is left as is
+        assert ncr['reason'] == 'x' * COMPRESSION_MIN_LENGTH
+
+        assert table.decode_items([dict(encoded)]) == [ncr]
+        exclusions_table.batch_get_items.assert_called_once_with([{'accountId': '*', 'rqrmntId_rsrceRegex': 'ccc#arn:*'}])
+
+    def test_decode_exclusion_snapshot(self):
+        exclusions_table = Mock()
+        exclusions_table.batch_get_items.return_value = []
+        table = NCRTable('ncr-table', exclusions_table=exclusions_table)
+        snapshot = {'status': 'approved', 'expirationDate': '2030/01/01', 'hidesResources': True, 'type': 'exception'}
+        encoded = {'scanId': 'sample', 'exclusionId': '*#ccc#arn:*', 'exclusionSnapshot': snapshot}
+        exclusion = {'accountId': '*', 'requirementId': 'ccc', 'resourceId': 'arn:*', 'rqrmntId_rsrceRegex': 'ccc#arn:*', **snapshot}
+
+        # exclusions not found are rebuilt from their snapshot
+        assert table.decode_items([dict(encoded)]) == [{'scanId': 'sample', 'exclusion': exclusion}]
+        exclusions_table.batch_get_items.assert_called_once()
+
+        # the snapshot takes precedence over the current record, whose other fields are kept
+        exclusions_table.batch_get_items.return_value = [{**exclusion, 'status': 'archived', 'justification': 'reason'}]
+        assert table.decode_items([dict(encoded)]) == [{'scanId': 'sample', 'exclusion': {**exclusion, 'justification': 'reason'}}]
+
+        # bulk readers don't look them up
+        exclusions_table.batch_get_items.reset_mock()
+        assert table.without_exclusion_lookup().decode_items([dict(encoded)]) == [{'scanId': 'sample', 'exclusion': exclusion}]
+        exclusions_table.batch_get_items.assert_not_called()
+        assert table.resolve_exclusions
+
+        # ncrs written before snapshots were kept only have the current record
+        assert table.decode_items([{'scanId': 'sample', 'exclusionId': '*#ccc#arn:*'}]) == [
+            {'scanId': 'sample', 'exclusion': {**exclusion, 'status': 'archived', 'justification': 'reason'}}
+        ]
+        exclusions_table.batch_get_items.return_value = []
+        assert table.decode_items([{'scanId': 'sample', 'exclusionId': '*#ccc#arn:*'}]) == [{'scanId': 'sample', 'exclusion': {}}]
+
+    def test_encode_decode_small(self):
+        table = NCRTable('ncr-table', exclusions_table=Mock())
+        ncr = {'scanId': 'sample', 'reason': 'short', 'exclusion': {}}
+        assert table.encode_item(ncr) == ncr
+        assert table.decode_items([dict(ncr)]) == [ncr]
+        table.exclusions_table.batch_get_items.assert_not_called()
@@ -127,3 +127,59 @@ class TestScanHandler:
         result = scans_table.get_item(Key=scan_key)['Item']
         assert result.pop('ttl')
         assert result == expected_result
+
+    def test_latest_complete_scan_pointer(self):
+        pointer_key = {'scan': scans_table.LATEST, 'scanId': scans_table.LATEST}
+        scans_table.put_item(Item={'scan': scans_table.SCAN, 'processState': scans_table.COMPLETED, 'scanId': '5050-pointertest'})
+
+        # without the pointer record scan history is searched
+        assert scans_table.get_latest_complete_scan() == '5050-pointertest'
+
+        assert scans_table.set_latest_complete_scan('5040-pointertest')
+        assert scans_table.get_latest_complete_scan() == '5040-pointertest'
+        # older scans do not replace a newer pointer
+        assert not scans_table.set_latest_complete_scan('5030-pointertest')
+        assert scans_table.get_latest_complete_scan() == '5040-pointertest'
+
+        scans_table.delete_item(Key=pointer_key)
+        scans_table.delete_item(Key={'scan': scans_table.SCAN, 'scanId': '5050-pointertest'})
+
+    def test_exclusion_job(self):
+        work_items = [{'partitionKey': '5060-jobtest#0'}, {'partitionKey': '5060-jobtest#1'}]
+        job = scans_table.create_exclusion_job('5060-jobtest', [{'accountId': '*'}], work_items, 'admin@test.com')
+        assert scans_table.get_exclusion_job(job['jobId'])['processState'] == scans_table.IN_PROGRESS
+        assert job['partitionKeys'] == ['5060-jobtest#0', '5060-jobtest#1']
+
+        job = scans_table.add_exclusion_job_progress(job['jobId'], ncrs=3, scores=1)
+        assert job['processState'] == scans_table.IN_PROGRESS
+        assert job['partitionsDone'] == 1
+
+        job = scans_table.add_exclusion_job_progress(job['jobId'], error='5060-jobtest#1: throttled')
+        assert job['processState'] == scans_table.ERRORED
+        stored_job = scans_table.get_exclusion_job(job['jobId'])
+        assert stored_job['processState'] == scans_table.ERRORED
+        assert stored_job['partitionsDone'] == 2
+        assert stored_job['partitionsFailed'] == 1
+        assert stored_job['ncrsUpdated'] == 3
+        assert stored_job['scoresUpdated'] == 1
+        assert stored_job['errors'] == ['5060-jobtest#1: throttled']
+
+        scans_table.delete_item(Key={'scan': scans_table.EXCLUSION_JOB, 'scanId': job['jobId']})
+
+    def test_exclusion_sweep(self):
+        scans_table.set_exclusion_sweep('5060-sweeptest', '5060/01/01', 'job01', '5059/12/31')
+        sweep = scans_table.get_exclusion_sweep()
+        assert sweep['rescoreScanId'] == '5060-sweeptest'
+        assert sweep['sweptDate'] == '5060/01/01'
+        assert sweep['jobId'] == 'job01'
+        assert sweep['previousSweptDate'] == '5059/12/31'
+        scans_table.delete_item(Key={'scan': scans_table.EXCLUSION_SWEEP, 'scanId': scans_table.EXCLUSION_SWEEP})
+
+    def test_get_scan_shards(self):
+        scans_table.put_item(Item={'scan': scans_table.SCAN, 'scanId': '5070-shardtest', 'shards': 4})
+        scans_table.put_item(Item={'scan': scans_table.SCAN, 'scanId': '5070-unshardedtest'})
+        assert scans_table.get_scan_shards('5070-shardtest') == 4
+        assert scans_table.get_scan_shards('5070-unshardedtest') == 1
+        assert scans_table.get_scan_shards('5070-missingtest') == 1
+        scans_table.delete_item(Key={'scan': scans_table.SCAN, 'scanId': '5070-shardtest'})
+        scans_table.delete_item(Key={'scan': scans_table.SCAN, 'scanId': '5070-unshardedtest'})
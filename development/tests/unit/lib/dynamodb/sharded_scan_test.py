@@ -0,0 +1,72 @@
+import zlib
+from unittest.mock import Mock, patch
+
+import pytest
+from boto3.dynamodb.conditions import Attr, Key
+
+from lib.dynamodb.ncr import NCRTable
+from lib.dynamodb.scores import ScoresTable
+
+SCAN_ID = '2020-06-16T00:00:00#abcdefgh'
+
+
+@pytest.fixture(scope='function')
+def sharded_ncr_table():
+    scans_table = Mock(get_scan_shards=Mock(return_value=4))
+    yield NCRTable('sharded-ncr-table', scans_table=scans_table), scans_table
+
+
+class TestShardedScanTable:
+    def test_get_scan_id(self):
+        assert NCRTable.get_scan_id(SCAN_ID) == SCAN_ID
+        assert NCRTable.get_scan_id(f'{SCAN_ID}#3') == SCAN_ID
+
+    def test_partition_key(self, sharded_ncr_table):
+        table, scans_table = sharded_ncr_table
+        assert table.partition_key(SCAN_ID, '123456789012') == f'{SCAN_ID}#{zlib.crc32(b"123456789012") % 4}'
+        scans_table.get_scan_shards.assert_called_once_with(SCAN_ID)
+        assert NCRTable('ncr-table').partition_key(SCAN_ID, '123456789012') == SCAN_ID
+
+    def test_partition_keys(self, sharded_ncr_table):
+        table, _ = sharded_ncr_table
+        assert table.partition_keys(SCAN_ID) == [f'{SCAN_ID}#{shard}' for shard in range(4)]
+
+    def test_partition_keys_unsharded_scan(self, sharded_ncr_table):
+        table, scans_table = sharded_ncr_table
+        scans_table.get_scan_shards.return_value = 1
+        assert table.partition_keys(SCAN_ID) == [SCAN_ID]
+        assert table.partition_key(SCAN_ID, '123456789012') == SCAN_ID
+
+    def test_query_scan(self, sharded_ncr_table):
+        table, _ = sharded_ncr_table
+        with patch.object(table, 'query_all', side_effect=lambda **kwargs: [kwargs['ExpressionAttributeValues'][':v0']]) as query_all:
+            result = table.query_scan(SCAN_ID, Key('accntId_rsrceId_rqrmntId').begins_with('111'), FilterExpression=Attr('region').eq('us-east-1'))
+        assert result == [f'{SCAN_ID}#{shard}' for shard in range(4)]
+        assert query_all.call_args.kwargs == {
+            'KeyConditionExpression': '(#n0 = :v0 AND begins_with(#n1, :v1))',
+            'FilterExpression': '#n2 = :v2',
+            'ExpressionAttributeNames': {'#n0': 'scanId', '#n1': 'accntId_rsrceId_rqrmntId', '#n2': 'region'},
+            'ExpressionAttributeValues': {':v0': f'{SCAN_ID}#3', ':v1': '111', ':v2': 'us-east-1'},
+        }
+
+    def test_build_query(self):
+        query_parameters = NCRTable.build_query(
+            SCAN_ID, IndexName='by-scanId', ProjectionExpression='#field0', ExpressionAttributeNames={'#field0': 'region'}
+        )
+        assert query_parameters == {
+            'IndexName': 'by-scanId',
+            'ProjectionExpression': '#field0',
+            'KeyConditionExpression': '#n0 = :v0',
+            'ExpressionAttributeNames': {'#field0': 'region', '#n0': 'scanId'},
+            'ExpressionAttributeValues': {':v0': SCAN_ID},
+        }
+
+    def test_sharded_records(self, sharded_ncr_table):
+        table, scans_table = sharded_ncr_table
+        ncr = table.new_ncr_record({'accountId': '111', 'resourceId': 'resource', 'requirementId': 'requirement'}, SCAN_ID)
+        assert ncr['scanId'] == f'{SCAN_ID}#{zlib.crc32(b"111") % 4}'
+        assert NCRTable.create_ncr_id(ncr) == f'{SCAN_ID}#111#resource#requirement'
+
+        scores_table = ScoresTable('sharded-scores-table', scans_table=scans_table)
+        score = scores_table.new_score(SCAN_ID, '111', {'requirementId': 'requirement', 'severity': 'high', 'weight': 1}, 1)
+        assert score['scanId'] == ncr['scanId']
@@ -1,4 +1,8 @@
-from boto3.dynamodb.conditions import Key
+from unittest.mock import patch
+
+import pytest
+from botocore.exceptions import ClientError
+from boto3.dynamodb.conditions import Attr, Key
 from lib.dynamodb.table_base import TableBase
 
 class TestTableBase:
@@ -19,3 +23,87 @@ class TestTableBase:
         assert len(results) >= 3
         for i in range(3):
             table.delete_item(Key={'year': '1971', 'timestamp': '1971-' + str(i)})
+
+    def test_batch_get_items(self):
+        table = TableBase('accounts-table')
+        keys = [{'accountId': str(i)} for i in range(150)]
+        serialized = [{'accountId': {'S': str(i)}} for i in range(150)]
+        responses = [
+            {
+                'Responses': {'accounts-table': serialized[:90]},
+                'UnprocessedKeys': {'accounts-table': {'Keys': serialized[90:100]}},
+            },
+            {'Responses': {'accounts-table': serialized[90:100]}, 'UnprocessedKeys': {}},
+            {'Responses': {'accounts-table': serialized[100:]}},
+        ]
+        # the low level client is thread safe, unlike the table resource
+        with patch.object(table.dynamodb, 'batch_get_item', side_effect=responses) as mock_batch_get_item:
+            results = table.batch_get_items(keys)
+        assert results == keys
+        assert mock_batch_get_item.call_count == 3
+        assert mock_batch_get_item.call_args_list[0][1]['RequestItems']['accounts-table']['Keys'] == serialized[:100]
+        assert mock_batch_get_item.call_args_list[1][1]['RequestItems']['accounts-table']['Keys'] == serialized[90:100]
+        assert mock_batch_get_item.call_args_list[2][1]['RequestItems']['accounts-table']['Keys'] == serialized[100:]
+
+    def test_batch_get_items_backoff(self):
+        table = TableBase('accounts-table')
+        unprocessed = {'Responses': {}, 'UnprocessedKeys': {'accounts-table': {'Keys': [{'accountId': {'S': '1'}}]}}}
+        with patch.object(table.dynamodb, 'batch_get_item', return_value=unprocessed) as mock_batch_get_item, \
+                patch.object(TableBase, 'backoff') as backoff:
+            with pytest.raises(RuntimeError):
+                table.batch_get_items([{'accountId': '1'}])
+        assert mock_batch_get_item.call_count == 10
+        assert [call.args[0] for call in backoff.call_args_list] == list(range(10))
+
+    def test_build_expressions(self):
+        table = TableBase('audit-table')
+        with patch.object(table.table, 'query', return_value={'Items': []}) as query:
+            table.query(KeyConditionExpression=Key('year').eq('1971'), FilterExpression=Attr('user').eq('me'), Limit=1)
+        # built per call rather than by the builder of the table resource, which is shared between threads
+        assert query.call_args.kwargs == {
+            'KeyConditionExpression': '#n0 = :v0',
+            'FilterExpression': '#n1 = :v1',
+            'ExpressionAttributeNames': {'#n0': 'year', '#n1': 'user'},
+            'ExpressionAttributeValues': {':v0': '1971', ':v1': 'me'},
+            'Limit': 1,
+        }
+        assert TableBase.build_expressions(KeyConditionExpression='#n0 = :v0', Limit=1) == {'KeyConditionExpression': '#n0 = :v0', 'Limit': 1}
+
+    def test_batch_write_items(self):
+        table = TableBase('accounts-table')
+        items = [{'accountId': str(i)} for i in range(30)]
+        unprocessed = [{'PutRequest': {'Item': {'accountId': {'S': '0'}}}}]
+        responses = {
+            '0': [{'UnprocessedItems': {'accounts-table': unprocessed}}, {'UnprocessedItems': {}}],
+            '25': [{}],
+        }
+
+        def batch_write_item(RequestItems):
+            first_key = RequestItems['accounts-table'][0]
+            first_id = (first_key.get('PutRequest', {}).get('Item') or first_key.get('DeleteRequest', {}).get('Key'))['accountId']['S']
+            return responses[first_id].pop(0)
+
+        with patch.object(table.dynamodb, 'batch_write_item', side_effect=batch_write_item) as mock_batch_write_item:
+            table.batch_write_items(put_items=items[:26], delete_keys=items[26:])
+        assert mock_batch_write_item.call_count == 3
+        requests = [call[1]['RequestItems']['accounts-table'] for call in mock_batch_write_item.call_args_list]
+        assert sorted(len(request) for request in requests) == [1, 5, 25]
+        assert {'DeleteRequest': {'Key': {'accountId': {'S': '29'}}}} in sum(requests, [])
+
+    def test_batch_write_items_throttled(self):
+        table = TableBase('accounts-table')
+        throttled = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'BatchWriteItem')
+        with patch.object(table.dynamodb, 'batch_write_item', side_effect=[throttled, {}]) as mock_batch_write_item, \
+                patch('lib.dynamodb.table_base.time.sleep') as mock_sleep:
+            metrics = table.batch_write_items(put_items=[{'accountId': '1'}])
+        assert mock_batch_write_item.call_count == 2
+        assert mock_batch_write_item.call_args_list[0] == mock_batch_write_item.call_args_list[1]
+        mock_sleep.assert_called_once()
+        assert (metrics.items, metrics.api_calls, metrics.retries, metrics.throttles) == (1, 2, 1, 1)
+
+    def test_batch_write_items_gives_up(self):
+        table = TableBase('accounts-table')
+        unprocessed = {'UnprocessedItems': {'accounts-table': [{'PutRequest': {'Item': {'accountId': {'S': '1'}}}}]}}
+        with patch.object(table.dynamodb, 'batch_write_item', return_value=unprocessed), patch('lib.dynamodb.table_base.time.sleep'):
+            with pytest.raises(RuntimeError):
+                table.batch_write_items(put_items=[{'accountId': '1'}])
@@ -0,0 +1,151 @@
+"""
+unit test for app/lib/exclusions/bulk.py
+"""
+import datetime
+from unittest.mock import patch, Mock
+
+from openpyxl import Workbook
+
+from lib.dynamodb import exclusions_table
+from lib.exclusions import bulk
+from tests.unit.api.test_setup_resources import sample_records
+
+ACCOUNT_ID = '123123123123'
+EXPIRATION_DATE = (datetime.date.today() + datetime.timedelta(days=30)).strftime('%Y/%m/%d')
+REQUIREMENT_TYPES = {'requirement01': 'exception', 'requirement02': 'exception'}
+
+
+def create_row(resource_id, **kwargs):
+    return {
+        'accountId': ACCOUNT_ID,
+        'requirementId': 'requirement01',
+        'resourceId': resource_id,
+        'expirationDate': EXPIRATION_DATE,
+        'formFields.reason': 'its fine',
+        **kwargs,
+    }
+
+
+class TestReadRows:
+    def test_read_csv(self, tmp_path):
+        filename = str(tmp_path / 'exclusions.csv')
+        with open(filename, 'w') as csv_file:
+            csv_file.write('accountId,requirementId,resourceId\n123123123123,requirement01,bucket-1\n,,\n123123123123,requirement02,\n')
+        assert list(bulk.read_rows(filename)) == [
+            (2, {'accountId': ACCOUNT_ID, 'requirementId': 'requirement01', 'resourceId': 'bucket-1'}),
+            (4, {'accountId': ACCOUNT_ID, 'requirementId': 'requirement02'}),
+        ]
+
+    def test_read_xlsx(self, tmp_path):
+        filename = str(tmp_path / 'exclusions.xlsx')
+        workbook = Workbook()
+        worksheet = workbook.active
+        worksheet.title = bulk.DEFAULT_SHEET
+        worksheet.append(['accountId', 'requirementId', 'hidden', 'expirationDate'])
+        worksheet.append([123123123, 'requirement01', 'yes', datetime.datetime(2030, 1, 31)])
+        workbook.save(filename)
+
+        rows = list(bulk.read_rows(filename))
+        assert rows[0][0] == 2
+        exclusion = bulk.row_to_exclusion(rows[0][1], REQUIREMENT_TYPES)
+        assert exclusion['accountId'] == '000123123123'
+        assert exclusion['hidesResources'] is True
+        assert exclusion['expirationDate'] == '2030/01/31'
+        assert exclusion['type'] == 'exception'
+        assert exclusion['status'] == bulk.DEFAULT_STATUS
+
+
+class TestImportExclusions:
+    @patch.object(exclusions_table, 'batch_put_records')
+    def test_import_exclusions(self, batch_put_records: Mock):
+        without_reason = {key: value for key, value in create_row('bucket-8').items() if key != 'formFields.reason'}
+        rows = [
+            (2, create_row('bucket-1')),
+            (3, create_row('bucket-*', status='initial', hidesResources='no')),
+            (4, create_row('bucket-1', adminComments='again')),
+            (5, create_row('bucket-2', accountId='123')),
+            (6, create_row('bucket-3', requirementId='missing')),
+            (7, create_row('bucket-4', expirationDate='2100/01/01')),
+            (8, create_row('')),
+            # the expirationDate of expired, rejected and archived exclusions only needs to be a date
+            (9, create_row('bucket-5', expirationDate='2000/01/01')),
+            (10, create_row('bucket-6', expirationDate='2100/01/01', status='archived')),
+            (11, create_row('bucket-7', expirationDate='2000/01/32', status='rejected')),
+            (12, {**without_reason, 'expirationDate': '2000/01/01', 'status': 'rejected'}),
+        ]
+        result = bulk.import_exclusions(rows, sample_records.EXCLUSION_TYPES, REQUIREMENT_TYPES, batch_size=4)
+
+        assert result.rows == 11
+        assert result.imported == 4
+        assert [(failure.row, failure.exclusion_id) for failure in result.failures] == [
+            (4, f'{ACCOUNT_ID}#requirement01#bucket-1'),
+            (5, '123#requirement01#bucket-2'),
+            (6, f'{ACCOUNT_ID}#missing#bucket-3'),
+            (7, f'{ACCOUNT_ID}#requirement01#bucket-4'),
+            (8, f'{ACCOUNT_ID}#requirement01#'),
+            (11, f'{ACCOUNT_ID}#requirement01#bucket-7'),
+            (12, f'{ACCOUNT_ID}#requirement01#bucket-8'),
+        ]
+        assert result.failures[0].error == 'Duplicate of row 2'
+        assert '12-digit' in result.failures[1].error
+        assert result.failures[2].error == 'Requirement not found: missing'
+        assert 'maxDurationInDays' in result.failures[3].error
+        assert result.failures[4].error == 'Missing resourceId'
+        assert 'Unable to parse datetime' in result.failures[5].error
+        assert 'Invalid form fields' in result.failures[6].error
+
+        written = [exclusion for call in batch_put_records.call_args_list for exclusion in call.args[0]]
+        assert [exclusion['resourceId'] for exclusion in written] == ['bucket-1', 'bucket-*', 'bucket-5', 'bucket-6']
+        assert written[0]['status'] == 'approved'
+        assert written[0]['formFields'] == {'reason': 'its fine'}
+        assert written[0]['rqrmntId_rsrceRegex'] == 'requirement01#bucket-1'
+        assert written[1]['hidesResources'] is False
+
+    @patch.object(exclusions_table, 'batch_put_records')
+    def test_import_exclusions_dry_run(self, batch_put_records: Mock):
+        result = bulk.import_exclusions([(2, create_row('bucket-1'))], sample_records.EXCLUSION_TYPES, REQUIREMENT_TYPES, dry_run=True)
+        assert result == bulk.ImportResult(1, 0, [])
+        batch_put_records.assert_not_called()
+
+    @patch.object(exclusions_table, 'put_item')
+    @patch.object(exclusions_table, 'batch_put_records', Mock(side_effect=RuntimeError('unprocessed items')))
+    def test_import_exclusions_write_error(self, put_item: Mock):
+        put_item.side_effect = [None, Exception('throttled')]
+        result = bulk.import_exclusions(
+            [(2, create_row('bucket-1')), (3, create_row('bucket-2'))], sample_records.EXCLUSION_TYPES, REQUIREMENT_TYPES
+        )
+        assert result.imported == 1
+        assert result.failures == [bulk.RowFailure(3, f'{ACCOUNT_ID}#requirement01#bucket-2', 'Unable to write: throttled')]
+
+
+class TestExportExclusions:
+    def test_export_import(self, tmp_path):
+        exclusion = {**sample_records.EXCLUSION_APPROVED, 'expirationDate': EXPIRATION_DATE}
+        for filename in [str(tmp_path / 'exclusions.csv'), str(tmp_path / 'exclusions.xlsx')]:
+            assert bulk.export_exclusions(filename, iter([exclusion]), ['reason']) == 1
+            rows = list(bulk.read_rows(filename))
+            imported = bulk.row_to_exclusion(rows[0][1], {})
+            for key in ['accountId', 'requirementId', 'resourceId', 'status', 'type', 'expirationDate', 'formFields', 'lastStatusChangeDate']:
+                assert imported[key] == exclusion[key]
+            assert imported['hidesResources'] is False
+
+    @patch.object(exclusions_table, 'batch_put_records')
+    def test_export_import_archived(self, batch_put_records: Mock, tmp_path):
+        # exported exclusions that expired or were archived long ago import again
+        archived = {**sample_records.EXCLUSION_ARCHIVED, 'resourceId': 'archived-bucket', 'expirationDate': '2000/01/01'}
+        exclusion_records = [{**sample_records.EXCLUSION_APPROVED, 'expirationDate': EXPIRATION_DATE}, archived]
+        requirement_types = {sample_records.EXCLUSION_APPROVED['requirementId']: 'exception'}
+        for filename in [str(tmp_path / 'exclusions.csv'), str(tmp_path / 'exclusions.xlsx')]:
+            assert bulk.export_exclusions(filename, iter(exclusion_records), ['reason']) == 2
+            result = bulk.import_exclusions(bulk.read_rows(filename), sample_records.EXCLUSION_TYPES, requirement_types)
+            assert result == bulk.ImportResult(2, 2, [])
+            written = batch_put_records.call_args.args[0]
+            assert [(exclusion['status'], exclusion['expirationDate']) for exclusion in written] == [
+                ('approved', EXPIRATION_DATE), ('archived', '2000/01/01')
+            ]
+
+    def test_write_failures(self, tmp_path):
+        filename = str(tmp_path / 'failures.csv')
+        bulk.write_failures(filename, [bulk.RowFailure(3, 'exclusion01', 'Duplicate of row 2')])
+        with open(filename) as csv_file:
+            assert csv_file.read().splitlines() == ['row,exclusionId,error', '3,exclusion01,Duplicate of row 2']
@@ -61,6 +61,12 @@ class TestExpirationDate:
         assert result is False
         assert message
 
+    def test_expiration_date_format(self):
+        assert validators.expiration_date_format({}, {'expirationDate': '2000/01/01'}, EXCEPTION, True) == (True, None)
+        result, message = validators.expiration_date_format({}, {'expirationDate': 'invalid-datetime'}, EXCEPTION, True)
+        assert result is False
+        assert message
+
 
 class TestResourceId:
     @patch.object(ncr_table, 'get_item', Mock(return_value={'Item': {'ncr':'resource'}}))
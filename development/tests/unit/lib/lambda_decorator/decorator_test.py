@@ -0,0 +1,25 @@
+import json
+from decimal import Decimal
+
+from lib.lambda_decorator import decorator
+from lib.lambda_decorator.decorator import api_decorator
+
+LARGE_RESULT = {'records': [{'id': str(i), 'score': Decimal(i)} for i in range(2000)]}
+
+
+@api_decorator
+def dummy_lambda_handler(event, context):
+    return event.get('result', LARGE_RESULT)
+
+
+def test_large_response():
+    # compression is left to api gateway, see MinimumCompressionSize in api.yaml
+    response = dummy_lambda_handler({'headers': {'Accept-Encoding': 'gzip, br'}}, {})
+    assert 'isBase64Encoded' not in response
+    assert 'Content-Encoding' not in response['headers']
+    assert json.loads(response['body']) == {'records': [{'id': str(i), 'score': i} for i in range(2000)]}
+
+
+def test_format_result():
+    assert decorator.format_result({'a': [Decimal(1), {'b': 'c'}]}) == '{"a": [1, {"b": "c"}]}'
+    assert decorator.format_result('text') == 'text'
@@ -74,3 +74,19 @@ class TestGetAllowedActions:
             'requestExclusion': False,
             'requestExclusionChange': False,
         }
+
+    @patch.object(authz, 'can_request_exclusion', Mock(return_value=(True, None)))
+    @patch.object(authz, 'can_remediate', Mock(return_value=(True, None)))
+    def test_memoized(self):
+        ncr_util.get_allowed_actions_for_permissions.cache_clear()
+        first = ncr_util.get_allowed_actions(sample_records.REGULAR_USER, '123123123123', {'remediation': True}, {})
+        first['remediate'] = 'mutated by caller'
+        second = ncr_util.get_allowed_actions(sample_records.REGULAR_USER, '123123123123', {'remediation': True}, {})
+        assert second == {
+            'remediate': True,
+            'requestExclusion': True,
+            'requestExclusionChange': False,
+        }
+        cache_info = ncr_util.get_allowed_actions_for_permissions.cache_info()
+        assert cache_info.misses == 1
+        assert cache_info.hits == 1
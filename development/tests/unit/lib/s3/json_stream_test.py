@@ -0,0 +1,25 @@
+import io
+import json
+
+from lib.s3 import json_stream
+
+
+class TestJsonStream:
+    def test_iter_values(self):
+        document = {
+            'resultsData': [{'title': 'one', 'tags': ['a', 'b']}, {'title': 'two', 'nested': {'list': [[1], [2]]}}],
+            'collectionData': {'aws': {'ec2': {'describeInstances': {'us-east-1': {'data': [1, 2]}}}, 'iam': {'listUsers': {}}}},
+            'count': 2,
+        }
+        body = io.BytesIO(json.dumps(document).encode('utf-8'))
+        values = list(json_stream.iter_values(body, ['resultsData.item', 'collectionData.aws.ec2.describeInstances', 'count']))
+        assert values == [
+            ('resultsData.item', {'title': 'one', 'tags': ['a', 'b']}),
+            ('resultsData.item', {'title': 'two', 'nested': {'list': [[1], [2]]}}),
+            ('collectionData.aws.ec2.describeInstances', {'us-east-1': {'data': [1, 2]}}),
+            ('count', 2),
+        ]
+
+    def test_iter_values_missing(self):
+        body = io.BytesIO(b'{"resultsData": []}')
+        assert list(json_stream.iter_values(body, ['resultsData.item', 'collectionData.aws.ec2.describeInstances'])) == []
@@ -0,0 +1,53 @@
+import datetime
+import gzip
+import io
+import json
+
+import pytest
+from botocore.stub import Stubber, ANY
+
+from lib.s3 import s3_buckets
+from lib.s3.s3_buckets import S3
+
+
+@pytest.fixture(scope='function')
+def s3_stubber():
+    with Stubber(S3) as stubber:
+        yield stubber
+
+
+class TestS3Buckets:
+    def test_get_fresh_object(self, s3_stubber):
+        response = {'Body': io.BytesIO(b'{}'), 'LastModified': datetime.datetime.now(datetime.timezone.utc)}
+        s3_stubber.add_response('get_object', response, {'Bucket': 'bucket', 'Key': 'key', 'IfModifiedSince': ANY})
+        assert s3_buckets.get_fresh_object('bucket', 'key', datetime.timedelta(hours=24)) == response
+        s3_stubber.assert_no_pending_responses()
+
+    def test_get_fresh_object_not_modified(self, s3_stubber):
+        s3_stubber.add_client_error('get_object', service_error_code='304', http_status_code=304)
+        with pytest.raises(Exception, match='s3 object too old, key: key, bucket: bucket'):
+            s3_buckets.get_fresh_object('bucket', 'key', datetime.timedelta(hours=24))
+
+    def test_get_fresh_object_stale(self, s3_stubber):
+        last_modified = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=25)
+        s3_stubber.add_response('get_object', {'Body': io.BytesIO(b'{}'), 'LastModified': last_modified})
+        with pytest.raises(Exception, match='s3 object too old'):
+            s3_buckets.get_fresh_object('bucket', 'key', datetime.timedelta(hours=24))
+
+    def test_get_fresh_object_error(self, s3_stubber):
+        s3_stubber.add_client_error('get_object', service_error_code='NoSuchKey', http_status_code=404)
+        with pytest.raises(S3.exceptions.NoSuchKey):
+            s3_buckets.get_fresh_object('bucket', 'key', datetime.timedelta(hours=24))
+
+    @pytest.mark.parametrize('key, response', [
+        ('latest.json.gz', {}),
+        ('latest.json', {'ContentEncoding': 'gzip'}),
+    ])
+    def test_open_body_gzip(self, key, response):
+        document = {'resultsData': [{'title': 'one'}]}
+        body = io.BytesIO(gzip.compress(json.dumps(document).encode('utf-8')))
+        assert json.load(s3_buckets.open_body({**response, 'Body': body}, key)) == document
+
+    def test_open_body(self):
+        body = io.BytesIO(b'{}')
+        assert s3_buckets.open_body({'Body': body}, 'latest.json') is body
@@ -0,0 +1,43 @@
+from unittest.mock import Mock, patch
+
+from lib.ttl_cache import TTLCache
+
+
+class TestTTLCache:
+    @patch('lib.ttl_cache.time.monotonic')
+    def test_expiration(self, mock_monotonic):
+        cache = TTLCache(60)
+        mock_monotonic.return_value = 100
+        cache.set('key', 'value')
+        mock_monotonic.return_value = 159
+        assert cache.get('key') == 'value'
+        mock_monotonic.return_value = 160
+        assert cache.get('key') is None
+
+    def test_eviction(self):
+        cache = TTLCache(60, maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')  # 'b' becomes least recently used
+        cache.set('c', 3)
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+        assert cache.get('c') == 3
+
+    def test_get_or_load(self):
+        cache = TTLCache(60)
+        loader = Mock(return_value=None)
+        assert cache.get_or_load('key', loader) is None
+        assert cache.get_or_load('key', loader) is None
+        loader.assert_called_once()
+        cache.invalidate('key')
+        cache.get_or_load('key', loader)
+        assert loader.call_count == 2
+
+    def test_disabled(self):
+        cache = TTLCache(0)
+        loader = Mock(return_value='value')
+        cache.get_or_load('key', loader)
+        cache.get_or_load('key', loader)
+        assert loader.call_count == 2
+        assert len(cache) == 0
@@ -3,17 +3,18 @@ import json
 import os
 from datetime import datetime
 from types import SimpleNamespace
-from unittest.mock import patch
+from unittest.mock import call, patch
 
 import pytest
 from boto3.dynamodb.conditions import Key
 from boto3.dynamodb.types import Decimal
-from botocore.stub import Stubber
+from botocore.stub import Stubber, ANY
 
 from lib.dynamodb import accounts_table, ncr_table, scans_table, scores_table
 from lib.dynamodb.scans import ScansTable
 from lib.s3.s3_buckets import S3
-from states.cloudsploit import cloudsploit_populate, cloudsploit_setup, cloudsploit_error
+from states import cloudsploit
+from states.cloudsploit import cloudsploit_populate, cloudsploit_setup, cloudsploit_error, load_results, index_results, get_findings, count_source_resources
 
 @pytest.fixture(scope='function')
 def s3_stubber():
@@ -59,6 +60,53 @@ def create_cloudsploit_s3_response(cs_data):
 
 
 class TestCloudSploitPopulate:
+    def test_load_results(self):
+        findings = [{'title': 'Plugin Name One', 'status': 'FAIL'}, {'title': 'Plugin Name Two', 'status': 'OK'}]
+        cs_data = create_cloudsploit_data({
+            'ec2': {
+                'describeInstances': {'us-east-1': {'data': [{'instance': 1}]}},
+                'describeVpcs': {'us-east-1': {'data': [{'vpc': 1}]}},
+            },
+            's3': {'listBuckets': {'us-east-1': {'err': 'access denied'}}},
+        }, findings)
+        result = load_results(io.BytesIO(json.dumps(cs_data).encode('utf-8')), {'ec2.describeInstances', 's3.listBuckets'})
+        assert result == {
+            'resultsData': findings,
+            'collectionData': {
+                'aws': {
+                    'ec2': {'describeInstances': {'us-east-1': {'data': [{'instance': 1}]}}},
+                    's3': {'listBuckets': {'us-east-1': {'err': 'access denied'}}},
+                },
+            },
+        }
+
+    def test_get_findings(self):
+        findings = [
+            {'title': 'one', 'status': 'WARN', 'resource': 'a'},
+            {'title': 'two', 'status': 'FAIL', 'resource': 'b'},
+            {'title': 'one', 'status': 'FAIL', 'resource': 'c'},
+            {'title': 'one', 'status': 'OK', 'resource': 'd'},
+            {'title': 'one', 'status': 'WARN', 'resource': 'e'},
+        ]
+        results_index = index_results(findings)
+        assert list(get_findings(results_index, ['one', 'two'], ['FAIL', 'WARN'])) == [findings[0], findings[2], findings[4], findings[1]]
+        assert list(get_findings(results_index, ['three'], ['FAIL'])) == []
+        assert sum(len(status_findings) for status_findings in results_index['one'].values()) == 4
+
+    def test_count_source_resources(self):
+        result = create_cloudsploit_data({
+            'ec2': {
+                'describeInstances': {
+                    'us-east-1': {'data': [{'instance': 1}, {'instance': 2}]},
+                    'us-west-2': {'data': [], 'err': 'region not enabled'},
+                },
+                'describeVpcs': {'us-east-1': {}},
+            },
+        }, [])
+        assert count_source_resources(result, 'ec2.describeInstances') == 2
+        with pytest.raises(RuntimeError):
+            count_source_resources(result, 'ec2.describeVpcs')
+
     @patch('lib.dynamodb.requirements_table.get_cloudsploit_based_requirements')
     def test_populate(self, get_cs_requirements, s3_stubber, regular_account):
         cs_data = create_cloudsploit_data({}, [
@@ -112,6 +160,7 @@ class TestCloudSploitPopulate:
         s3_stubber.add_response('get_object', create_cloudsploit_s3_response(cs_data), {
             'Bucket': os.getenv('CLOUDSPLOIT_RESULT_BUCKET'),
             'Key': os.getenv('CLOUDSPLOIT_PREFIX') + '/' + regular_account['accountId'] + '/latest.json',
+            'IfModifiedSince': ANY,
         })
         scan_id = scans_table.create_new_scan_id()
 
@@ -203,6 +252,7 @@ class TestCloudSploitPopulate:
         s3_stubber.add_response('get_object', create_cloudsploit_s3_response(cs_data), {
             'Bucket': os.getenv('CLOUDSPLOIT_RESULT_BUCKET'),
             'Key': os.getenv('CLOUDSPLOIT_PREFIX') + '/' + regular_account['accountId'] + '/latest.json',
+            'IfModifiedSince': ANY,
         })
         scan_id = scans_table.create_new_scan_id()
 
@@ -274,6 +324,7 @@ class TestCloudSploitPopulate:
         s3_stubber.add_response('get_object', create_cloudsploit_s3_response(cs_data), {
             'Bucket': os.getenv('CLOUDSPLOIT_RESULT_BUCKET'),
             'Key': os.getenv('CLOUDSPLOIT_PREFIX') + '/' + special_account['accountId'] + '/latest.json',
+            'IfModifiedSince': ANY,
         })
         scan_id = scans_table.create_new_scan_id()
 
@@ -304,6 +355,41 @@ class TestCloudSploitPopulate:
         ]
 
 
+class TestCloudSploitPopulateBatch:
+    context = SimpleNamespace(function_name='function-name')
+
+    @patch.object(scans_table, 'add_error')
+    @patch.object(scores_table, 'batch_write_items')
+    @patch.object(ncr_table, 'batch_write_items')
+    @patch.object(cloudsploit, 'populate_account')
+    @patch('lib.dynamodb.requirements_table.get_cloudsploit_based_requirements')
+    @patch.object(accounts_table, 'get_accounts')
+    def test_populate_batch(self, get_accounts, get_cs_requirements, populate_account, ncr_batch_write, scores_batch_write, add_error):
+        requirement = {'requirementId': '10', 'weight': Decimal(100), 'severity': 'medium', 'cloudsploit': {'finding': 'Plugin Name One'}}
+        get_cs_requirements.return_value = [requirement]
+        get_accounts.return_value = {'1': {'accountId': '1'}, '2': {'accountId': '2'}}
+
+        def populate(scan_id, account, requirements):
+            if account['accountId'] == '2':
+                raise RuntimeError('bad results')
+            return [{'ncr': account['accountId']}], [{'score': account['accountId']}]
+        populate_account.side_effect = populate
+
+        cloudsploit.cloudsploit_populate_batch({'scanId': 'scan', 'accountIds': ['1', None, '2', '3']}, self.context)
+
+        get_accounts.assert_called_once_with(['1', '2', '3'])
+        get_cs_requirements.assert_called_once()
+        ncr_batch_write.assert_called_once_with(put_items=[{'ncr': '1'}])
+        assert scores_batch_write.call_args_list == [
+            call(put_items=[{'score': '1'}]),
+            call(put_items=[
+                scores_table.new_score('scan', '2', requirement, scores_table.DATA_NOT_COLLECTED, scores_table.DATA_NOT_COLLECTED),
+                scores_table.new_score('scan', '3', requirement, scores_table.DATA_NOT_COLLECTED, scores_table.DATA_NOT_COLLECTED),
+            ]),
+        ]
+        assert [call_args[0][2]['accountId'] for call_args in add_error.call_args_list] == ['2', '3']
+
+
 class TestCloudSploitSetup():
     event = {
         'accountId': '100',
@@ -505,3 +591,28 @@ class TestCloudSploitError():
             }]
         }
         assert scans_table.get_item(Key={'scan': ScansTable.SCAN, 'scanId': scan_id})['Item'] == expected_results
+
+    @patch.object(scans_table, 'add_error')
+    @patch.object(scores_table, 'batch_put_records')
+    @patch.object(scores_table, 'has_account_scores')
+    @patch.object(accounts_table, 'get_accounts')
+    @patch('lib.dynamodb.requirements_table.get_cloudsploit_based_requirements')
+    def test_batch_error_skips_populated_accounts(self, get_cs_requirements, get_accounts, has_account_scores, batch_put_records, add_error):
+        requirement = {'requirementId': '10', 'weight': Decimal(100), 'severity': 'medium', 'cloudsploit': {'finding': 'Plugin Name One'}}
+        get_cs_requirements.return_value = [requirement]
+        get_accounts.side_effect = lambda account_ids: {account_id: {'accountId': account_id} for account_id in account_ids}
+        has_account_scores.side_effect = lambda scan_id, account_id: account_id == '1'
+        event = {'scanId': 'scan', 'accountIds': ['1', None, '2'], 'error': {'Error': 'States.Timeout'}}
+
+        cloudsploit_error(event, self.context)
+
+        batch_put_records.assert_called_once_with([
+            scores_table.new_score('scan', '2', requirement, scores_table.DATA_NOT_COLLECTED, scores_table.DATA_NOT_COLLECTED),
+        ])
+        add_error.assert_called_once_with('scan', 'function-name', {'Error': 'States.Timeout'})
+
+        has_account_scores.side_effect = None
+        has_account_scores.return_value = True
+        add_error.reset_mock()
+        cloudsploit_error(event, self.context)
+        add_error.assert_not_called()
@@ -0,0 +1,153 @@
+"""
+unit test for app/states/rescore.py
+"""
+import json
+from unittest.mock import patch, Mock
+
+from boto3.dynamodb.types import Decimal
+
+from lib.dynamodb import account_scores_table, accounts_table, exclusions_table, ncr_table, scores_table
+from states import rescore
+from tests.unit.api.test_setup_resources import sample_records
+
+SCAN_ID = '2020-06-15T00:00:00#abcdefgh'
+ACCOUNT_ID = '123123123123'
+REQUIREMENT = {'requirementId': 'requirement01', 'severity': 'high', 'weight': Decimal(100)}
+
+
+def create_ncr(resource_id):
+    return ncr_table.new_ncr_record({'accountId': ACCOUNT_ID, 'resourceId': resource_id, 'requirementId': REQUIREMENT['requirementId']}, SCAN_ID)
+
+
+def create_exclusion(resource_id, status='approved'):
+    return {
+        'accountId': ACCOUNT_ID,
+        'requirementId': REQUIREMENT['requirementId'],
+        'resourceId': resource_id,
+        'rqrmntId_rsrceRegex': f'{REQUIREMENT["requirementId"]}#{resource_id}',
+        'status': status,
+        'type': 'exception',
+        'expirationDate': '2999/12/31',
+    }
+
+
+class TestRescore:
+    @patch.object(rescore, 'SPREADSHEETS_FUNCTION', 'spreadsheets-function')
+    @patch.object(rescore.lambda_client, 'invoke')
+    @patch.object(account_scores_table, 'batch_put_records')
+    @patch.object(account_scores_table, 'get_histories', Mock(return_value={}))
+    @patch.object(account_scores_table, 'get_item')
+    @patch.object(scores_table, 'get_account_scores')
+    @patch.object(scores_table, 'batch_put_records')
+    @patch.object(scores_table, 'get_score')
+    @patch.object(ncr_table, 'batch_put_records')
+    @patch.object(exclusions_table, 'query_all')
+    @patch.object(ncr_table, 'get_all_account_ncrs_by_requirement_id')
+    def test_rescore_exclusions(self, get_ncrs, query_exclusions, put_ncrs, get_score, put_scores, get_account_scores,
+                                get_account_score, put_account_scores, invoke):
+        excluded_ncr, other_ncr = create_ncr('bucket-1'), create_ncr('other')
+        get_ncrs.return_value = [excluded_ncr, other_ncr]
+        exclusion = create_exclusion('bucket-*')
+        def account_exclusions(**kwargs):
+            account_condition = kwargs['KeyConditionExpression'].get_expression()['values'][0]
+            return [exclusion] if account_condition.get_expression()['values'][1] == ACCOUNT_ID else []
+        query_exclusions.side_effect = account_exclusions
+        score = scores_table.new_score(SCAN_ID, ACCOUNT_ID, REQUIREMENT, Decimal(5), Decimal(2))
+        get_score.return_value = score
+        get_account_scores.return_value = [score]
+        get_account_score.return_value = {'Item': {'accountId': ACCOUNT_ID, 'date': SCAN_ID[0:10], 'scanId': SCAN_ID, 'score': {}}}
+
+        result = rescore.rescore_exclusions(SCAN_ID, [exclusion], sample_records.EXCLUSION_TYPES)
+
+        assert result == rescore.RescoreResult(1, 1, [ACCOUNT_ID])
+        put_ncrs.assert_called_once_with([excluded_ncr])
+        assert excluded_ncr['exclusionApplied'] is True
+        assert excluded_ncr['exclusion'] == exclusion
+        assert 'exclusion' not in other_ncr
+        get_score.assert_called_once_with(SCAN_ID, ACCOUNT_ID, REQUIREMENT['requirementId'])
+        assert put_scores.call_args.args[0][0]['score']['high']['numFailing'] == 1
+
+        account_scores = put_account_scores.call_args.args[0]
+        assert account_scores[0]['score']['high'] == {'weight': Decimal(100), 'numFailing': 1, 'numResources': 5}
+        assert account_scores[1]['date'] == account_scores_table.HISTORY
+        assert account_scores[1]['daily'][0]['score'] == 100
+        assert invoke.call_args.kwargs['FunctionName'] == 'spreadsheets-function'
+        assert json.loads(invoke.call_args.kwargs['Payload']) == {'openScan': {'scanId': SCAN_ID}, 'accountId': ACCOUNT_ID, 'refresh': True}
+
+    @patch.object(rescore, 'queue_spreadsheets')
+    @patch.object(account_scores_table, 'batch_put_records')
+    @patch.object(scores_table, 'batch_put_records')
+    @patch.object(scores_table, 'get_score')
+    @patch.object(ncr_table, 'batch_put_records')
+    @patch.object(exclusions_table, 'query_all', Mock(return_value=[]))
+    @patch.object(ncr_table, 'get_all_account_ncrs_by_requirement_id')
+    def test_rescore_deleted_exclusion(self, get_ncrs, put_ncrs, get_score, put_scores, put_account_scores, queue_spreadsheets):
+        exclusion = create_exclusion('bucket-1')
+        excluded_ncr = create_ncr('bucket-1')
+        excluded_ncr.update({'exclusion': exclusion, 'exclusionApplied': True, 'isHidden': False})
+        get_ncrs.return_value = [excluded_ncr]
+        get_score.return_value = scores_table.new_score(SCAN_ID, ACCOUNT_ID, REQUIREMENT, scores_table.DATA_NOT_COLLECTED, scores_table.DATA_NOT_COLLECTED)
+
+        result = rescore.rescore_exclusions(SCAN_ID, [exclusion], sample_records.EXCLUSION_TYPES)
+
+        assert result == rescore.RescoreResult(1, 0, [])
+        put_ncrs.assert_called_once_with([excluded_ncr])
+        assert excluded_ncr['exclusionApplied'] is False
+        assert 'exclusion' not in excluded_ncr
+        # scores of data not collected are left as they are
+        put_scores.assert_called_once_with([])
+        put_account_scores.assert_called_once_with([])
+        queue_spreadsheets.assert_called_once_with(SCAN_ID, [])
+
+    def test_resource_matcher(self):
+        matches_resource = rescore.resource_matcher([create_exclusion('bucket-*'), create_exclusion('role-?')])
+        assert matches_resource('bucket-1')
+        assert matches_resource('role-a')
+        assert not matches_resource('role-ab')
+        assert not matches_resource('my-bucket-1')
+
+    @patch.object(ncr_table, 'get_shards', Mock(return_value=4))
+    def test_get_partition_keys(self):
+        exclusion = create_exclusion('bucket-*')
+        assert rescore.get_partition_keys(SCAN_ID, [exclusion, {}]) == [ncr_table.partition_key(SCAN_ID, ACCOUNT_ID)]
+        assert rescore.get_partition_keys(SCAN_ID, [exclusion, {**exclusion, 'accountId': '*'}]) == [f'{SCAN_ID}#{shard}' for shard in range(4)]
+
+    @patch.object(ncr_table, 'get_shards', Mock(return_value=4))
+    @patch.object(ncr_table, 'get_all_account_ncrs_by_requirement_id')
+    @patch.object(ncr_table, 'query_all')
+    def test_get_requirement_ncrs_partition(self, query_all, get_ncrs):
+        partition_key = ncr_table.partition_key(SCAN_ID, ACCOUNT_ID)
+        rescore.get_requirement_ncrs(SCAN_ID, REQUIREMENT['requirementId'], {'*'}, partition_key)
+        assert query_all.call_args.kwargs['IndexName'] == 'by-scanId'
+        assert query_all.call_args.kwargs['ExpressionAttributeValues'] == {':v0': partition_key, ':v1': f'{REQUIREMENT["requirementId"]}#'}
+
+        other_account_id = next(str(account) for account in range(100) if ncr_table.partition_key(SCAN_ID, str(account)) != partition_key)
+        rescore.get_requirement_ncrs(SCAN_ID, REQUIREMENT['requirementId'], {ACCOUNT_ID, other_account_id}, partition_key)
+        get_ncrs.assert_called_once_with(SCAN_ID, ACCOUNT_ID, REQUIREMENT['requirementId'])
+
+    @patch.object(ncr_table, 'get_shards', Mock(return_value=1))
+    @patch.object(ncr_table, 'get_all_account_ncrs_by_requirement_id')
+    @patch.object(ncr_table, 'query_all')
+    def test_get_requirement_ncrs_accounts(self, query_all, get_ncrs):
+        # the ncrs of wildcard exclusions are queried per account when the accounts are given
+        rescore.get_requirement_ncrs(SCAN_ID, REQUIREMENT['requirementId'], {'*'}, SCAN_ID, ['111111111111', ACCOUNT_ID])
+        query_all.assert_not_called()
+        assert [call.args[1] for call in get_ncrs.call_args_list] == ['111111111111', ACCOUNT_ID]
+
+        get_ncrs.reset_mock()
+        rescore.get_requirement_ncrs(SCAN_ID, REQUIREMENT['requirementId'], {ACCOUNT_ID, '999999999999'}, SCAN_ID, ['111111111111', ACCOUNT_ID])
+        get_ncrs.assert_called_once_with(SCAN_ID, ACCOUNT_ID, REQUIREMENT['requirementId'])
+
+    @patch.object(accounts_table, 'scan_all', Mock(return_value=[{'accountId': '222222222222'}, {'accountId': '111111111111'}]))
+    def test_get_account_ids(self):
+        exclusion = create_exclusion('bucket-*')
+        assert rescore.get_account_ids([exclusion, {}]) == [ACCOUNT_ID]
+        assert rescore.get_account_ids([exclusion, {**exclusion, 'accountId': '*'}]) == ['111111111111', '222222222222']
+
+    @patch.object(exclusions_table, 'query_all')
+    def test_get_requirement_exclusions(self, query_all):
+        query_all.side_effect = lambda **kwargs: [exclusions_table.build_expressions(**kwargs)['ExpressionAttributeValues']]
+        # the wildcard account and each account are queried, rather than scanning the table
+        assert rescore.get_requirement_exclusions(REQUIREMENT['requirementId'], {'222', '111', '*'}) == [
+            {':v0': account_id, ':v1': f'{REQUIREMENT["requirementId"]}#'} for account_id in ['*', '111', '222']
+        ]
@@ -20,41 +20,43 @@ EVENT = {
     'error': 'test-error'
 }
 
-DESIRED_OUTPUT = [
-    scores_table.new_score(
-        SCAN_ID,
-        '111',
-        {
-            'requirementId': '1',
-            'severity': 'high',
-            'weight': Decimal(1000),
-        },
-        scores_table.DATA_NOT_COLLECTED,
-        scores_table.DATA_NOT_COLLECTED,
-    ),
-    scores_table.new_score(
-        SCAN_ID,
-        '222',
-        {
-            'requirementId': '1',
-            'severity': 'high',
-            'weight': Decimal(1000),
-        },
-        scores_table.DATA_NOT_COLLECTED,
-        scores_table.DATA_NOT_COLLECTED,
-    ),
-    scores_table.new_score(
-        SCAN_ID,
-        '333',
-        {
-            'requirementId': '1',
-            'severity': 'high',
-            'weight': Decimal(1000),
-        },
-        scores_table.DATA_NOT_COLLECTED,
-        scores_table.DATA_NOT_COLLECTED,
-    ),
-]
+def get_desired_output():
+    # built when the test runs, scores look up the shards of the scan in the scans table
+    return [
+        scores_table.new_score(
+            SCAN_ID,
+            '111',
+            {
+                'requirementId': '1',
+                'severity': 'high',
+                'weight': Decimal(1000),
+            },
+            scores_table.DATA_NOT_COLLECTED,
+            scores_table.DATA_NOT_COLLECTED,
+        ),
+        scores_table.new_score(
+            SCAN_ID,
+            '222',
+            {
+                'requirementId': '1',
+                'severity': 'high',
+                'weight': Decimal(1000),
+            },
+            scores_table.DATA_NOT_COLLECTED,
+            scores_table.DATA_NOT_COLLECTED,
+        ),
+        scores_table.new_score(
+            SCAN_ID,
+            '333',
+            {
+                'requirementId': '1',
+                'severity': 'high',
+                'weight': Decimal(1000),
+            },
+            scores_table.DATA_NOT_COLLECTED,
+            scores_table.DATA_NOT_COLLECTED,
+        ),
+    ]
 
 def test_many_accounts():
     """
@@ -82,7 +84,7 @@ def test_many_accounts():
         assert record.pop('ttl')
 
     sorted_handler_output = sorted(records_in_db, key=lambda k: k['accountId'])
-    sorted_desired_output = sorted(DESIRED_OUTPUT, key=lambda k: k['accountId'])
+    sorted_desired_output = sorted(get_desired_output(), key=lambda k: k['accountId'])
 
     assert sorted_handler_output == sorted_desired_output
 
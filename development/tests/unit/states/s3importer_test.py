@@ -39,12 +39,12 @@ def create_s3_data(account_ids, resource_count, req_id):
                     'accountId': account_id,
                     'accountName': str(account_id) + '_account_name',
                     'requirementId': req_id,
-                    'resourceId': ''.join(random.choice(['a', 'b', 'c', 'd']) for _ in range(5)),
+                    'resourceId': ''.join(random.choice(['a', 'b', 'c', 'd']) for _ in range(5)) + str(index),
                     'resourceType': 'ec2',
                     'region': 'us-east-2',
                     'reason': 'no_reason'
                 }
-                for _ in range(resource_count - 1)  # there is always 1 passing resource
+                for index in range(resource_count - 1)  # there is always 1 passing resource
             ]
         }
         for account_id in account_ids
@@ -93,7 +93,8 @@ class TestS3Importer:
         s3_stubber.add_response('get_object', create_s3_response(s3_data),
                                 {
                                     'Bucket': ANY,
-                                    'Key': s3_key
+                                    'Key': s3_key,
+                                    'IfModifiedSince': ANY,
                                 })
 
         s3import_handler(event, {})
@@ -144,7 +145,7 @@ class TestS3Importer:
         get_item.return_value = {
             'Item': s3_import_requirement
         }
-        s3_stubber.add_response('get_object', create_s3_response(s3_data), {'Bucket': ANY, 'Key': s3_key})
+        s3_stubber.add_response('get_object', create_s3_response(s3_data), {'Bucket': ANY, 'Key': s3_key, 'IfModifiedSince': ANY})
 
         s3import_handler(event, {})
 
@@ -162,3 +163,76 @@ class TestS3Importer:
             s3_import_requirement,
             Decimal(2),
         )]
+
+    @patch.object(scores_table, 'batch_put_records')
+    @patch.object(ncr_table, 'batch_put_records')
+    @patch('lib.dynamodb.requirements_table.get_item')
+    def test_s3importer_reconciliation(self, get_item, ncr_batch_put, scores_batch_put, s3_stubber):
+        s3_key = 'sample key'
+        requirement_id = '100'
+        event = {
+            'scanId': 'scan',
+            'requirementId': requirement_id,
+            'accountIds': ['1', '2', '3', '4'],
+        }
+        s3_import_requirement = create_s3import_requirement(requirement_id, 'critical', s3_key)
+        get_item.return_value = {'Item': s3_import_requirement}
+        s3_stubber.add_response('get_object', create_s3_response(create_s3_data(('3', '1', '5'), 3, requirement_id)))
+
+        with patch('states.s3importer.NCR_WRITE_BATCH_SIZE', 4):
+            s3import_handler(event, {})
+
+        assert [len(call[0][0]) for call in ncr_batch_put.call_args_list] == [4, 2]
+        scores = scores_batch_put.call_args[0][0]
+        assert [score['accountId'] for score in scores] == ['3', '1', '5', '2', '4']
+        assert scores[-1] == scores_table.new_score(
+            'scan', '4', s3_import_requirement, scores_table.DATA_NOT_COLLECTED, scores_table.DATA_NOT_COLLECTED)
+
+    @patch.object(scores_table, 'batch_put_records')
+    @patch.object(ncr_table, 'batch_put_records')
+    @patch('lib.dynamodb.requirements_table.get_item')
+    def test_s3importer_grouped(self, get_item, ncr_batch_put, scores_batch_put, s3_stubber):
+        s3_key = 'shared key'
+        requirements = {
+            requirement_id: create_s3import_requirement(requirement_id, 'high', s3_key) for requirement_id in ['100', '200', '300']
+        }
+        requirements['300']['ignore'] = True
+        get_item.side_effect = lambda Key: {'Item': requirements[Key['requirementId']]}
+        event = {
+            'scanId': 'scan',
+            'requirementIds': ['100', '200', '300'],
+            'accountIds': ['1', '2'],
+        }
+        s3_data = create_s3_data(('1',), 2, 'import requirement')
+        s3_stubber.add_response('get_object', create_s3_response(s3_data), {'Bucket': ANY, 'Key': s3_key, 'IfModifiedSince': ANY})
+
+        s3import_handler(event, {})
+
+        s3_stubber.assert_no_pending_responses()
+        ncrs = ncr_batch_put.call_args[0][0]
+        assert [ncr['requirementId'] for ncr in ncrs] == ['100', '200']
+        assert all(ncr['resourceId'] == s3_data['1']['failingResources'][0]['resourceId'] for ncr in ncrs)
+        scores = scores_batch_put.call_args[0][0]
+        assert [(score['accountId'], score['requirementId']) for score in scores] == [('1', '100'), ('1', '200'), ('2', '100'), ('2', '200')]
+
+    @patch.object(scores_table, 'batch_put_records')
+    @patch.object(ncr_table, 'batch_put_records')
+    @patch('lib.dynamodb.requirements_table.get_item')
+    def test_s3importer_duplicate_account(self, get_item, ncr_batch_put, scores_batch_put, s3_stubber):
+        requirement_id = '100'
+        get_item.return_value = {'Item': create_s3import_requirement(requirement_id, 'high', 'sample key')}
+        first, second = create_s3_data(('1',), 3, requirement_id)['1'], create_s3_data(('1',), 2, requirement_id)['1']
+        second['failingResources'][0]['resourceId'] = 'other-resource'
+        second['failingResources'].append({**first['failingResources'][0], 'reason': 'changed'})
+        # a json object can hold the same key twice, json.dumps can't write it
+        s3_body = f'{{"1": {json.dumps(first)}, "1": {json.dumps(second)}}}'
+        s3_stubber.add_response('get_object', {'Body': io.StringIO(s3_body), 'LastModified': datetime.now()})
+
+        s3import_handler({'scanId': 'scan', 'requirementId': requirement_id, 'accountIds': ['1']}, {})
+
+        # a batch write can't hold the same key twice, the last record of a key is kept
+        ncrs = ncr_batch_put.call_args[0][0]
+        assert len({ncr['accntId_rsrceId_rqrmntId'] for ncr in ncrs}) == len(ncrs) == 3
+        assert next(ncr for ncr in ncrs if ncr['resourceId'] == first['failingResources'][0]['resourceId'])['reason'] == 'changed'
+        scores = scores_batch_put.call_args[0][0]
+        assert [(score['accountId'], score['score']['high']['numResources']) for score in scores] == [('1', 2)]